@@ -350,6 +350,17 @@ of the choice of plugin.
         the dependencies of this part. This might be useful if one knows these
         dependencies will be satisfied in other manner, e.g. via content
         sharing from other snaps.
+
+      - incremental:
+        Keep the build directory of this part between builds, only bringing
+        in the changes to its source, so that build tools can skip the work
+        that is already done. `snapcraft clean` still removes it.
+
+      - ccache:
+        Cache what the compilers of this part produce with ccache, which is
+        added to the build-packages. The cache is shared by all projects and
+        kept under 5G unless CCACHE_MAXSIZE says otherwise. The hits and
+        misses of the build are reported when it ends.
 """
 
 from collections import OrderedDict                 # noqa
@@ -18,7 +18,7 @@ import contextlib
 import logging
 import os
 
-from snapcraft.internal import common
+from snapcraft.internal import common, jobserver
 
 
 logger = logging.getLogger(__name__)
@@ -182,6 +182,18 @@ class BasePlugin:
         else:
             return self.project.parallel_build_count
 
+    @property
+    def parallel_build_args(self):
+        """Arguments giving make the number of jobs to build with.
+
+        When the build environment hands make the jobserver shared by all
+        the parts, make takes its jobs from there and is given none.
+        """
+        count = self.parallel_build_count
+        if count > 1 and jobserver.get():
+            return []
+        return ['-j{}'.format(count)]
+
     # Helpers
     def run(self, cmd, cwd=None, **kwargs):
         if not cwd:
@@ -26,6 +26,7 @@ from snapcraft.internal.errors import SnapcraftEnvironmentError
 
 logger = logging.getLogger(__name__)
 
+_DEFAULT_JOB_MEMORY = 1024
 
 _ARCH_TRANSLATIONS = {
     'armv7l': {
@@ -121,6 +122,16 @@ class ProjectOptions:
 
         return build_count
 
+    @property
+    def jobs(self):
+        """Number of part steps the lifecycle may run concurrently."""
+        return self.__jobs
+
+    @property
+    def job_memory(self):
+        """Memory each build job is expected to use, in MiB."""
+        return self.__job_memory
+
     @property
     def is_cross_compiling(self):
         return self.__target_machine != self.__platform_arch
@@ -174,17 +185,25 @@ class ProjectOptions:
     def snap_dir(self):
         return os.path.join(self.__project_dir, 'prime')
 
+    @property
+    def trace_file(self):
+        return self.__trace_file
+
     @property
     def debug(self):
         return self.__debug
 
     def __init__(self, use_geoip=False, parallel_builds=True,
-                 target_deb_arch=None, debug=False):
+                 target_deb_arch=None, debug=False, jobs=1,
+                 trace_file=None, job_memory=None):
         # TODO: allow setting a different project dir and check for
         #       snapcraft.yaml
         self.__project_dir = os.getcwd()
         self.__use_geoip = use_geoip
         self.__parallel_builds = parallel_builds
+        self.__jobs = jobs
+        self.__trace_file = trace_file
+        self.__job_memory = job_memory or _DEFAULT_JOB_MEMORY
         self._set_machine(target_deb_arch)
         self.__debug = debug
 
@@ -14,11 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 from contextlib import contextmanager
+import fcntl
 import hashlib
 import logging
 import os
 import shutil
+from stat import S_ISREG
 import subprocess
 import sys
 
@@ -87,37 +90,154 @@ def link_or_copy(source, destination, follow_symlinks=False):
     """Hard-link source and destination files. Copy if it fails to link.
 
     Hard-linking may fail (e.g. a cross-device link, or permission denied), so
-    as a backup plan we just copy it.
+    as a backup plan the file is cloned or copied in the cheapest way the
+    filesystems allow, see get_copy_stats().
 
     :param str source: The source to which destination will be linked.
     :param str destination: The destination to be linked to source.
     :param bool follow_symlinks: Whether or not symlinks should be followed.
     """
 
-    try:
-        # Note that follow_symlinks doesn't seem to work for os.link, so we'll
-        # implement this logic ourselves using realpath.
-        source_path = source
-        if follow_symlinks:
-            source_path = os.path.realpath(source)
+    # Note that follow_symlinks doesn't seem to work for os.link, so we'll
+    # implement this logic ourselves using realpath.
+    source_path = source
+    if follow_symlinks:
+        source_path = os.path.realpath(source)
 
-        if not os.path.exists(os.path.dirname(destination)):
+    destination_dir = os.path.dirname(destination)
+    try:
+        if not os.path.exists(destination_dir):
             create_similar_directory(
-                os.path.dirname(source_path),
-                os.path.dirname(destination))
+                os.path.dirname(source_path), destination_dir)
         # Setting follow_symlinks=False in case this bug is ever fixed
         # upstream-- we want this function to continue supporting NOT following
         # symlinks.
         os.link(source_path, destination, follow_symlinks=False)
+        _copy_stats['link'] += 1
+        return
     except OSError:
+        pass
+
+    clone_or_copy(source, destination, follow_symlinks=follow_symlinks)
+
+
+def clone_or_copy(source, destination, follow_symlinks=False):
+    """Copy source to destination, sharing its data where possible.
+
+    The data is cloned or copied in the cheapest way the filesystems allow,
+    see get_copy_stats(). Unlike with link_or_copy, destination never is
+    the same file as source, so either can be changed in place without
+    affecting the other.
+
+    :param str source: The file to copy.
+    :param str destination: Where to copy it, or a directory to copy it into.
+    :param bool follow_symlinks: Whether or not symlinks should be followed.
+    """
+
+    # Like shutil.copy2, copy into destination if it is a directory.
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    destination_dir = os.path.dirname(destination)
+
+    stat = os.stat(source, follow_symlinks=follow_symlinks)
+    if S_ISREG(stat.st_mode):
+        _copy_file(source, destination, stat, destination_dir)
+        shutil.copystat(source, destination, follow_symlinks=follow_symlinks)
+    else:
+        # Symlinks and special files are left to shutil.
         shutil.copy2(source, destination, follow_symlinks=follow_symlinks)
-        uid = os.stat(source, follow_symlinks=follow_symlinks).st_uid
-        gid = os.stat(source, follow_symlinks=follow_symlinks).st_gid
-        try:
-            os.chown(destination, uid, gid, follow_symlinks=follow_symlinks)
-        except PermissionError as e:
-            logger.debug('Unable to chown {destination}: {error}'.format(
-                destination=destination, error=e))
+        _copy_stats['copy'] += 1
+    try:
+        os.chown(destination, stat.st_uid, stat.st_gid,
+                 follow_symlinks=follow_symlinks)
+    except PermissionError as e:
+        logger.debug('Unable to chown {destination}: {error}'.format(
+            destination=destination, error=e))
+
+
+def get_copy_stats():
+    """Return how many files link_or_copy placed with each strategy.
+
+    The strategies are 'link', 'reflink', 'copy_file_range', 'sendfile'
+    and 'copy', in the order they are tried.
+    """
+
+    return dict(_copy_stats)
+
+
+def _reflink(source_fd, destination_fd, size):
+    fcntl.ioctl(destination_fd, _FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd, destination_fd, size):
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(source_fd, destination_fd, size - offset)
+        if not copied:
+            break
+        offset += copied
+
+
+def _sendfile(source_fd, destination_fd, size):
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(destination_fd, source_fd, offset, size - offset)
+        if not sent:
+            break
+        offset += sent
+
+
+def _userspace_copy(source_fd, destination_fd, size):
+    with open(source_fd, 'rb', closefd=False) as source_file, \
+            open(destination_fd, 'wb', closefd=False) as destination_file:
+        shutil.copyfileobj(source_file, destination_file)
+
+
+_FICLONE = 0x40049409
+_COPY_STRATEGIES = [('reflink', _reflink)]
+if hasattr(os, 'copy_file_range'):
+    _COPY_STRATEGIES.append(('copy_file_range', _copy_file_range))
+if hasattr(os, 'sendfile'):
+    _COPY_STRATEGIES.append(('sendfile', _sendfile))
+_COPY_STRATEGIES.append(('copy', _userspace_copy))
+
+# The first strategy that worked, by (source device, destination device).
+_copy_strategies = {}
+_copy_stats = collections.Counter()
+
+
+def _copy_file(source, destination, stat, destination_dir):
+    try:
+        if os.path.samestat(stat, os.stat(destination)):
+            raise shutil.SameFileError(
+                '{!r} and {!r} are the same file'.format(source, destination))
+    except FileNotFoundError:
+        pass
+
+    devices = (stat.st_dev, os.stat(destination_dir or '.').st_dev)
+    first = _copy_strategies.get(devices, 0)
+
+    with open(source, 'rb') as source_file, \
+            open(destination, 'wb') as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+        for index in range(first, len(_COPY_STRATEGIES)):
+            name, strategy = _COPY_STRATEGIES[index]
+            try:
+                strategy(source_fd, destination_fd, stat.st_size)
+            except OSError as e:
+                if index == len(_COPY_STRATEGIES) - 1:
+                    raise
+                logger.debug('Unable to {} {} to {}: {}'.format(
+                    name, source, destination, e))
+                # Start over in case some data made it through.
+                os.ftruncate(destination_fd, 0)
+                os.lseek(destination_fd, 0, os.SEEK_SET)
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                continue
+            _copy_strategies[devices] = index
+            _copy_stats[name] += 1
+            return
 
 
 def link_or_copy_tree(source_tree, destination_tree,
@@ -165,6 +285,128 @@ def link_or_copy_tree(source_tree, destination_tree,
             copy_function(source, destination)
 
 
+def sync_tree(source_tree, destination_tree, *, ignore=None,
+              copy_function=link_or_copy, delete=None):
+    """Make destination_tree a mirror of source_tree, like rsync --delete.
+
+    Only the entries that differ are changed. Files are taken to be the same
+    if they are the same inode, or if they have the same size, mode and
+    modification time. Symlinks are kept as symlinks.
+
+    :param str source_tree: Source directory to be mirrored.
+    :param str destination_tree: Destination directory. Anything else in
+                                 its place is removed first.
+    :param callable ignore: Called with a directory and the names in it,
+                            returns the names to leave out, as for
+                            shutil.copytree.
+    :param callable copy_function: Function used to copy files.
+    :param callable delete: Called with the path of each destination entry
+                            missing from the source, returns whether to
+                            remove it. All of them are removed by default.
+    :returns: the number of entries added, updated or removed.
+    """
+
+    # The destination may be within the source, it is not part of it.
+    parent, name = os.path.split(os.path.abspath(destination_tree))
+
+    def ignore_destination(directory, names):
+        ignored = list(ignore(directory, names)) if ignore else []
+        if os.path.abspath(directory) == parent:
+            ignored.append(name)
+        return ignored
+
+    tree_sync = _TreeSync(ignore_destination, copy_function, delete)
+
+    changes = 0
+    if (os.path.islink(destination_tree) or
+            os.path.exists(destination_tree) and
+            not os.path.isdir(destination_tree)):
+        os.remove(destination_tree)
+        changes += 1
+    if os.path.isdir(destination_tree):
+        return changes + tree_sync.sync_directory(source_tree,
+                                                  destination_tree)
+
+    os.makedirs(destination_tree)
+    changes += tree_sync.sync_directory(source_tree, destination_tree)
+    shutil.copystat(source_tree, destination_tree)
+    return changes + 1
+
+
+class _TreeSync:
+
+    def __init__(self, ignore, copy_function, delete):
+        self._ignore = ignore
+        self._copy_function = copy_function
+        self._delete = delete
+
+    def sync_directory(self, source, destination):
+        source_entries = {e.name: e for e in os.scandir(source)}
+        for name in self._ignore(source, list(source_entries)):
+            source_entries.pop(name, None)
+
+        changes = 0
+        destination_entries = {}
+        for entry in os.scandir(destination):
+            if entry.name in source_entries:
+                destination_entries[entry.name] = entry
+            elif not self._delete or self._delete(entry.path):
+                _remove_entry(entry)
+                changes += 1
+
+        for name in sorted(source_entries):
+            changes += self._sync_entry(
+                source_entries[name], destination_entries.get(name),
+                os.path.join(destination, name))
+
+        return changes
+
+    def _sync_entry(self, source, destination, destination_path):
+        if source.is_dir(follow_symlinks=False):
+            if destination and destination.is_dir(follow_symlinks=False):
+                return self.sync_directory(source.path, destination_path)
+            if destination:
+                _remove_entry(destination)
+            os.mkdir(destination_path)
+            changes = self.sync_directory(source.path, destination_path)
+            shutil.copystat(source.path, destination_path)
+            return changes + 1
+
+        if destination:
+            if _same_entry(source, destination):
+                return 0
+            _remove_entry(destination)
+        if source.is_symlink():
+            os.symlink(os.readlink(source.path), destination_path)
+        else:
+            self._copy_function(source.path, destination_path)
+        return 1
+
+
+def _same_entry(source, destination):
+    if source.is_symlink() or destination.is_symlink():
+        return (source.is_symlink() and destination.is_symlink() and
+                os.readlink(source.path) == os.readlink(destination.path))
+    if destination.is_dir(follow_symlinks=False):
+        return False
+
+    source_stat = source.stat(follow_symlinks=False)
+    destination_stat = destination.stat(follow_symlinks=False)
+    if (source_stat.st_dev == destination_stat.st_dev and
+            source_stat.st_ino == destination_stat.st_ino):
+        return True
+    return (source_stat.st_size == destination_stat.st_size and
+            source_stat.st_mode == destination_stat.st_mode and
+            source_stat.st_mtime_ns == destination_stat.st_mtime_ns)
+
+
+def _remove_entry(entry):
+    if entry.is_dir(follow_symlinks=False):
+        shutil.rmtree(entry.path)
+    else:
+        os.remove(entry.path)
+
+
 def create_similar_directory(source, destination, follow_symlinks=False):
     """Create a directory with the same permission bits and owner information.
 
@@ -234,3 +476,54 @@ def calculate_sha3_384(path):
                 break
             hasher.update(buf)
         return hasher.hexdigest()
+
+
+def calculate_sha256(path):
+    """Calculate sha256 hash, reading the file in 1MB chunks."""
+    blocksize = 2**20
+    with open(path, 'rb') as f:
+        hasher = hashlib.sha256()
+        while True:
+            buf = f.read(blocksize)
+            if not buf:
+                break
+            hasher.update(buf)
+        return hasher.hexdigest()
+
+
+def calculate_tree_hash(directory, ignore=None):
+    """Calculate a hash of the contents of a directory tree.
+
+    Files are identified by their metadata (type, mode, size and
+    modification time) rather than by their contents, so this is cheap
+    enough to run on large trees every time. Each directory hash covers
+    the hashes of its entries, so any change in the tree changes the result.
+
+    :param str directory: Root of the tree to hash.
+    :param callable ignore: Same as the ignore argument to shutil.copytree:
+                            called with a directory and the names in it, it
+                            returns the names to leave out.
+    :returns: Hex digest for the tree.
+    """
+
+    hasher = hashlib.sha3_384()
+    entries = sorted(os.scandir(directory), key=lambda e: e.name)
+    ignored = set()
+    if ignore:
+        ignored = set(ignore(directory, [e.name for e in entries]))
+
+    for entry in entries:
+        if entry.name in ignored:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if entry.is_symlink():
+            digest = os.readlink(entry.path)
+        elif entry.is_dir(follow_symlinks=False):
+            digest = calculate_tree_hash(entry.path, ignore)
+        else:
+            digest = '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+        hasher.update('{}\0{:o}\0{}\0'.format(
+            entry.name, stat.st_mode, digest).encode(
+                'utf-8', errors='surrogateescape'))
+
+    return hasher.hexdigest()
@@ -73,3 +73,21 @@ def pluralize(container, if_one, if_multiple):
         return if_one
     else:
         return if_multiple
+
+
+def humanize_size(size):
+    """Format a number of bytes into a human-readable string.
+
+    :param int size: The number of bytes, e.g. 1536 for '1.5 KiB'.
+    """
+
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+
+    if unit == 'B':
+        return '{} B'.format(size)
+    return '{:.1f} {}'.format(size, unit)
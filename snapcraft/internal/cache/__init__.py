@@ -16,4 +16,8 @@
 
 from ._apt import AptStagePackageCache  # noqa
 from ._cache import SnapcraftCache  # noqa
+from ._compiler import CompilerCache  # noqa
+from ._dependencies import DependencyCache  # noqa
+from ._manager import CacheManager, CacheStats, Pruned  # noqa
 from ._snap import SnapCache  # noqa
+from ._unpacked import UnpackedStagePackageCache  # noqa
@@ -25,6 +25,9 @@ logger = logging.getLogger(__name__)
 class AptStagePackageCache(SnapcraftStagePackageCache):
     """Cache for stage-packages coming from apt."""
 
+    kind = 'stage-packages'
+    entries = os.path.join('stage-packages', 'apt', '*')
+
     def __init__(self, *, sources_digest):
         """Create a new AptStagePackageCache.
 
@@ -34,8 +37,8 @@ class AptStagePackageCache(SnapcraftStagePackageCache):
         super().__init__()
         cache_base_dir = os.path.join(self.stage_package_cache_root, 'apt')
 
-        # TODO: Clean old cache, LP: #1663051
-
+        # The roots of sources no longer used are evicted by the
+        # CacheManager, LP: #1663051
         self.base_dir = os.path.join(
             cache_base_dir, sources_digest)
         self.packages_dir = os.path.join(
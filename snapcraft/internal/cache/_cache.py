@@ -18,16 +18,36 @@ import os
 
 from xdg import BaseDirectory
 
+from . import _usage
+
 
 class SnapcraftCache:
     """Generic cache base class.
 
     This class is responsible for cache location, notification and pruning.
     """
+
+    # The name the use of the cache is recorded under.
+    kind = None
+    # A glob of the entries of the cache, relative to cache_root.
+    entries = None
+    # Whether the cache keeps itself bounded, else the CacheManager evicts
+    # its entries.
+    bounded = False
+
     def __init__(self):
         self.cache_root = os.path.join(
             BaseDirectory.xdg_cache_home, 'snapcraft')
 
+    def record_use(self, entries=(), *, hits=0, misses=0):
+        """Record that entries were used, and how many lookups hit or missed.
+
+        The entries used last are the ones kept longest by the CacheManager.
+        """
+
+        _usage.record(self.cache_root, self.kind, entries=entries, hits=hits,
+                      misses=misses)
+
     def cache(self):
         raise NotImplementedError
 
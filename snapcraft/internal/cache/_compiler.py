@@ -0,0 +1,127 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import logging
+import os
+import shutil
+
+from ._cache import SnapcraftCache
+
+logger = logging.getLogger(__name__)
+
+_MAX_SIZE = '5G'
+
+# The results ccache logs for a compilation, by ccache 3 and ccache 4. With
+# ccache 4 a miss of the direct mode is logged before the outcome of the
+# preprocessor mode, so only the outcome is counted.
+_HITS = {'cache hit (direct)', 'cache hit (preprocessed)',
+         'direct_cache_hit', 'preprocessed_cache_hit'}
+_MISSES = {'cache miss', 'cache_miss'}
+
+
+class CompilerCache(SnapcraftCache):
+    """Cache of compilation results, kept by ccache.
+
+    Compilers are put behind ccache by symlinks named after them, found
+    first in PATH. The results are shared by all the parts and projects
+    using it, and ccache evicts the oldest ones beyond the maximum size.
+    """
+
+    kind = 'ccache'
+    entries = 'ccache'
+    bounded = True
+
+    def __init__(self, *, max_size=_MAX_SIZE):
+        """Create a new CompilerCache.
+
+        :param str max_size: Size the cache is kept under, as understood by
+                             ccache. CCACHE_MAXSIZE overrides it.
+        """
+
+        super().__init__()
+        self.compiler_cache_root = os.path.join(self.cache_root, 'ccache')
+        self.max_size = max_size
+
+    def env(self, wrappers_dir, log_file):
+        """Return the exports putting the compilers behind ccache.
+
+        :param str wrappers_dir: Directory the compiler symlinks are in.
+        :param str log_file: File ccache logs each compilation to.
+        """
+
+        return [
+            'PATH="{}:$PATH"'.format(wrappers_dir),
+            'CCACHE_DIR="{}"'.format(self.compiler_cache_root),
+            'CCACHE_MAXSIZE="${{CCACHE_MAXSIZE:-{}}}"'.format(self.max_size),
+            'CCACHE_LOGFILE="{}"'.format(log_file),
+        ]
+
+    def setup(self, wrappers_dir, compilers, path):
+        """Put the compilers found in path behind ccache.
+
+        Symlinks are only made for the compilers there are, so that build
+        systems looking for a compiler do not find one ccache cannot run.
+
+        :param str wrappers_dir: Directory to make the symlinks in.
+        :param list compilers: Names of the compilers to look for.
+        :param str path: The PATH the compilers are searched in.
+        :returns: False if ccache cannot be found.
+        """
+
+        if os.path.exists(wrappers_dir):
+            shutil.rmtree(wrappers_dir)
+
+        search_path = os.pathsep.join(
+            d for d in path.split(os.pathsep)
+            if os.path.abspath(d) != os.path.abspath(wrappers_dir))
+        ccache = shutil.which('ccache', path=search_path)
+        if not ccache:
+            logger.warning('ccache cannot be found, compilations will not '
+                           'be cached.')
+            return False
+
+        os.makedirs(wrappers_dir)
+        os.makedirs(self.compiler_cache_root, exist_ok=True)
+        for compiler in compilers:
+            if shutil.which(compiler, path=search_path):
+                os.symlink(ccache, os.path.join(wrappers_dir, compiler))
+        return True
+
+    def get_stats(self, log_file):
+        """Return the hits and misses logged in log_file, then remove it.
+
+        They are also recorded with those of the other caches.
+
+        :returns: A (hits, misses) tuple.
+        """
+
+        hits = misses = 0
+        with contextlib.suppress(FileNotFoundError):
+            with open(log_file, errors='replace') as f:
+                for line in f:
+                    _, separator, result = line.partition('Result: ')
+                    result = result.strip()
+                    if not separator:
+                        continue
+                    elif result in _HITS:
+                        hits += 1
+                    elif result in _MISSES:
+                        misses += 1
+            os.remove(log_file)
+
+        self.record_use(hits=hits, misses=misses)
+        return hits, misses
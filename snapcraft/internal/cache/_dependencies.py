@@ -0,0 +1,178 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from ._cache import SnapcraftCache
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS dependencies (
+        path TEXT NOT NULL,
+        signature TEXT NOT NULL,
+        context TEXT NOT NULL,
+        dependencies TEXT NOT NULL,
+        used INTEGER NOT NULL,
+        PRIMARY KEY (context, path, signature))""",
+    """CREATE INDEX IF NOT EXISTS dependencies_used
+        ON dependencies (used)""",
+)
+
+_MAX_AGE = 30 * 24 * 60 * 60
+_MAX_ENTRIES = 200000
+
+
+class DependencyCache(SnapcraftCache):
+    """Cache for the libraries the files of a snap depend on.
+
+    Dependencies are stored by the path and signature of a file, and by the
+    context they were resolved in: anything that changes where libraries
+    are found must change the context. Entries not used for a while are
+    evicted, as are the oldest ones when there are too many.
+    """
+
+    kind = 'dependencies'
+    entries = 'dependencies.db'
+    bounded = True
+
+    def __init__(self, *, max_age=_MAX_AGE, max_entries=_MAX_ENTRIES):
+        """Create a new DependencyCache.
+
+        :param int max_age: Seconds an entry is kept for after its last use.
+        :param int max_entries: Number of entries kept at most.
+        """
+
+        super().__init__()
+        self.path = os.path.join(self.cache_root, 'dependencies.db')
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+    def get(self, context, signatures):
+        """Return the dependencies stored for files, by path.
+
+        :param str context: The context the dependencies were resolved in.
+        :param dict signatures: The signature of each file, by path. Files
+                                whose signature changed are left out.
+        """
+
+        if not signatures:
+            return {}
+
+        cached = self._get(context, signatures)
+        self.record_use(hits=len(cached),
+                        misses=len(signatures) - len(cached))
+        return cached
+
+    def _get(self, context, signatures):
+        cached = {}
+        if not os.path.exists(self.path):
+            return cached
+
+        with self._connection() as connection:
+            if not connection:
+                return cached
+            rows = connection.execute(
+                'SELECT path, signature, dependencies FROM dependencies '
+                'WHERE context = ?', (context,))
+            for path, signature, dependencies in rows:
+                if signatures.get(path) == signature:
+                    cached[path] = json.loads(dependencies)
+            connection.executemany(
+                'UPDATE dependencies SET used = ? '
+                'WHERE context = ? AND path = ? AND signature = ?',
+                ((int(time.time()), context, path, signatures[path])
+                 for path in cached))
+
+        return cached
+
+    def cache(self, context, dependencies):
+        """Store the dependencies of files, then evict old entries.
+
+        :param str context: The context the dependencies were resolved in.
+        :param dict dependencies: (signature, dependencies) tuples by path.
+        """
+
+        if not dependencies:
+            return
+
+        now = int(time.time())
+        with self._connection() as connection:
+            if not connection:
+                return
+            connection.executemany(
+                'INSERT OR REPLACE INTO dependencies VALUES (?, ?, ?, ?, ?)',
+                ((path, signature, context, json.dumps(sorted(libraries)),
+                  now)
+                 for path, (signature, libraries) in dependencies.items()))
+            self._prune(connection, now)
+
+    def prune(self):
+        """Evict the entries that are too old or too many."""
+
+        if not os.path.exists(self.path):
+            return
+
+        with self._connection() as connection:
+            if connection:
+                self._prune(connection, int(time.time()))
+
+    def _prune(self, connection, now):
+        connection.execute('DELETE FROM dependencies WHERE used < ?',
+                           (now - self.max_age,))
+        connection.execute(
+            'DELETE FROM dependencies WHERE rowid IN ('
+            'SELECT rowid FROM dependencies ORDER BY used DESC '
+            'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    @contextlib.contextmanager
+    def _connection(self):
+        # The dependencies can always be found again, failing to use the
+        # cache only makes that slower.
+        try:
+            connection = self._connect()
+        except (OSError, sqlite3.Error) as e:
+            logger.debug('Unable to open the dependency cache {!r}: {}'.format(
+                self.path, e))
+            yield None
+            return
+
+        try:
+            with connection:
+                yield connection
+        except sqlite3.Error as e:
+            logger.debug('Unable to use the dependency cache {!r}: {}'.format(
+                self.path, e))
+        finally:
+            connection.close()
+
+    def _connect(self):
+        os.makedirs(self.cache_root, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            # Losing the latest writes to a cache on a crash is harmless.
+            connection.execute('PRAGMA synchronous = OFF')
+            for statement in _SCHEMA:
+                connection.execute(statement)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        return connection
@@ -0,0 +1,240 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import glob
+import logging
+import os
+import re
+import shutil
+import stat
+import time
+
+from . import _usage
+from ._apt import AptStagePackageCache
+from ._cache import SnapcraftCache
+from ._compiler import CompilerCache
+from ._dependencies import DependencyCache
+from ._snap import SnapCache
+from ._unpacked import UnpackedStagePackageCache
+
+logger = logging.getLogger(__name__)
+
+_CACHES = (AptStagePackageCache, UnpackedStagePackageCache, SnapCache,
+           DependencyCache, CompilerCache)
+
+_MAX_SIZE = '10G'
+_MAX_AGE = '30'
+_PRUNE_INTERVAL = 24 * 60 * 60
+_PRUNE_STAMP = 'prune-stamp'
+
+_SIZE_PATTERN = re.compile(r'^(\d+)\s*([KMGT]?)(?:i?B)?$', re.IGNORECASE)
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+               'T': 1024 ** 4}
+
+CacheStats = collections.namedtuple(
+    'CacheStats', ['kind', 'entries', 'size', 'hits', 'misses'])
+CacheStats.__doc__ = """The use of a kind of cache.
+
+:ivar str kind: The kind of cache.
+:ivar int entries: The number of entries, None for the caches keeping
+                   themselves bounded.
+:ivar int size: The bytes the cache takes.
+:ivar int hits: The lookups recorded that found what they looked for.
+:ivar int misses: The lookups recorded that did not.
+"""
+
+Pruned = collections.namedtuple('Pruned', ['entries', 'size'])
+Pruned.__doc__ = """What pruning the caches evicted.
+
+:ivar list entries: The paths of the entries evicted.
+:ivar int size: The bytes reclaimed.
+"""
+
+
+class CacheManager(SnapcraftCache):
+    """Keep the caches under a maximum size and age.
+
+    Entries not used for max_age are evicted, then the ones used least
+    recently until the caches fit in max_size, whatever cache they are
+    from. The caches that keep themselves bounded are only accounted for.
+    """
+
+    def __init__(self, *, max_size=None, max_age=None):
+        """Create a new CacheManager.
+
+        :param str max_size: Size the caches are kept under, like 10G.
+                             Defaults to SNAPCRAFT_CACHE_MAX_SIZE, or 10G.
+        :param str max_age: Days an entry is kept for after its last use.
+                            Defaults to SNAPCRAFT_CACHE_MAX_AGE, or 30.
+        :raises EnvironmentError: If either of them is not valid.
+        """
+
+        super().__init__()
+        if max_size is None:
+            max_size = os.environ.get('SNAPCRAFT_CACHE_MAX_SIZE', _MAX_SIZE)
+        if max_age is None:
+            max_age = os.environ.get('SNAPCRAFT_CACHE_MAX_AGE', _MAX_AGE)
+        self.max_size = _parse_size(max_size)
+        self.max_age = _parse_age(max_age)
+
+    def get_stats(self):
+        """Return the CacheStats of each kind of cache."""
+
+        lookups = _usage.get_lookups(self.cache_root)
+        stats = []
+        for cache_class in _CACHES:
+            entries = self._get_entries(cache_class)
+            hits, misses = lookups.get(cache_class.kind, (0, 0))
+            stats.append(CacheStats(
+                kind=cache_class.kind,
+                entries=None if cache_class.bounded else len(entries),
+                size=sum(_get_size(entry) for entry in entries),
+                hits=hits, misses=misses))
+        return stats
+
+    def prune(self, *, keep_since=None):
+        """Evict the entries that are too old, then the least recently used.
+
+        :param int keep_since: Entries used since then are kept, even if the
+                               caches remain too large.
+        :returns: What was evicted, as Pruned.
+        """
+
+        DependencyCache().prune()
+
+        now = time.time()
+        last_used = _usage.get_last_used(self.cache_root)
+        entries = []
+        for cache_class in _CACHES:
+            if cache_class.bounded:
+                continue
+            for entry in self._get_entries(cache_class):
+                with contextlib.suppress(FileNotFoundError):
+                    used = last_used.get(entry) or os.lstat(entry).st_mtime
+                    entries.append((used, entry, _get_size(entry)))
+        entries.sort()
+
+        total = sum(size for _, _, size in entries)
+        evicted = []
+        reclaimed = 0
+        for used, entry, size in entries:
+            if keep_since is not None and used >= keep_since:
+                break
+            if used >= now - self.max_age and total <= self.max_size:
+                break
+            try:
+                _remove(entry)
+            except OSError as e:
+                logger.warning('Unable to evict {!r} from the cache: '
+                               '{}'.format(entry, e))
+                continue
+            logger.debug('Evicted {!r} from the cache'.format(entry))
+            evicted.append(entry)
+            reclaimed += size
+            total -= size
+
+        _usage.forget(self.cache_root, evicted + [
+            entry for entry in last_used if not os.path.lexists(entry)])
+        with contextlib.suppress(OSError):
+            os.makedirs(self.cache_root, exist_ok=True)
+            with open(os.path.join(self.cache_root, _PRUNE_STAMP), 'w'):
+                pass
+
+        return Pruned(entries=evicted, size=reclaimed)
+
+    def prune_if_due(self, *, keep_since=None):
+        """Prune the caches unless it was done within the last day.
+
+        :returns: What was evicted, as Pruned, or None if it was not due.
+        """
+
+        try:
+            pruned = os.path.getmtime(
+                os.path.join(self.cache_root, _PRUNE_STAMP))
+        except OSError:
+            pruned = 0
+        if time.time() - pruned < _PRUNE_INTERVAL:
+            return None
+
+        return self.prune(keep_since=keep_since)
+
+    def _get_entries(self, cache_class):
+        return sorted(glob.glob(
+            os.path.join(self.cache_root, cache_class.entries)))
+
+
+def _parse_size(value):
+    match = _SIZE_PATTERN.match(str(value).strip())
+    if not match:
+        raise EnvironmentError(
+            'The maximum size of the caches must be a number of bytes, '
+            'optionally followed by K, M, G or T, not {!r}'.format(value))
+
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def _parse_age(value):
+    try:
+        days = float(value)
+    except (TypeError, ValueError):
+        days = -1
+
+    if days < 0:
+        raise EnvironmentError(
+            'The maximum age of the cache entries must be a number of days, '
+            'not {!r}'.format(value))
+
+    return days * 24 * 60 * 60
+
+
+def _get_size(path):
+    # Only what removing path reclaims is counted, files still linked from
+    # elsewhere, like the parts linking to the downloaded packages, are not.
+    inodes = {}
+    for entry in _walk(path):
+        with contextlib.suppress(FileNotFoundError):
+            st = os.lstat(entry)
+            if stat.S_ISDIR(st.st_mode):
+                continue
+            nlink, size, seen = inodes.get(
+                (st.st_dev, st.st_ino), (st.st_nlink, st.st_size, 0))
+            inodes[(st.st_dev, st.st_ino)] = (nlink, size, seen + 1)
+
+    return sum(size for nlink, size, seen in inodes.values()
+               if seen >= nlink)
+
+
+def _walk(path):
+    yield path
+    for directory, dirs, files in os.walk(path):
+        for name in dirs + files:
+            yield os.path.join(directory, name)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=_remove_read_only)
+    else:
+        os.remove(path)
+
+
+def _remove_read_only(function, path, exc_info):
+    # The trees extracted from packages can have read-only directories.
+    parent = os.path.dirname(path)
+    os.chmod(parent, os.stat(parent).st_mode | stat.S_IWUSR)
+    function(path)
@@ -30,6 +30,9 @@ logger = logging.getLogger(__name__)
 class SnapCache(SnapcraftProjectCache):
     """Cache for snap revisions."""
 
+    kind = 'snaps'
+    entries = os.path.join('projects', '*', 'snap_hashes', '*', '*')
+
     def __init__(self, *, project_name):
         super().__init__(project_name=project_name)
         self.snap_cache_root = self._setup_snap_cache_root()
@@ -73,6 +76,8 @@ class SnapCache(SnapcraftProjectCache):
         except OSError:
             logger.warning(
                 'Unable to cache snap {}.'.format(snap_filename))
+        else:
+            self.record_use([cached_snap_path])
         return cached_snap_path
 
     def get(self, *, deb_arch, snap_hash=None):
@@ -83,6 +88,14 @@ class SnapCache(SnapcraftProjectCache):
 
         :returns: full path to cached snap.
         """
+        cached_snap = self._find(deb_arch, snap_hash)
+        if cached_snap:
+            self.record_use([cached_snap], hits=1)
+        else:
+            self.record_use(misses=1)
+        return cached_snap
+
+    def _find(self, deb_arch, snap_hash):
         snap_cache_dir = os.path.join(self.snap_cache_root, deb_arch)
         if not os.path.isdir(snap_cache_dir):
             return None
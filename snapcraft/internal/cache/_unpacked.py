@@ -0,0 +1,92 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from ._cache import SnapcraftStagePackageCache
+
+logger = logging.getLogger(__name__)
+
+
+class UnpackedStagePackageCache(SnapcraftStagePackageCache):
+    """Cache for the trees extracted from stage packages.
+
+    Each package is extracted once, into a directory named after the SHA256
+    of the .deb, along with the list of what was extracted in order. Parts
+    get copies of these trees, cloned where the filesystem allows, instead
+    of extracting the package again.
+    """
+
+    kind = 'unpacked-stage-packages'
+    # Trees being extracted are hidden until they are complete.
+    entries = os.path.join('stage-packages', 'unpacked', '*')
+
+    def __init__(self):
+        super().__init__()
+        self.unpacked_root = os.path.join(
+            self.stage_package_cache_root, 'unpacked')
+
+    def get(self, *, digest):
+        """Return the (tree, members) tuple cached for a package.
+
+        :param str digest: SHA256 hex digest of the .deb.
+        :returns: The directory the package was extracted into and the
+                  paths extracted, relative to it. None if not cached.
+        """
+
+        entry = os.path.join(self.unpacked_root, digest)
+        try:
+            with open(os.path.join(entry, 'members')) as f:
+                members = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return os.path.join(entry, 'tree'), members
+
+    def cache(self, *, digest, extract):
+        """Extract a package into the cache and return get() for it.
+
+        The package is extracted aside and moved into place at once, so
+        other processes never see it half extracted. If one of them cached
+        it first, its tree is kept.
+
+        :param str digest: SHA256 hex digest of the .deb.
+        :param callable extract: Called with the directory to extract the
+                                 package into, returns the paths extracted.
+        """
+
+        os.makedirs(self.unpacked_root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.', dir=self.unpacked_root)
+        try:
+            tree = os.path.join(staging, 'tree')
+            os.mkdir(tree)
+            members = extract(tree)
+            with open(os.path.join(staging, 'members'), 'w') as f:
+                json.dump(members, f)
+            try:
+                os.rename(staging, os.path.join(self.unpacked_root, digest))
+            except OSError as e:
+                logger.debug('Keeping the tree cached for {}: {}'.format(
+                    digest, e))
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+
+        return self.get(digest=digest)
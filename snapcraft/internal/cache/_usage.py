@@ -0,0 +1,144 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record when the entries of the caches were last used.
+
+The record is kept in a database at the root of the caches, along with
+how many lookups of each kind of cache hit or missed.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS entries (
+        path TEXT NOT NULL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        used INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS lookups (
+        kind TEXT NOT NULL PRIMARY KEY,
+        hits INTEGER NOT NULL,
+        misses INTEGER NOT NULL)""",
+)
+
+_DATABASE = 'usage.db'
+
+
+def record(cache_root, kind, *, entries=(), hits=0, misses=0):
+    """Record that entries were used now, and the outcome of lookups.
+
+    :param str cache_root: The root of the caches.
+    :param str kind: The kind of cache used.
+    :param entries: Paths of the entries used.
+    :param int hits: Lookups that found what they looked for.
+    :param int misses: Lookups that did not.
+    """
+
+    entries = list(entries)
+    if not entries and not hits and not misses:
+        return
+
+    now = int(time.time())
+    with _connection(cache_root) as connection:
+        if not connection:
+            return
+        connection.executemany(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+            ((entry, kind, now) for entry in entries))
+        if hits or misses:
+            connection.execute(
+                'INSERT OR IGNORE INTO lookups VALUES (?, 0, 0)', (kind,))
+            connection.execute(
+                'UPDATE lookups SET hits = hits + ?, misses = misses + ? '
+                'WHERE kind = ?', (hits, misses, kind))
+
+
+def get_last_used(cache_root):
+    """Return when each entry recorded was last used, by path."""
+
+    last_used = {}
+    with _connection(cache_root, create=False) as connection:
+        if connection:
+            last_used = dict(connection.execute(
+                'SELECT path, used FROM entries'))
+    return last_used
+
+
+def get_lookups(cache_root):
+    """Return the (hits, misses) tuple recorded for each kind of cache."""
+
+    lookups = {}
+    with _connection(cache_root, create=False) as connection:
+        if connection:
+            lookups = {kind: (hits, misses) for kind, hits, misses in
+                       connection.execute(
+                           'SELECT kind, hits, misses FROM lookups')}
+    return lookups
+
+
+def forget(cache_root, entries):
+    """Forget the use of entries, once they are gone."""
+
+    with _connection(cache_root, create=False) as connection:
+        if connection:
+            connection.executemany('DELETE FROM entries WHERE path = ?',
+                                   ((entry,) for entry in entries))
+
+
+@contextlib.contextmanager
+def _connection(cache_root, *, create=True):
+    # Failing to record the use of the caches only makes their eviction
+    # less accurate.
+    path = os.path.join(cache_root, _DATABASE)
+    if not create and not os.path.exists(path):
+        yield None
+        return
+
+    try:
+        connection = _connect(cache_root, path)
+    except (OSError, sqlite3.Error) as e:
+        logger.debug('Unable to open the cache usage record {!r}: {}'.format(
+            path, e))
+        yield None
+        return
+
+    try:
+        with connection:
+            yield connection
+    except sqlite3.Error as e:
+        logger.debug('Unable to use the cache usage record {!r}: {}'.format(
+            path, e))
+    finally:
+        connection.close()
+
+
+def _connect(cache_root, path):
+    os.makedirs(cache_root, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    try:
+        # Losing the latest writes to a cache on a crash is harmless.
+        connection.execute('PRAGMA synchronous = OFF')
+        for statement in _SCHEMA:
+            connection.execute(statement)
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
@@ -16,7 +16,8 @@
 
 # Data/methods shared between plugins and snapcraft
 
-from contextlib import suppress
+from contextlib import contextmanager, suppress
+import functools
 import glob
 import logging
 import math
@@ -24,9 +25,11 @@ import os
 import shutil
 import subprocess
 import sys
-import tempfile
+import threading
 import urllib
 
+from snapcraft.internal import jobserver
+
 
 SNAPCRAFT_FILES = ['snapcraft.yaml', '.snapcraft.yaml', 'parts', 'stage',
                    'prime', 'snap']
@@ -43,40 +46,125 @@ _tourdir = _DEFAULT_TOURDIR
 MAX_CHARACTERS_WRAP = 120
 
 env = []
+_thread_env = threading.local()
 
 logger = logging.getLogger(__name__)
 
 
 def assemble_env():
-    return '\n'.join(['export ' + e for e in env])
+    return '\n'.join(['export ' + e for e in _current_env()])
+
+
+def resolve_env(exports, env=None, cwd=None):
+    """Return the environment the exports result in, as a dict.
+
+    The exports are shell assignments that may refer to other variables,
+    so they are evaluated once by a shell on top of the current environment.
+
+    :param list exports: The assignments, as used in env.
+    :param dict env: The environment to evaluate them in, instead of the
+                     current one.
+    :param str cwd: The directory to evaluate them from.
+    """
+    script = '\n'.join(
+        ['export ' + e for e in exports] + ['exec /usr/bin/env -0'])
+    output = subprocess.check_output(['/bin/sh', '-c', script], env=env,
+                                     cwd=cwd)
+
+    resolved = {}
+    for variable in output.split(b'\0'):
+        name, separator, value = variable.partition(b'=')
+        if separator:
+            resolved[os.fsdecode(name)] = os.fsdecode(value)
+
+    return resolved
+
+
+def _current_env():
+    return getattr(_thread_env, 'env', env)
+
+
+def set_env(new_env):
+    """Set the build environment used by run and run_output.
+
+    If the calling thread has its own environment (see thread_env) only that
+    one is replaced.
+    """
+    global env
+    if hasattr(_thread_env, 'env'):
+        _thread_env.env = new_env
+    else:
+        env = new_env
+
+
+@contextmanager
+def thread_env():
+    """Give the calling thread a build environment of its own.
+
+    This allows parts to be processed concurrently without their environments
+    leaking into each other.
+    """
+    _thread_env.env = []
+    try:
+        yield
+    finally:
+        del _thread_env.env
 
 
 def run(cmd, **kwargs):
     assert isinstance(cmd, list), 'run command must be a list'
-    # FIXME: This is gross to keep writing this, even when env is the same
-    with tempfile.NamedTemporaryFile(mode='w+') as f:
-        f.write(assemble_env())
-        f.write('\n')
-        f.write('exec "$@"')
-        f.flush()
-        subprocess.check_call(['/bin/sh', f.name] + cmd, **kwargs)
+    _call(subprocess.check_call, cmd, kwargs)
 
 
 def run_output(cmd, **kwargs):
     assert isinstance(cmd, list), 'run command must be a list'
-    # FIXME: This is gross to keep writing this, even when env is the same
-    with tempfile.NamedTemporaryFile(mode='w+') as f:
-        f.write(assemble_env())
-        f.write('\n')
-        f.write('exec "$@"')
-        f.flush()
-        output = subprocess.check_output(['/bin/sh', f.name] + cmd, **kwargs)
-        try:
-            return output.decode(sys.getfilesystemencoding()).strip()
-        except UnicodeEncodeError:
-            logger.warning('Could not decode output for {!r} correctly'.format(
-                cmd))
-            return output.decode('latin-1', 'surrogateescape').strip()
+    output = _call(subprocess.check_output, cmd, kwargs)
+    try:
+        return output.decode(sys.getfilesystemencoding()).strip()
+    except UnicodeEncodeError:
+        logger.warning('Could not decode output for {!r} correctly'.format(
+            cmd))
+        return output.decode('latin-1', 'surrogateescape').strip()
+
+
+def run_env(env=None, cwd=None):
+    """Return the environment run and run_output execute commands in.
+
+    :param dict env: The environment the build environment is set on top of,
+                     instead of the current one.
+    :param str cwd: The directory commands are run from.
+    """
+    # The build environment is resolved by a shell once and then handed
+    # straight to every command run with it, instead of going through a
+    # shell script for each command.
+    if env is None:
+        env = os.environ
+    return _resolve_env_cached(
+        tuple(_current_env()), frozenset(env.items()), cwd)
+
+
+def _call(function, cmd, kwargs):
+    kwargs['env'] = run_env(kwargs.get('env'), kwargs.get('cwd'))
+    # The jobserver pipe has to be inherited for the MAKEFLAGS of the build
+    # environment to be of use.
+    server = jobserver.get()
+    if server:
+        kwargs['pass_fds'] = tuple(kwargs.get('pass_fds', ())) + server.fds
+
+    try:
+        return function(cmd, **kwargs)
+    except (FileNotFoundError, PermissionError) as e:
+        if e.filename != cmd[0]:
+            raise
+        # Keep failing the way the shell these commands used to be run
+        # from did when the command could not be executed.
+        returncode = 127 if isinstance(e, FileNotFoundError) else 126
+        raise subprocess.CalledProcessError(returncode, cmd) from e
+
+
+@functools.lru_cache(maxsize=32)
+def _resolve_env_cached(exports, base_env, cwd):
+    return resolve_env(exports, env=dict(base_env), cwd=cwd)
 
 
 def get_core_path():
@@ -171,8 +259,7 @@ def isurl(url):
 
 
 def reset_env():
-    global env
-    env = []
+    set_env([])
 
 
 def get_terminal_width(max_width=MAX_CHARACTERS_WRAP):
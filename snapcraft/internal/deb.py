@@ -0,0 +1,195 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Extract Debian binary packages without running dpkg-deb.
+
+A .deb is an ar archive whose data.tar member holds the files of the
+package. That member is read straight from the archive and extracted the
+way dpkg-deb --extract does: with the modes and modification times of the
+package, replacing whatever was in the way.
+
+Basic example:
+    >>> members = deb.extract('hello_2.10-1_amd64.deb', 'unpacked')
+    >>> members[:2]
+    ['usr', 'usr/bin']
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import tarfile
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_AR_MAGIC = b'!<arch>\n'
+_AR_HEADER_SIZE = 60
+
+_TAR_MODES = {
+    'data.tar': 'r|',
+    'data.tar.gz': 'r|gz',
+    'data.tar.bz2': 'r|bz2',
+    'data.tar.xz': 'r|xz',
+}
+
+
+class DebError(Exception):
+
+    @property
+    def message(self):
+        return 'Cannot extract {!r}: {}'.format(self.deb_file, self.reason)
+
+    def __init__(self, deb_file, reason):
+        self.deb_file = deb_file
+        self.reason = reason
+
+
+class UnsupportedDebError(DebError):
+    """The package is compressed in a way that cannot be read here."""
+
+
+def extract(deb_file, destination):
+    """Extract the files of the package deb_file into destination.
+
+    :param str deb_file: Path to the .deb.
+    :param str destination: Directory to extract into.
+    :returns: The paths extracted, relative to destination, in the order
+              they were extracted.
+    :raises UnsupportedDebError: If the data of the package is compressed
+                                 with something not available here.
+    :raises DebError: If the package cannot be read.
+    """
+
+    with open(deb_file, 'rb') as f:
+        name, size = _find_data(deb_file, f)
+        with _open_data(deb_file, name, _Member(f, size)) as tar:
+            try:
+                return _extract_all(deb_file, tar, destination)
+            except (tarfile.TarError, EOFError) as e:
+                raise DebError(deb_file, e)
+
+
+def _find_data(deb_file, f):
+    if f.read(len(_AR_MAGIC)) != _AR_MAGIC:
+        raise DebError(deb_file, 'not an ar archive')
+
+    while True:
+        header = f.read(_AR_HEADER_SIZE)
+        if len(header) < _AR_HEADER_SIZE:
+            raise DebError(deb_file, 'no data.tar member')
+        # GNU ar ends names with a slash.
+        name = header[:16].decode('ascii').strip().rstrip('/')
+        size = int(header[48:58].decode('ascii'))
+        if name.startswith('data.tar'):
+            return name, size
+        # Members are aligned on even offsets.
+        f.seek(size + size % 2, os.SEEK_CUR)
+
+
+@contextlib.contextmanager
+def _open_data(deb_file, name, member):
+    if name == 'data.tar.zst':
+        if not zstandard:
+            raise UnsupportedDebError(
+                deb_file, 'the zstandard module is needed for data.tar.zst')
+        member = zstandard.ZstdDecompressor().stream_reader(member)
+    elif name not in _TAR_MODES:
+        raise UnsupportedDebError(deb_file, 'unknown member {!r}'.format(name))
+
+    try:
+        tar = tarfile.open(fileobj=member, mode=_TAR_MODES.get(name, 'r|'))
+    except tarfile.TarError as e:
+        raise DebError(deb_file, e)
+    with tar:
+        yield tar
+
+
+def _extract_all(deb_file, tar, destination):
+    members = []
+    directories = []
+    for info in tar:
+        name = os.path.normpath(info.name)
+        if name == '.':
+            continue
+        if os.path.isabs(name) or name.split(os.sep)[0] == '..':
+            raise DebError(deb_file, 'unsafe path {!r}'.format(info.name))
+
+        path = os.path.join(destination, name)
+        if info.isdir():
+            os.makedirs(path, exist_ok=True)
+            # Like tar, set their modes last in case they are read-only.
+            directories.append((path, info))
+        elif not _extract_file(tar, info, path, destination):
+            logger.warning('Skipping {!r} from {!r}: not a regular file, '
+                           'directory or link'.format(name, deb_file))
+            continue
+        members.append(name)
+
+    for path, info in reversed(directories):
+        _set_attributes(path, info)
+
+    return members
+
+
+def _extract_file(tar, info, path, destination):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    if info.isreg():
+        with tar.extractfile(info) as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+    elif info.issym():
+        os.symlink(info.linkname, path)
+    elif info.islnk():
+        os.link(os.path.join(destination, os.path.normpath(info.linkname)),
+                path)
+    else:
+        return False
+
+    _set_attributes(path, info)
+    return True
+
+
+def _set_attributes(path, info):
+    if info.issym():
+        os.utime(path, (info.mtime, info.mtime), follow_symlinks=False)
+    else:
+        os.chmod(path, info.mode)
+        os.utime(path, (info.mtime, info.mtime))
+
+
+class _Member:
+    """A file object reading a member of an ar archive."""
+
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._f.read(size)
+        self._left -= len(data)
+        return data
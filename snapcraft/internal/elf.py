@@ -0,0 +1,223 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read the dynamic linking information of ELF files.
+
+Only the headers the dynamic linker looks at are read: the program headers,
+the interpreter and the dynamic section.
+
+Basic example:
+    >>> elf_file = elf.read('prime/bin/hello')
+    >>> elf_file.interpreter, elf_file.needed, elf_file.runpath
+"""
+
+import os
+import struct
+
+_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+_PT_LOAD = 1
+_PT_DYNAMIC = 2
+_PT_INTERP = 3
+
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_STRTAB = 5
+_DT_STRSZ = 10
+_DT_SONAME = 14
+_DT_RPATH = 15
+_DT_RUNPATH = 29
+_DT_FLAGS_1 = 0x6ffffffb
+
+DF_1_NODEFLIB = 0x800
+
+# Formats of the file header after e_ident, of a program header and of a
+# dynamic entry, for each class.
+_FORMATS = {
+    ELFCLASS32: ('HHIIIIIHHHHHH', 'IIIIIIII', 'iI'),
+    ELFCLASS64: ('HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'),
+}
+
+
+class ElfError(Exception):
+
+    def __init__(self, path, reason):
+        super().__init__('{!r} cannot be read as an ELF file: {}'.format(
+            path, reason))
+        self.path = path
+
+
+class ElfFile:
+    """The dynamic linking information of an ELF file.
+
+    :ivar str path: Path the file was read from.
+    :ivar tuple file_id: Device and inode of the file.
+    :ivar int elf_class: 1 for 32-bit files, 2 for 64-bit ones.
+    :ivar int machine: The e_machine of the file.
+    :ivar int flags: The e_flags of the file.
+    :ivar bool dynamic: Whether the file is dynamically linked.
+    :ivar str interpreter: The PT_INTERP of the file, None if it has none.
+    :ivar str soname: The DT_SONAME of the file, None if it has none.
+    :ivar list needed: The DT_NEEDED entries of the file, in order.
+    :ivar list rpath: The DT_RPATH directories, None if there are none.
+    :ivar list runpath: The DT_RUNPATH directories, None if there are none.
+    :ivar int flags_1: The DT_FLAGS_1 of the file.
+    """
+
+    def __init__(self, path, file_id, elf_class, machine, flags):
+        self.path = path
+        self.file_id = file_id
+        self.elf_class = elf_class
+        self.machine = machine
+        self.flags = flags
+        self.dynamic = False
+        self.interpreter = None
+        self.soname = None
+        self.needed = []
+        self.rpath = None
+        self.runpath = None
+        self.flags_1 = 0
+
+    def is_compatible(self, other):
+        """Return whether other could be loaded along with this file."""
+
+        return (self.elf_class == other.elf_class and
+                self.machine == other.machine)
+
+
+def read(path):
+    """Return the ElfFile at path, None if it is not an ELF file.
+
+    :raises ElfError: if the file is an ELF file that cannot be read.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            ident = f.read(16)
+            if ident[:4] != _MAGIC:
+                return None
+            return _read(f, path, ident)
+    except (OSError, struct.error, ValueError) as e:
+        raise ElfError(path, e) from e
+
+
+def _read(f, path, ident):
+    if len(ident) < 16:
+        raise ElfError(path, 'truncated header')
+    elf_class, data = ident[4], ident[5]
+    if elf_class not in _FORMATS or data not in (_ELFDATA2LSB, _ELFDATA2MSB):
+        raise ElfError(path, 'unknown class or data encoding')
+    order = '<' if data == _ELFDATA2LSB else '>'
+    header_format, segment_format, entry_format = (
+        order + f for f in _FORMATS[elf_class])
+
+    header = _unpack(f, header_format)
+    (_, machine, _, _, phoff, _, flags, _, phentsize, phnum) = header[:10]
+    stat = os.fstat(f.fileno())
+    elf_file = ElfFile(path, (stat.st_dev, stat.st_ino), elf_class, machine,
+                       flags)
+
+    f.seek(phoff)
+    segments = []
+    for _ in range(phnum):
+        segment = f.read(phentsize)
+        segments.append(struct.unpack_from(segment_format, segment))
+    if elf_class == ELFCLASS64:
+        # The 64-bit layout has p_flags second.
+        segments = [(s[0], s[2], s[3], s[5]) for s in segments]
+    else:
+        segments = [(s[0], s[1], s[2], s[4]) for s in segments]
+
+    dynamic = None
+    for p_type, p_offset, p_vaddr, p_filesz in segments:
+        if p_type == _PT_INTERP:
+            f.seek(p_offset)
+            elf_file.interpreter = _decode(f.read(p_filesz).split(b'\0')[0])
+        elif p_type == _PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+
+    if dynamic:
+        elf_file.dynamic = True
+        loads = [s[1:] for s in segments if s[0] == _PT_LOAD]
+        _read_dynamic(f, elf_file, dynamic, loads, entry_format)
+
+    return elf_file
+
+
+def _read_dynamic(f, elf_file, dynamic, loads, entry_format):
+    entries = _read_entries(f, dynamic, entry_format)
+    strings = _read_strings(f, elf_file, dict(entries), loads)
+    if strings is None:
+        return
+
+    def string(index):
+        return _decode(strings[index:strings.index(b'\0', index)])
+
+    for d_tag, d_val in entries:
+        if d_tag == _DT_NEEDED:
+            elf_file.needed.append(string(d_val))
+        elif d_tag == _DT_SONAME:
+            elf_file.soname = string(d_val)
+        elif d_tag == _DT_RPATH:
+            elf_file.rpath = _split_path(string(d_val))
+        elif d_tag == _DT_RUNPATH:
+            elf_file.runpath = _split_path(string(d_val))
+        elif d_tag == _DT_FLAGS_1:
+            elf_file.flags_1 = d_val
+
+
+def _read_entries(f, dynamic, entry_format):
+    offset, size = dynamic
+    f.seek(offset)
+    data = f.read(size)
+    data = data[:len(data) - len(data) % struct.calcsize(entry_format)]
+    entries = []
+    for d_tag, d_val in struct.iter_unpack(entry_format, data):
+        if d_tag == _DT_NULL:
+            break
+        entries.append((d_tag, d_val))
+    return entries
+
+
+def _read_strings(f, elf_file, values, loads):
+    strtab = values.get(_DT_STRTAB)
+    if strtab is None:
+        return None
+    # The string table is given by its address once loaded.
+    for p_offset, p_vaddr, p_filesz in loads:
+        if p_vaddr <= strtab < p_vaddr + p_filesz:
+            f.seek(strtab - p_vaddr + p_offset)
+            return f.read(values.get(_DT_STRSZ, 0))
+    raise ElfError(elf_file.path, 'string table is not loaded')
+
+
+def _unpack(f, struct_format):
+    size = struct.calcsize(struct_format)
+    return struct.unpack(struct_format, f.read(size))
+
+
+def _split_path(path):
+    # Like the dynamic linker, both ':' and ';' separate directories.
+    return path.replace(';', ':').split(':')
+
+
+def _decode(data):
+    return data.decode('utf-8', errors='surrogateescape')
@@ -105,6 +105,11 @@ class SnapcraftPartConflictError(SnapcraftError):
                          file_paths='\n'.join(sorted(spaced_conflict_files)))
 
 
+class SchedulerCycleError(SnapcraftError):
+
+    fmt = 'Circular dependency chain found between: {nodes!r}'
+
+
 class MissingCommandError(SnapcraftError):
 
     fmt = (
@@ -0,0 +1,182 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Download files several at a time, checking them as they come in.
+
+HTTP downloads share a pool of keep-alive connections, so fetching many
+small files from one archive does not set up a connection for each of
+them. file: URIs are read directly.
+
+Basic example:
+    >>> fetcher = Fetcher(jobs=4)
+    >>> fetcher.fetch([Download(
+    ...     uri='http://archive.ubuntu.com/ubuntu/pool/main/h/hello/'
+    ...         'hello_2.10-1_amd64.deb',
+    ...     destination='hello_2.10-1_amd64.deb', size=27956,
+    ...     sha256=sha256)])
+    >>> fetcher.close()
+"""
+
+import collections
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import urllib.parse
+import urllib.request
+from concurrent import futures
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from snapcraft import file_utils
+from snapcraft.internal.indicators import download_progress_bar
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+SCHEMES = ('http', 'https', 'file')
+
+Download = collections.namedtuple(
+    'Download', ['uri', 'destination', 'size', 'sha256'])
+Download.__doc__ = """A file to download.
+
+:ivar str uri: The http, https or file URI to download from.
+:ivar str destination: The path to download to.
+:ivar int size: The expected size in bytes.
+:ivar str sha256: The expected SHA256 hex digest.
+"""
+
+
+class FetchError(Exception):
+
+    @property
+    def message(self):
+        return 'Failed to fetch {!r}: {}'.format(self.uri, self.reason)
+
+    def __init__(self, uri, reason):
+        self.uri = uri
+        self.reason = reason
+
+
+class Fetcher:
+    """Download files jobs at a time over pooled connections."""
+
+    def __init__(self, *, jobs):
+        """Create a new Fetcher.
+
+        :param int jobs: The number of files to download at the same time.
+        """
+
+        self._jobs = jobs
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=jobs, max_retries=3)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._progress_lock = threading.Lock()
+        self._progress = None
+        self._total = self._done = 0
+
+    def fetch(self, downloads, *, message='Downloading'):
+        """Download all of downloads, skipping those already in place.
+
+        A download is in place if its destination already has the expected
+        checksum. Files are written next to their destination first, and only
+        moved into place once their checksum is verified.
+
+        :param list downloads: The Download tuples to fetch.
+        :param str message: The message shown with the progress.
+        :raises FetchError: If a download fails or has the wrong checksum.
+        """
+
+        missing = [d for d in downloads if not _is_in_place(d)]
+        if not missing:
+            return
+
+        logger.debug('Fetching {} files, {} at a time'.format(
+            len(missing), self._jobs))
+        self._total = sum(d.size for d in missing)
+        self._done = 0
+        self._progress = download_progress_bar(self._total, message)
+        self._progress.start()
+        with futures.ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            # Wait for all downloads to be over before reporting a failure,
+            # to not leave any running.
+            results = [executor.submit(self._fetch, d) for d in missing]
+            futures.wait(results)
+        self._progress.finish()
+
+        for result in results:
+            result.result()
+
+    def close(self):
+        self._session.close()
+
+    def _fetch(self, download):
+        partial = '{}.partial'.format(download.destination)
+        sha256 = hashlib.sha256()
+        try:
+            with self._open(download.uri) as chunks, \
+                    open(partial, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    self._advance(len(chunk))
+        except (OSError, requests.RequestException) as e:
+            _remove(partial)
+            raise FetchError(download.uri, e)
+
+        if sha256.hexdigest() != download.sha256:
+            _remove(partial)
+            raise FetchError(
+                download.uri, 'expected SHA256 {}, got {}'.format(
+                    download.sha256, sha256.hexdigest()))
+
+        os.replace(partial, download.destination)
+
+    @contextlib.contextmanager
+    def _open(self, uri):
+        if urllib.parse.urlparse(uri).scheme == 'file':
+            with open(urllib.request.url2pathname(
+                    urllib.parse.urlparse(uri).path), 'rb') as f:
+                yield iter(lambda: f.read(_CHUNK_SIZE), b'')
+            return
+
+        with contextlib.closing(self._session.get(uri, stream=True)) as r:
+            r.raise_for_status()
+            yield r.iter_content(_CHUNK_SIZE)
+
+    def _advance(self, size):
+        with self._progress_lock:
+            self._done += size
+            # Sizes may be off, the checksums are what matter.
+            self._progress.update(
+                min(self._done, self._total) if self._total else self._done)
+
+
+def _is_in_place(download):
+    try:
+        return file_utils.calculate_sha256(
+            download.destination) == download.sha256
+    except FileNotFoundError:
+        return False
+
+
+def _remove(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
@@ -51,6 +51,12 @@ def _init_progress_bar(total_length, destination, message=None):
     return ProgressBar(widgets=widgets, maxval=maxval)
 
 
+def download_progress_bar(total_length, message):
+    """Return a progress bar for downloads of total_length bytes."""
+
+    return _init_progress_bar(total_length, None, message)
+
+
 def download_requests_stream(request_stream, destination, message=None):
     """This is a facility to download a request with nice progress bars."""
 
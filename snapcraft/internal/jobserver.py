@@ -0,0 +1,123 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A GNU make jobserver shared by all the builds of a lifecycle run.
+
+The jobserver is a pipe holding a token for each job that may run besides
+the one every make starts with. Makes are handed the pipe through MAKEFLAGS
+and take a token before starting another job, so parts built at the same
+time, and the makes they run in turn, never run more jobs together than
+there are slots.
+
+Basic example:
+    >>> jobserver.start(jobserver.get_slots(8, job_memory=1024), builds=2)
+    >>> jobserver.get().makeflags()
+    '-j --jobserver-fds=3,4'
+    >>> jobserver.stop()
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+_jobserver = None
+
+
+class JobServer:
+    """The token pipe of a jobserver with a number of slots.
+
+    :ivar int slots: The number of jobs that may run at the same time.
+    :ivar tuple fds: The read and write ends of the pipe.
+    """
+
+    def __init__(self, slots, *, builds=1):
+        """Create the pipe and fill it with tokens.
+
+        :param int slots: The number of jobs that may run at the same time.
+        :param int builds: The number of builds that may run at the same time,
+                           each starting with a job of its own.
+        """
+
+        self.slots = slots
+        self.fds = os.pipe()
+        os.write(self.fds[1], b'+' * max(slots - builds, 0))
+
+    def makeflags(self):
+        """Return the MAKEFLAGS making make use the jobserver."""
+
+        # A bare -j lets make take as many tokens as it can get.
+        return '-j --jobserver-fds={},{}'.format(*self.fds)
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+
+
+def start(slots, *, builds=1):
+    """Start the jobserver used by the builds, see JobServer."""
+
+    global _jobserver
+    logger.debug('Starting a jobserver with {} slots'.format(slots))
+    _jobserver = JobServer(slots, builds=builds)
+
+
+def stop():
+    """Stop the jobserver, if there is one."""
+
+    global _jobserver
+    jobserver, _jobserver = _jobserver, None
+    if jobserver:
+        jobserver.close()
+
+
+def get():
+    """Return the running JobServer, None if there is none."""
+
+    return _jobserver
+
+
+def get_slots(cpu_count, *, job_memory):
+    """Return the number of jobs the machine can run at the same time.
+
+    :param int cpu_count: The number of CPUs to use.
+    :param int job_memory: The memory each job is expected to use, in MiB.
+    """
+
+    available = _get_available_memory()
+    if available is None:
+        return cpu_count
+
+    slots = max(available // (job_memory * 1024 * 1024), 1)
+    if slots < cpu_count:
+        logger.info(
+            'Running {} build jobs at most, as {} MiB of memory are '
+            'available'.format(slots, available // (1024 * 1024)))
+        return slots
+    return cpu_count
+
+
+def _get_available_memory(meminfo='/proc/meminfo'):
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name == 'MemAvailable':
+                    # The value is given in kB.
+                    return int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
@@ -14,14 +14,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import re
 import glob
+import hashlib
 import logging
 import os
 import platform
+import struct
 import subprocess
+from stat import S_ISLNK
 
-from snapcraft.internal import common
+from snapcraft.internal import (
+    common,
+    elf,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -102,3 +109,324 @@ def get_dependencies(elf):
     libs = [l for l in ldd_out if not os.path.basename(l) in system_libs]
 
     return libs
+
+
+_LD_SO_CACHE = '/etc/ld.so.cache'
+_LD_SO_CACHE_MAGIC = b'glibc-ld.so.cache1.1'
+_LD_SO_CACHE_OLD_MAGIC = b'ld.so-1.7.0'
+
+# The flags ld.so.cache entries have for the libraries of each ELF class and
+# machine. Hard float ARM libraries are told apart by their e_flags.
+_LD_SO_CACHE_FLAGS = {
+    (elf.ELFCLASS32, 3): 0x0003,      # i386
+    (elf.ELFCLASS32, 40): 0x0003,     # armel
+    (elf.ELFCLASS32, 62): 0x0803,     # x32
+    (elf.ELFCLASS64, 62): 0x0303,     # x86_64
+    (elf.ELFCLASS64, 183): 0x0a03,    # aarch64
+    (elf.ELFCLASS64, 21): 0x0503,     # ppc64
+    (elf.ELFCLASS64, 22): 0x0403,     # s390x
+}
+_EF_ARM_ABI_FLOAT_HARD = 0x400
+_LD_SO_CACHE_ARMHF_FLAGS = 0x0903
+
+# Subdirectories the dynamic linker also looks into for libraries optimized
+# for the hardware it runs on.
+_HWCAP_SUBDIRS = ('glibc-hwcaps', 'tls', 'haswell', 'xeon_phi', 'x86_64',
+                  'i686', 'sse2', 'avx512_1')
+
+_DYNAMIC_LINKER_NAME = re.compile(r'^ld(-linux)?([-.].*)?\.so(\.|$)|^ld64\.so')
+
+
+_LIBRARY_NAME = re.compile(r'\.so(\.|$)')
+
+
+def get_search_context(ld_library_path, library_dirs=(), libraries=()):
+    """Return a digest of what affects finding the libraries of a file.
+
+    The digest changes whenever get_dependencies could find other
+    libraries: another LD_LIBRARY_PATH, libraries changing in it or in
+    library_dirs, another ld.so.cache or other system libraries.
+
+    :param str ld_library_path: The LD_LIBRARY_PATH ldd would run with.
+    :param list library_dirs: Directories whose libraries are looked at
+                              recursively.
+    :param list libraries: Other files to look at.
+    """
+    digest = hashlib.sha1()
+
+    def add(*values):
+        digest.update(repr(values).encode('utf-8', errors='surrogateescape'))
+
+    add(ld_library_path, _file_signature(_LD_SO_CACHE),
+        sorted(_get_system_libs()))
+    for d in (ld_library_path or '').replace(';', ':').split(':'):
+        with contextlib.suppress(OSError):
+            for entry in sorted(os.scandir(d or '.'), key=lambda e: e.name):
+                if is_library_name(entry.name):
+                    add(entry.path, _file_signature(entry.path))
+    for library_dir in library_dirs:
+        for root, dirs, files in os.walk(library_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if is_library_name(name):
+                    path = os.path.join(root, name)
+                    add(path, _file_signature(path))
+    for path in sorted(libraries):
+        add(path, _file_signature(path))
+
+    return digest.hexdigest()
+
+
+def is_library_name(path):
+    """Return whether path is named like a shared library."""
+
+    return bool(_LIBRARY_NAME.search(os.path.basename(path)))
+
+
+def _file_signature(path):
+    try:
+        stat = os.lstat(path)
+        if S_ISLNK(stat.st_mode):
+            return os.readlink(path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class DependencyResolver:
+    """Find the libraries an ELF file needs the way the dynamic linker does.
+
+    Libraries are looked up in the same places ldd would look for them, so
+    that the result is the same as get_dependencies without running ldd. The
+    lookups and the files read are cached, so one resolver should be used for
+    many files.
+
+    Basic example:
+        >>> resolver = DependencyResolver(os.environ.get('LD_LIBRARY_PATH'))
+        >>> resolver.get_dependencies('prime/bin/hello')
+    """
+
+    def __init__(self, ld_library_path, *, ld_so_cache=_LD_SO_CACHE):
+        """Create a resolver for a given environment.
+
+        :param str ld_library_path: The LD_LIBRARY_PATH ldd would run with.
+        :param str ld_so_cache: The cache of the system libraries.
+        """
+        self._ld_library_path = None
+        if ld_library_path:
+            # Like the dynamic linker, an empty entry is the current
+            # directory.
+            self._ld_library_path = [
+                d or '.' for d in ld_library_path.replace(';', ':').split(':')]
+        self._ld_so_cache_path = ld_so_cache
+        self._ld_so_cache = None
+        self._elf_files = {}
+        self._lookups = {}
+
+    def get_dependencies(self, path):
+        """Return the libraries path needs, None if they cannot be resolved.
+
+        Like get_dependencies, the system libraries are left out.
+
+        :raises elf.ElfError: if path or a library cannot be read.
+        """
+        main = self._read(path)
+        if main is None or not main.dynamic:
+            return None
+
+        loaded = {}
+        if main.interpreter:
+            loaded[os.path.basename(main.interpreter)] = None
+        # Objects are loaded breadth first, each one remembering the object
+        # that needed it first.
+        queue = [(main, None)]
+        dependencies = []
+        file_ids = {main.file_id}
+        for elf_file, loader in queue:
+            for name in elf_file.needed:
+                if name in loaded:
+                    continue
+                if (not main.interpreter and
+                        _DYNAMIC_LINKER_NAME.match(name)):
+                    loaded[name] = None
+                    continue
+                library = self._find(name, elf_file, loader, main)
+                if library is None:
+                    return None
+                loaded[name] = library
+                if library.soname:
+                    loaded.setdefault(library.soname, library)
+                if library.file_id in file_ids:
+                    continue
+                file_ids.add(library.file_id)
+                dependencies.append(library.path)
+                queue.append((library, (elf_file, loader)))
+
+        system_libs = _get_system_libs()
+        return [d for d in dependencies
+                if os.path.basename(d) not in system_libs]
+
+    def _find(self, name, elf_file, loader, main):
+        if '/' in name or '$' in name:
+            return None
+
+        dirs = []
+        if elf_file.runpath is None:
+            # The RPATH of the objects that led to this one are searched
+            # too, starting with its own.
+            chain = (elf_file, loader)
+            while chain:
+                dirs.extend(_search_path(chain[0], _rpath(chain[0]), main))
+                chain = chain[1]
+        if self._ld_library_path:
+            dirs.extend(self._ld_library_path)
+        dirs.extend(_search_path(elf_file, elf_file.runpath, main))
+        if None in dirs:
+            return None
+
+        use_cache = not elf_file.flags_1 & elf.DF_1_NODEFLIB
+        key = (name, tuple(dirs), use_cache, _cache_flags(elf_file))
+        try:
+            path = self._lookups[key]
+        except KeyError:
+            path = self._lookups[key] = self._lookup(name, dirs, elf_file,
+                                                     use_cache)
+        return self._read(path) if path else None
+
+    def _lookup(self, name, dirs, elf_file, use_cache):
+        for d in _unique(dirs):
+            if _in_hwcap_subdir(d, name):
+                return None
+            path = d.rstrip('/') + '/' + name
+            if self._is_compatible(path, elf_file):
+                return path
+
+        flags = _cache_flags(elf_file)
+        if not use_cache or flags is None:
+            return None
+        entries = self._get_ld_so_cache().get(name, [])
+        if any(hwcap for _, _, hwcap in entries):
+            return None
+        for entry_flags, path, _ in entries:
+            if (entry_flags == flags and
+                    self._is_compatible(path, elf_file)):
+                return path
+        # The default directories of the dynamic linker depend on how it was
+        # built, leave those to ldd.
+        return None
+
+    def _is_compatible(self, path, elf_file):
+        try:
+            library = self._read(path)
+        except elf.ElfError:
+            return False
+        return library is not None and library.is_compatible(elf_file)
+
+    def _read(self, path):
+        try:
+            return self._elf_files[path]
+        except KeyError:
+            pass
+        try:
+            elf_file = elf.read(path)
+        except elf.ElfError as e:
+            if isinstance(e.__cause__,
+                          (FileNotFoundError, NotADirectoryError)):
+                elf_file = None
+            else:
+                raise
+        self._elf_files[path] = elf_file
+        return elf_file
+
+    def _get_ld_so_cache(self):
+        if self._ld_so_cache is None:
+            self._ld_so_cache = _read_ld_so_cache(self._ld_so_cache_path)
+        return self._ld_so_cache
+
+
+def _rpath(elf_file):
+    # The RPATH of an object is ignored when it has a RUNPATH.
+    return elf_file.rpath if elf_file.runpath is None else None
+
+
+def _search_path(elf_file, dirs, main):
+    if not dirs:
+        return []
+    # $ORIGIN is the directory the object was loaded from, the other dynamic
+    # string tokens depend on the system running it.
+    if elf_file is main:
+        origin = os.path.dirname(os.path.realpath(elf_file.path))
+    else:
+        origin = os.path.dirname(elf_file.path)
+    expanded = []
+    for d in dirs:
+        d = d.replace('${ORIGIN}', origin).replace('$ORIGIN', origin)
+        expanded.append(None if '$' in d else d or '.')
+    return expanded
+
+
+def _unique(dirs):
+    seen = set()
+    for d in dirs:
+        if d not in seen:
+            seen.add(d)
+            yield d
+
+
+def _in_hwcap_subdir(d, name):
+    for subdir in _HWCAP_SUBDIRS:
+        subdir = os.path.join(d, subdir)
+        if not os.path.isdir(subdir):
+            continue
+        if (os.path.exists(os.path.join(subdir, name)) or
+                glob.glob(os.path.join(glob.escape(subdir), '*', name))):
+            return True
+    return False
+
+
+def _cache_flags(elf_file):
+    if (elf_file.machine == 40 and
+            elf_file.flags & _EF_ARM_ABI_FLOAT_HARD):
+        return _LD_SO_CACHE_ARMHF_FLAGS
+    return _LD_SO_CACHE_FLAGS.get((elf_file.elf_class, elf_file.machine))
+
+
+def _read_ld_so_cache(path):
+    """Return the entries of an ld.so.cache by library name.
+
+    Each entry is a (flags, path, hwcap) tuple. A cache that cannot be read
+    has no entries.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.debug('Cannot read {!r}: {}'.format(path, e))
+        return {}
+
+    start = 0
+    if data.startswith(_LD_SO_CACHE_OLD_MAGIC):
+        # The current format follows the entries of the old one.
+        nlibs = struct.unpack_from('=I', data, 12)[0]
+        start = 16 + nlibs * 12
+        start += -start % 8
+    if data[start:start + len(_LD_SO_CACHE_MAGIC)] != _LD_SO_CACHE_MAGIC:
+        logger.debug('Unknown format for {!r}'.format(path))
+        return {}
+
+    def string(offset):
+        offset += start
+        return os.fsdecode(data[offset:data.index(b'\0', offset)])
+
+    entries = {}
+    try:
+        nlibs = struct.unpack_from('=I', data, start + 20)[0]
+        for index in range(nlibs):
+            flags, key, value, _, hwcap = struct.unpack_from(
+                '=iIIIQ', data, start + 48 + index * 24)
+            entries.setdefault(string(key), []).append(
+                (flags, string(value), hwcap))
+    except (struct.error, ValueError) as e:
+        logger.debug('Cannot read {!r}: {}'.format(path, e))
+        return {}
+    return entries
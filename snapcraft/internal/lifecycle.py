@@ -19,6 +19,7 @@ import logging
 import os
 import shutil
 import tarfile
+import threading
 import time
 from subprocess import check_call, Popen, PIPE, STDOUT
 from tempfile import TemporaryDirectory
@@ -31,12 +32,15 @@ from snapcraft import formatting_utils
 import snapcraft.internal
 from snapcraft.internal import (
     common,
+    jobserver,
     lxd,
     meta,
     pluginhandler,
     repo,
+    scheduler,
+    tracing,
 )
-from snapcraft.internal.cache import SnapCache
+from snapcraft.internal.cache import CacheManager, SnapCache
 from snapcraft.internal.indicators import is_dumb_terminal
 from snapcraft.internal.project_loader import replace_attr
 
@@ -114,7 +118,19 @@ def execute(step, project_options, part_names=None):
             config.data['confinement'] == 'classic'):
         _setup_core(project_options.deb_arch)
 
-    _Executor(config, project_options).run(step, part_names)
+    if project_options.trace_file:
+        tracing.start()
+    _start_jobserver(project_options)
+    started = int(time.time())
+    try:
+        _Executor(config, project_options).run(step, part_names)
+    finally:
+        jobserver.stop()
+        repo.close_archive()
+        if project_options.trace_file:
+            _write_trace(project_options.trace_file)
+
+    _prune_caches(keep_since=started)
 
     return {'name': config.data['name'],
             'version': config.data['version'],
@@ -122,6 +138,35 @@ def execute(step, project_options, part_names=None):
             'type': config.data.get('type', '')}
 
 
+def _start_jobserver(project_options):
+    # The builds of all the parts share the jobs the machine can run, instead
+    # of each of them running as many jobs as there are CPUs.
+    slots = jobserver.get_slots(project_options.parallel_build_count,
+                                job_memory=project_options.job_memory)
+    if slots > 1:
+        jobserver.start(slots, builds=project_options.jobs)
+
+
+def _write_trace(trace_file):
+    tracer = tracing.stop()
+    tracer.write(trace_file)
+    logger.info('Time spent in each step, slowest first (trace written to '
+                '{!r}):\n{}'.format(trace_file, tracer.summary()))
+
+
+def _prune_caches(*, keep_since):
+    # What this run used is kept, for the next one to use it again.
+    try:
+        pruned = CacheManager().prune_if_due(keep_since=keep_since)
+    except EnvironmentError as e:
+        logger.warning('Not pruning the caches: {}'.format(e))
+        return
+
+    if pruned and pruned.entries:
+        logger.info('Evicted {} unused cache entries, reclaiming {}'.format(
+            len(pruned.entries), formatting_utils.humanize_size(pruned.size)))
+
+
 def _setup_core(deb_arch):
     core_path = common.get_core_path()
     if os.path.exists(core_path) and os.listdir(core_path):
@@ -173,12 +218,19 @@ class _Executor:
         self.project_options = project_options
         self.parts_config = config.parts
         self._steps_run = self._init_run_states()
+        self._steps_run_lock = threading.Lock()
+        # Steps touching the shared stage and prime directories are never
+        # run concurrently.
+        self._shared_area_lock = threading.Lock()
+        # The files of the parts staged, to check the next ones against.
+        self._staged_files = None
 
     def _init_run_states(self):
         steps_run = {}
 
         for part in self.config.all_parts:
             steps_run[part.name] = set()
+            self._handle_source_change(part)
             for step in common.COMMAND_ORDER:
                 dirty_report = part.get_dirty_report(step)
                 if dirty_report:
@@ -200,6 +252,13 @@ class _Executor:
             parts = self.config.all_parts
             part_names = self.config.part_names
 
+        self._fetch_stage_packages(parts)
+
+        if self.project_options.jobs > 1:
+            self._run_concurrently(step, parts, part_names)
+            self._create_meta(step, part_names)
+            return
+
         step_index = common.COMMAND_ORDER.index(step) + 1
 
         for step in common.COMMAND_ORDER[0:step_index]:
@@ -212,6 +271,12 @@ class _Executor:
 
         self._create_meta(step, part_names)
 
+    def _fetch_stage_packages(self, parts):
+        pulling = [p for p in parts if 'pull' not in self._steps_run[p.name]]
+        if pulling:
+            with tracing.span('stage packages', category='phase'):
+                pluginhandler.fetch_stage_packages(pulling)
+
     def _run_step(self, step, part, part_names):
         common.reset_env()
         prereqs = self.parts_config.get_prereqs(part.name)
@@ -219,13 +284,7 @@ class _Executor:
                             if 'stage' not in self._steps_run[p]}
 
         if unstaged_prereqs and not unstaged_prereqs.issubset(part_names):
-            missing_parts = [part_name for part_name in self.config.part_names
-                             if part_name in unstaged_prereqs]
-            if missing_parts:
-                raise RuntimeError(
-                    'Requested {!r} of {!r} but there are unsatisfied '
-                    'prerequisites: {!r}'.format(
-                        step, part.name, ' '.join(missing_parts)))
+            self._raise_unsatisfied_prereqs(step, part, unstaged_prereqs)
         elif unstaged_prereqs:
             # prerequisites need to build all the way to the staging
             # step to be able to share the common assets that make them
@@ -235,22 +294,149 @@ class _Executor:
                 '{}'.format(part.name, ' '.join(unstaged_prereqs)))
             self.run('stage', unstaged_prereqs)
 
-        # Run the preparation function for this step (if implemented)
-        with contextlib.suppress(AttributeError):
-            getattr(part, 'prepare_{}'.format(step))()
+        self._execute_step(step, part)
+
+    def _raise_unsatisfied_prereqs(self, step, part, unstaged_prereqs):
+        missing_parts = [part_name for part_name in self.config.part_names
+                         if part_name in unstaged_prereqs]
+        if missing_parts:
+            raise RuntimeError(
+                'Requested {!r} of {!r} but there are unsatisfied '
+                'prerequisites: {!r}'.format(
+                    step, part.name, ' '.join(missing_parts)))
+
+    def _execute_step(self, step, part):
+        # The preparation is part of the step, as far as tracing goes.
+        with tracing.span(step, category='step', part=part.name):
+            # Run the preparation function for this step (if implemented)
+            with contextlib.suppress(AttributeError):
+                getattr(part, 'prepare_{}'.format(step))()
+
+            env = self.parts_config.build_env_for_part(part)
+            env.extend(self.config.project_env())
+            common.set_env(env)
+
+            part = _replace_in_part(part)
+            if step in ('stage', 'prime'):
+                # Files the other parts migrated as well are left in place
+                # when the step updates what it migrated before.
+                getattr(part, step)(
+                    project_state=self.config.get_project_state(step))
+            else:
+                getattr(part, step)()
+
+        if step == 'stage':
+            # The build env of the parts depending upon this one now has
+            # to include what it staged.
+            self.parts_config.clear_build_env_cache()
+
+    def _run_concurrently(self, step, parts, part_names):
+        step_scheduler = scheduler.Scheduler(jobs=self.project_options.jobs)
+        self._schedule(step_scheduler, step, parts, part_names)
+        step_scheduler.run(self._run_scheduled_step)
+
+    def _schedule(self, step_scheduler, step, parts, part_names):
+        """Add a (part name, step) node for every step that needs to run.
+
+        The rules are the same as for the sequential run: a part's steps run
+        in order, and all of its prerequisites must be staged before any of
+        its steps run.
+        """
 
-        common.env = self.parts_config.build_env_for_part(part)
-        common.env.extend(self.config.project_env())
+        step_index = common.COMMAND_ORDER.index(step) + 1
 
-        part = _replace_in_part(part)
-        getattr(part, step)()
+        for part in parts:
+            steps = [s for s in common.COMMAND_ORDER[0:step_index]
+                     if s not in self._steps_run[part.name]]
+            if not steps:
+                continue
+
+            prereqs = self.parts_config.get_prereqs(part.name)
+            unstaged_prereqs = {p for p in prereqs
+                                if 'stage' not in self._steps_run[p]}
+            # Prerequisites already scheduled to be staged are as good as
+            # staged here.
+            unscheduled_prereqs = {p for p in unstaged_prereqs
+                                   if (p, 'stage') not in step_scheduler}
+
+            if (unscheduled_prereqs and
+                    not unscheduled_prereqs.issubset(part_names)):
+                self._raise_unsatisfied_prereqs(
+                    steps[0], part, unscheduled_prereqs)
+            elif unscheduled_prereqs:
+                logger.info(
+                    '{!r} has prerequisites that need to be staged: '
+                    '{}'.format(part.name, ' '.join(unscheduled_prereqs)))
+                self._schedule(
+                    step_scheduler, 'stage',
+                    [p for p in self.config.all_parts
+                     if p.name in unscheduled_prereqs],
+                    unscheduled_prereqs)
+
+            requires = [(p, 'stage') for p in unstaged_prereqs]
+            for index, part_step in enumerate(steps):
+                if index > 0:
+                    requires.append((part.name, steps[index-1]))
+                step_scheduler.add((part.name, part_step), requires)
+
+    def _run_scheduled_step(self, node):
+        part_name, step = node
+        part = self.parts_config.get_part(part_name)
+
+        with common.thread_env():
+            if step in ('stage', 'prime'):
+                with self._shared_area_lock:
+                    if step == 'stage':
+                        self._check_for_collisions(part)
+                    self._execute_step(step, part)
+            else:
+                self._execute_step(step, part)
+
+        with self._steps_run_lock:
+            self._steps_run[part_name].add(step)
+
+    def _check_for_collisions(self, part):
+        # Only the part being staged is checked, against the parts staged
+        # before it. Parts that are not staged yet are left out; any
+        # collision with them is found once they are staged.
+        if self._staged_files is None:
+            self._staged_files = pluginhandler.CollisionIndex()
+            with self._steps_run_lock:
+                staged = [p for p in self.config.all_parts
+                          if 'stage' in self._steps_run[p.name]]
+            for staged_part in staged:
+                self._staged_files.add(staged_part)
+
+        self._staged_files.add(part)
 
     def _create_meta(self, step, part_names):
         if step == 'prime' and part_names == self.config.part_names:
-            common.env = self.config.snap_env()
+            common.set_env(self.config.snap_env())
             meta.create_snap_packaging(self.config.data,
                                        self.project_options)
 
+    def _handle_source_change(self, part):
+        step = part.get_source_dirty_step()
+        if not step:
+            return
+
+        staged_state = self.config.get_project_state('stage')
+        primed_state = self.config.get_project_state('prime')
+
+        # Only this part and the parts built against it need to run again,
+        # everything else is left untouched. Parts are sorted, so dependents
+        # are cleaned before their run states are initialized.
+        dependents = self.parts_config.get_dependents(
+            part.name, recursive=True)
+        for dependent in self.config.all_parts:
+            if dependent.name in dependents:
+                dependent.clean(staged_state, primed_state, 'build',
+                                '(dependency source changed)',
+                                incremental=True)
+
+        part.clean(staged_state, primed_state, step, '(source changed)',
+                   incremental=True)
+
     def _handle_dirty(self, part, step, dirty_report):
         if step not in _STEPS_TO_AUTOMATICALLY_CLEAN_IF_DIRTY:
             message_components = [
@@ -308,7 +494,8 @@ class _Executor:
                             step, part.name, humanized_parts,
                             pluralized_depends))
 
-        part.clean(staged_state, primed_state, step, '(out of date)')
+        part.clean(staged_state, primed_state, step, '(out of date)',
+                   incremental=True)
 
 
 def _create_tar_filter(tar_filename):
@@ -416,21 +603,11 @@ def snap(project_options, directory=None, output=None):
     return snap_name
 
 
-def _reverse_dependency_tree(config, part_name):
-    dependents = config.parts.get_dependents(part_name)
-    for dependent in dependents.copy():
-        # No need to worry about infinite recursion due to circular
-        # dependencies since the YAML validation won't allow it.
-        dependents |= _reverse_dependency_tree(config, dependent)
-
-    return dependents
-
-
 def _clean_part_and_all_dependents(part_name, step, config, staged_state,
                                    primed_state):
     # Obtain the reverse dependency tree for this part. Make sure all
     # dependents are cleaned.
-    dependents = _reverse_dependency_tree(config, part_name)
+    dependents = config.parts.get_dependents(part_name, recursive=True)
     dependent_parts = {p for p in config.all_parts
                        if p.name in dependents}
     for dependent_part in dependent_parts:
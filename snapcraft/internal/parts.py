@@ -15,9 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import difflib
+import heapq
 import logging
 import os
+import re
 import sys
+import threading
 
 import requests
 import yaml
@@ -27,10 +30,12 @@ from snapcraft.internal.indicators import download_requests_stream
 from snapcraft.internal.common import get_terminal_width
 from snapcraft.internal.errors import SnapcraftPartMissingError
 from snapcraft.internal import (
+    common,
     deprecations,
     pluginhandler,
     project_loader,
-    repo
+    repo,
+    states,
 )
 
 
@@ -38,6 +43,7 @@ PARTS_URI = 'https://parts.snapcraft.io/v1/parts.yaml'
 _MATCH_RATIO = 0.6
 _HEADER_PART_NAME = 'PART NAME'
 _HEADER_DESCRIPTION = 'DESCRIPTION'
+_EXPORT_RE = re.compile(r'(\w+)=(.*)$', re.DOTALL)
 
 logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 logger = logging.getLogger(__name__)
@@ -158,6 +164,9 @@ class PartsConfig:
         self._parts_data = parts.get('parts', {})
         self._project_options = project_options
         self._validator = validator
+        # One store holds the states of all the parts.
+        self._state_store = states.StateStore(
+            os.path.join(project_options.parts_dir, 'state.db'))
         self.build_tools = build_tools
         self._snapcraft_yaml = snapcraft_yaml
 
@@ -165,6 +174,10 @@ class PartsConfig:
         self._part_names = []
         self.after_requests = {}
 
+        self._dependency_envs = {}
+        self._dependency_envs_generation = 0
+        self._dependency_envs_lock = threading.Lock()
+
         self._process_parts()
 
     @property
@@ -199,59 +212,110 @@ class PartsConfig:
         self.all_parts = self._sort_parts()
 
     def _compute_dependencies(self):
-        '''Gather the lists of dependencies and adds to all_parts.'''
+        '''Build the dependency graph and add dependencies to all_parts.
+
+        Both the prerequisites and the dependents of every part are indexed
+        by name, so that walking the graph in either direction is linear.
+        '''
+
+        self._parts_by_name = {part.name: part for part in self.all_parts}
+        self._prerequisites = {}
+        self._dependents = {name: set() for name in self._part_names}
+        self._prerequisite_closures = {}
+        self._dependent_closures = {}
+
+        for part_name in self._part_names:
+            dep_names = []
+            for dep in self.after_requests.get(part_name, []):
+                if dep not in dep_names:
+                    dep_names.append(dep)
+                    self._dependents.setdefault(dep, set()).add(part_name)
+            self._prerequisites[part_name] = dep_names
 
         for part in self.all_parts:
-            dep_names = self.after_requests.get(part.name, [])
-            for dep in dep_names:
-                for i in range(len(self.all_parts)):
-                    if dep == self.all_parts[i].name:
-                        part.deps.append(self.all_parts[i])
-                        break
+            part.deps.extend(self._parts_by_name[dep]
+                             for dep in self._prerequisites[part.name]
+                             if dep in self._parts_by_name)
 
     def _sort_parts(self):
-        '''Performs an inneficient but easy to follow sorting of parts.'''
-        sorted_parts = []
+        '''Sort parts so that every part comes after its dependencies.
 
-        while self.all_parts:
-            top_part = None
-            for part in self.all_parts:
-                mentioned = False
-                for other in self.all_parts:
-                    if part in other.deps:
-                        mentioned = True
-                        break
-                if not mentioned:
-                    top_part = part
-                    break
-            if not top_part:
-                raise SnapcraftLogicError(
-                    'circular dependency chain found in parts definition')
-            sorted_parts = [top_part] + sorted_parts
-            self.all_parts.remove(top_part)
+        Parts are taken in reverse, dependents first and in the order they
+        are defined in, so that independent parts keep a stable order.
+        '''
 
+        index = {part.name: i for i, part in enumerate(self.all_parts)}
+        pending = {part.name: len(self._dependents[part.name] & index.keys())
+                   for part in self.all_parts}
+        ready = [index[name] for name, count in pending.items() if not count]
+        heapq.heapify(ready)
+
+        sorted_parts = []
+        while ready:
+            part = self.all_parts[heapq.heappop(ready)]
+            sorted_parts.append(part)
+            for dep_name in self._prerequisites[part.name]:
+                if dep_name not in index:
+                    continue
+                pending[dep_name] -= 1
+                if not pending[dep_name]:
+                    heapq.heappush(ready, index[dep_name])
+
+        if len(sorted_parts) < len(self.all_parts):
+            cycle = self._find_cycle(
+                [name for name, count in pending.items() if count])
+            raise SnapcraftLogicError(
+                'circular dependency chain found in parts definition: '
+                '{}'.format(' -> '.join(cycle)))
+
+        sorted_parts.reverse()
         return sorted_parts
 
-    def get_prereqs(self, part_name):
-        """Returns a set with all of part_names' prerequisites."""
-        return set(self.after_requests.get(part_name, []))
+    def _find_cycle(self, part_names):
+        # Every part left unsorted has a dependent left unsorted, so
+        # following dependents among them always gets back to a part
+        # already seen.
+        unsorted = set(part_names)
+        path = [part_names[0]]
+        while True:
+            name = min(self._dependents[path[-1]] & unsorted)
+            if name in path:
+                cycle = path[path.index(name):] + [name]
+                # Show the chain from dependents to prerequisites, the way
+                # 'after' reads.
+                return list(reversed(cycle))
+            path.append(name)
+
+    def get_prereqs(self, part_name, recursive=False):
+        """Returns a set with all of part_names' prerequisites.
+
+        :param str part_name: The part to get the prerequisites of.
+        :param bool recursive: Whether to include the prerequisites of the
+                               prerequisites, and so on.
+        """
 
-    def get_dependents(self, part_name):
-        """Returns a set of all the parts that depend upon part_name."""
+        if recursive:
+            return set(_closure(
+                self._prerequisites, self._prerequisite_closures, part_name))
 
-        dependents = set()
-        for part, prerequisites in self.after_requests.items():
-            if part_name in prerequisites:
-                dependents.add(part)
+        return set(self._prerequisites.get(part_name, ()))
 
-        return dependents
+    def get_dependents(self, part_name, recursive=False):
+        """Returns a set of all the parts that depend upon part_name.
 
-    def get_part(self, part_name):
-        for part in self.all_parts:
-            if part.name == part_name:
-                return part
+        :param str part_name: The part to get the dependents of.
+        :param bool recursive: Whether to include the parts that depend upon
+                               the dependents, and so on.
+        """
 
-        return None
+        if recursive:
+            return set(_closure(
+                self._dependents, self._dependent_closures, part_name))
+
+        return set(self._dependents.get(part_name, ()))
+
+    def get_part(self, part_name):
+        return self._parts_by_name.get(part_name)
 
     def clean_part(self, part_name, staged_state, primed_state, step):
         part = self.get_part(part_name)
@@ -271,7 +335,8 @@ class PartsConfig:
             part_properties=part_properties,
             project_options=self._project_options,
             part_schema=self._validator.part_schema,
-            definitions_schema=self._validator.definitions_schema)
+            definitions_schema=self._validator.definitions_schema,
+            state_store=self._state_store)
 
         self.build_tools += part.code.build_packages
         if part.source_handler and part.source_handler.command:
@@ -282,7 +347,12 @@ class PartsConfig:
         return part
 
     def build_env_for_part(self, part, root_part=True):
-        """Return a build env of all the part's dependencies."""
+        """Return a build env of all the part's dependencies.
+
+        Exports repeated through several dependencies are only kept once,
+        where they decide the value of their variable: the first copy of
+        those appending to a variable, the last of those prepending to it.
+        """
 
         env = []
         stagedir = self._project_options.stage_dir
@@ -310,18 +380,115 @@ class PartsConfig:
             env.append('SNAPCRAFT_PART_INSTALL={}'.format(part.installdir))
             env.append('SNAPCRAFT_PARALLEL_BUILD_COUNT={}'.format(
                        self._project_options.parallel_build_count))
+            env += part.jobserver_env()
         else:
             env += part.env(stagedir)
             env += project_loader._runtime_env(
                 stagedir, self._project_options.arch_triplet)
 
         for dep_part in part.deps:
-            env += dep_part.env(stagedir)
-            env += self.build_env_for_part(dep_part, root_part=False)
+            env += self._dependency_env(dep_part)
+
+        if root_part:
+            # The compilers behind ccache have to be found before any other.
+            env += part.compiler_cache_env()
+
+        return _deduplicate_env(env)
+
+    def build_env_dict_for_part(self, part):
+        """Return the build env of part as a dict of environment variables.
+
+        The dict is meant to be passed as the env of subprocess calls that
+        do not go through a shell.
+        """
+
+        return common.resolve_env(self.build_env_for_part(part))
+
+    def clear_build_env_cache(self):
+        """Forget the build envs of dependencies.
+
+        They depend on what is in the stage directory, so this needs to be
+        called whenever something is staged or unstaged.
+        """
+
+        with self._dependency_envs_lock:
+            self._dependency_envs.clear()
+            self._dependency_envs_generation += 1
+
+    def _dependency_env(self, part):
+        # Every part that depends upon part, directly or not, gets the same
+        # env for it, so it is only computed once however many paths lead
+        # to it in the dependency graph.
+        with self._dependency_envs_lock:
+            env = self._dependency_envs.get(part.name)
+            generation = self._dependency_envs_generation
+        if env is not None:
+            return env
+
+        env = self.build_env_for_part(part, root_part=False)
+
+        with self._dependency_envs_lock:
+            # Do not keep an env computed from a stage directory that has
+            # changed since.
+            if generation == self._dependency_envs_generation:
+                self._dependency_envs[part.name] = env
 
         return env
 
 
+def _deduplicate_env(env):
+    # A repeated export is only dropped where it cannot change the result:
+    # the later copies of one appending to its variable, as the first copy
+    # decides where its paths are searched, and the earlier copies of one
+    # prepending to it. Exports that set a variable otherwise are kept,
+    # unless they set it to what it was just set to, and the copies on
+    # either side of one are not compared.
+    kinds = [_export_kind(export) for export in env]
+    keep = [True] * len(env)
+    last = {}
+    for index, (name, export_kind) in enumerate(kinds):
+        if (export_kind == 'set' and last.get(name) == env[index] and
+                '$' not in env[index]):
+            keep[index] = False
+        last[name] = env[index]
+
+    for direction, kind in ((range(len(env)), 'append'),
+                            (reversed(range(len(env))), 'prepend')):
+        seen = {}
+        for index in direction:
+            name, export_kind = kinds[index]
+            if export_kind == kind:
+                exports = seen.setdefault(name, set())
+                if env[index] in exports:
+                    keep[index] = False
+                exports.add(env[index])
+            elif export_kind in ('set', 'other'):
+                seen.pop(name, None)
+
+    return [export for export, kept in zip(env, keep) if kept]
+
+
+def _export_kind(export):
+    match = _EXPORT_RE.match(export)
+    if not match:
+        return None, None
+
+    name, value = match.group(1), match.group(2)
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+        value = value[1:-1]
+    references = re.findall(r'\$(?:{0}\b|{{{0}}})'.format(name), value)
+    if not references:
+        return name, 'set'
+    elif len(references) > 1:
+        return name, 'other'
+    elif value.startswith(references[0]):
+        return name, 'append'
+    elif value.endswith(references[0]):
+        return name, 'prepend'
+
+    return name, 'other'
+
+
 def update():
     _Update().execute()
 
@@ -369,3 +536,19 @@ def search(part_match):
 
 def get_remote_parts():
     return _RemoteParts()
+
+
+def _closure(graph, closures, part_name):
+    # Parts cannot be added or removed once loaded, so the transitive
+    # closures are computed once and shared by all the lookups.
+    if part_name not in closures:
+        closure = set()
+        stack = [part_name]
+        while stack:
+            for name in graph.get(stack.pop(), ()):
+                if name not in closure:
+                    closure.add(name)
+                    stack.append(name)
+        closures[part_name] = frozenset(closure)
+
+    return closures[part_name]
@@ -14,19 +14,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import contextlib
 import copy
-import filecmp
 import importlib
+import json
 import logging
 import os
 import shutil
 import sys
+from stat import S_ISLNK, S_ISREG
+from concurrent import futures
 from glob import glob, iglob
 
 import jsonschema
-import magic
-import yaml
 
 import snapcraft
 from snapcraft import file_utils
@@ -38,18 +39,42 @@ from snapcraft.internal.errors import (
     SnapcraftSchemaError
 )
 from snapcraft.internal import (
+    cache,
     common,
+    elf,
+    jobserver,
     libraries,
     repo,
     sources,
     states,
+    tracing,
 )
 from ._scriptlets import ScriptRunner
 from ._build_attributes import BuildAttributes
+from ._fileset import FilesetMatcher
 from ._stage_package_handler import StagePackageHandler
 
 logger = logging.getLogger(__name__)
 
+# Files are migrated in batches of this size, concurrently when there is
+# more than one.
+_MIGRATION_BATCH_SIZE = 1000
+_MIGRATION_WORKERS = 8
+
+# The dependencies of this many ELF files are looked for concurrently.
+_DEPENDENCY_WORKERS = 8
+
+# Compilers put behind ccache for parts with the ccache build attribute,
+# along with the gcc and g++ of the target architecture.
+_CCACHE_COMPILERS = ['cc', 'c++', 'gcc', 'g++', 'clang', 'clang++']
+
+# Steps migrating files into the directories shared by all the parts.
+_SHARED_STEPS = ('stage', 'prime')
+
+# Digests of the files compared for collisions, by device, inode,
+# modification time and size.
+_file_digests = {}
+
 
 class DirtyReport:
     def __init__(self, dirty_properties, dirty_project_options):
@@ -69,7 +94,7 @@ class PluginHandler:
 
     def __init__(self, *, plugin_name, part_name,
                  part_properties, project_options, part_schema,
-                 definitions_schema):
+                 definitions_schema, state_store=None):
         self.valid = False
         self.code = None
         self.config = {}
@@ -92,6 +117,10 @@ class PluginHandler:
         parts_dir = project_options.parts_dir
         self.ubuntudir = os.path.join(parts_dir, part_name, 'ubuntu')
         self.statedir = os.path.join(parts_dir, part_name, 'state')
+        if state_store is None:
+            state_store = states.StateStore(
+                os.path.join(parts_dir, 'state.db'))
+        self._state_store = state_store
         self.sourcedir = os.path.join(parts_dir, part_name, 'src')
 
         self.source_handler = self._get_source_handler(self._part_properties)
@@ -110,6 +139,10 @@ class PluginHandler:
             raise PluginError('properties failed to load for {}: {}'.format(
                 part_name, error.message))
 
+        if (self._build_attributes.ccache() and
+                'ccache' not in self.code.build_packages):
+            self.code.build_packages.append('ccache')
+
         stage_packages = getattr(self.code, 'stage_packages', [])
         sources = getattr(self.code, 'PLUGIN_STAGE_SOURCES', None)
         self._stage_package_handler = StagePackageHandler(
@@ -213,6 +246,9 @@ class PluginHandler:
     def notify_part_progress(self, progress, hint=''):
         logger.info('%s %s %s', progress, self.name, hint)
 
+    def _trace(self, phase):
+        return tracing.span(phase, category='phase', part=self.name)
+
     def last_step(self):
         for step in reversed(common.COMMAND_ORDER):
             if os.path.exists(self._step_state_file(step)):
@@ -267,6 +303,40 @@ class PluginHandler:
 
         return None
 
+    def get_source_fingerprint(self):
+        """Return a fingerprint of the source as it is now.
+
+        Returns None if the source cannot be fingerprinted.
+        """
+
+        if self.source_handler:
+            return self.source_handler.get_fingerprint()
+
+        return None
+
+    def get_source_dirty_step(self):
+        """Return the first step that ran on a source that has since changed.
+
+        Returns None if neither the pull nor the build step ran on a different
+        source, or if that cannot be told (the source has no fingerprint, or
+        the step was run by a version of snapcraft not recording it).
+        """
+
+        if self.is_clean('pull'):
+            return None
+
+        fingerprint = self.get_source_fingerprint()
+        if fingerprint is None:
+            return None
+
+        for step in ('pull', 'build'):
+            state = self.get_state(step)
+            recorded = getattr(state, 'assets', {}).get('source-fingerprint')
+            if recorded and recorded != fingerprint:
+                return step
+
+        return None
+
     def should_step_run(self, step, force=False):
         return force or self.is_clean(step)
 
@@ -277,34 +347,77 @@ class PluginHandler:
         index = common.COMMAND_ORDER.index(step)
 
         with open(self._step_state_file(step), 'w') as f:
-            f.write(yaml.dump(state))
+            f.write(states.dump(state))
 
         # We know we've only just completed this step, so make sure any later
-        # steps don't have a saved state.
+        # steps don't have a saved state. What they migrated is left in
+        # place to be updated once they run again.
         if index+1 != len(common.COMMAND_ORDER):
             for command in common.COMMAND_ORDER[index+1:]:
-                self.mark_cleaned(command)
+                if command in _SHARED_STEPS:
+                    self.supersede(command)
+                else:
+                    self.mark_cleaned(command)
 
     def mark_cleaned(self, step):
         state_file = self._step_state_file(step)
         if os.path.exists(state_file):
             os.remove(state_file)
+            self._state_store.remove(self.name, step)
 
         if os.path.isdir(self.statedir) and not os.listdir(self.statedir):
             os.rmdir(self.statedir)
 
     def get_state(self, step):
-        state = None
-        state_file = self._step_state_file(step)
-        if os.path.isfile(state_file):
-            with open(state_file, 'r') as f:
-                state = yaml.load(f.read())
-
-        return state
+        return self._state_store.get(
+            self.name, step, self._step_state_file(step))
 
     def _step_state_file(self, step):
         return os.path.join(self.statedir, step)
 
+    def supersede(self, step):
+        """Mark the shared step as clean, leaving its files in place.
+
+        The state of the step is kept as its previous state, which the
+        next run of the step updates the stage or prime directory from
+        instead of migrating every file again.
+        """
+
+        state = self.get_state(step)
+        if not state:
+            self.mark_cleaned(step)
+            return
+
+        # Files of an earlier run of the step that never ran again are
+        # still there too.
+        previous = self.get_previous_state(step)
+        if previous:
+            for name in state.file_set_attributes:
+                setattr(state, name,
+                        getattr(state, name) | getattr(previous, name))
+
+        state_file = self._previous_state_file(step)
+        with open(state_file, 'w') as f:
+            f.write(states.dump(state))
+        self._state_store.put(self.name, _previous_step(step), state_file,
+                              state)
+        self.mark_cleaned(step)
+
+    def get_previous_state(self, step):
+        """Return the state step had when it was superseded, if any."""
+
+        return self._state_store.get(
+            self.name, _previous_step(step), self._previous_state_file(step))
+
+    def _forget_previous_state(self, step):
+        state_file = self._previous_state_file(step)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+            self._state_store.remove(self.name, _previous_step(step))
+
+    def _previous_state_file(self, step):
+        return os.path.join(self.statedir, _previous_step(step))
+
     def _fetch_stage_packages(self):
         try:
             self.stage_packages = self._stage_package_handler.fetch()
@@ -318,15 +431,18 @@ class PluginHandler:
     def prepare_pull(self, force=False):
         self.makedirs()
         self.notify_part_progress('Preparing to pull')
-        self._fetch_stage_packages()
-        self._unpack_stage_packages()
+        with self._trace('stage packages'):
+            self._fetch_stage_packages()
+            self._unpack_stage_packages()
 
     def pull(self, force=False):
         self.makedirs()
         self.notify_part_progress('Pulling')
         if self.source_handler:
-            self.source_handler.pull()
-        self.code.pull()
+            with self._trace('source pull'):
+                self.source_handler.pull()
+        with self._trace('plugin pull'):
+            self.code.pull()
 
         self.mark_pull_done()
 
@@ -335,9 +451,16 @@ class PluginHandler:
 
         self.mark_done('pull', states.PullState(
             pull_properties, part_properties=self._part_properties,
-            project=self._project_options, stage_packages=self.stage_packages))
+            project=self._project_options, stage_packages=self.stage_packages,
+            source_fingerprint=self.get_source_fingerprint()))
+
+    def clean_pull(self, hint='', *, incremental=False):
+        """Clean the pull step.
+
+        With incremental, the pulled source is kept if the source handler
+        only updates what changed when pulling again.
+        """
 
-    def clean_pull(self, hint=''):
         if self.is_clean('pull'):
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning pulled source for',
@@ -349,10 +472,12 @@ class PluginHandler:
         if os.path.exists(self.ubuntudir):
             shutil.rmtree(self.ubuntudir)
 
+        keep_source = (incremental and self.source_handler and
+                       self.source_handler.incremental_pull)
         if os.path.exists(self.sourcedir):
             if os.path.islink(self.sourcedir):
                 os.remove(self.sourcedir)
-            else:
+            elif not keep_source:
                 shutil.rmtree(self.sourcedir)
 
         self.code.clean_pull()
@@ -363,15 +488,13 @@ class PluginHandler:
         self.notify_part_progress('Preparing to build')
         # Stage packages are fetched and unpacked in the pull step, but we'll
         # unpack again here just in case the build step has been cleaned.
-        self._unpack_stage_packages()
+        with self._trace('stage packages'):
+            self._unpack_stage_packages()
 
     def build(self, force=False):
         self.makedirs()
         self.notify_part_progress('Building')
 
-        if os.path.exists(self.code.build_basedir):
-            shutil.rmtree(self.code.build_basedir)
-
         # FIXME: It's not necessary to ignore here anymore since it's now done
         # in the Local source. However, it's left here so that it continues to
         # work on old snapcraft trees that still have src symlinks.
@@ -386,42 +509,165 @@ class PluginHandler:
             else:
                 return []
 
-        shutil.copytree(self.code.sourcedir, self.code.build_basedir,
-                        symlinks=True, ignore=ignore)
+        # Without the sources of the previous build, what the build added to
+        # the tree cannot be told apart from what was removed from the source.
+        incremental = (self._build_attributes.incremental() and
+                       os.path.isdir(self.code.build_basedir) and
+                       os.path.exists(self._build_sources_file()))
+        if incremental:
+            with self._trace('sync build tree'):
+                self._sync_build_tree(ignore)
+        else:
+            if os.path.exists(self.code.build_basedir):
+                shutil.rmtree(self.code.build_basedir)
+
+            with self._trace('copytree'):
+                shutil.copytree(self.code.sourcedir, self.code.build_basedir,
+                                symlinks=True, ignore=ignore)
+
+        if self._build_attributes.incremental():
+            # The next build needs to know what came from the source.
+            _write_build_sources(self._build_sources_file(),
+                                 self.code.sourcedir, ignore)
+
+        compiler_cache = None
+        if self._build_attributes.ccache():
+            compiler_cache = self._setup_compiler_cache()
 
         script_runner = ScriptRunner(builddir=self.code.build_basedir)
 
-        script_runner.run(scriptlet=self._part_properties.get('prepare'))
-        build_scriptlet = self._part_properties.get('build')
-        if build_scriptlet:
-            script_runner.run(scriptlet=build_scriptlet)
-        else:
-            self.code.build()
-        script_runner.run(scriptlet=self._part_properties.get('install'))
+        with self._trace('plugin build'):
+            script_runner.run(scriptlet=self._part_properties.get('prepare'))
+            build_scriptlet = self._part_properties.get('build')
+            if build_scriptlet:
+                script_runner.run(scriptlet=build_scriptlet)
+            else:
+                self.code.build()
+            script_runner.run(scriptlet=self._part_properties.get('install'))
+
+        if compiler_cache:
+            self._report_compiler_cache_stats(compiler_cache)
+
+        self.mark_build_done(incremental=incremental)
+
+    def compiler_cache_env(self):
+        """Return the exports putting the compilers of the part behind ccache.
+
+        Parts without the ccache build attribute get none.
+        """
+
+        if not self._build_attributes.ccache():
+            return []
+
+        return cache.CompilerCache().env(self._ccache_wrappers_dir(),
+                                         self._ccache_log_file())
+
+    def jobserver_env(self):
+        """Return the exports handing make the jobserver of the lifecycle.
+
+        Parts building without parallel jobs get none.
+        """
+
+        server = jobserver.get()
+        if not server or getattr(self.code, 'parallel_build_count', 1) < 2:
+            return []
+
+        return ['MAKEFLAGS="$MAKEFLAGS {}"'.format(server.makeflags())]
+
+    def _setup_compiler_cache(self):
+        compiler_cache = cache.CompilerCache()
+        compilers = _CCACHE_COMPILERS + [
+            '{}-{}'.format(self._project_options.arch_triplet, compiler)
+            for compiler in ('gcc', 'g++')]
+        # Compilers may come from the stage directory as well as from the
+        # system, so they are looked for in the PATH of the build.
+        path = common.run_env().get('PATH', '')
+        if not compiler_cache.setup(self._ccache_wrappers_dir(), compilers,
+                                    path):
+            return None
+
+        # Only what this build compiles is reported.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._ccache_log_file())
+        return compiler_cache
+
+    def _report_compiler_cache_stats(self, compiler_cache):
+        hits, misses = compiler_cache.get_stats(self._ccache_log_file())
+        logger.info('Compiler cache for {!r}: {} hits, {} misses'.format(
+            self.name, hits, misses))
+        tracing.count('ccache hits', hits)
+        tracing.count('ccache misses', misses)
+
+    def _ccache_wrappers_dir(self):
+        return os.path.join(self.code.partdir, 'ccache')
+
+    def _ccache_log_file(self):
+        return os.path.join(self.code.partdir, 'ccache.log')
+
+    def _sync_build_tree(self, ignore):
+        """Bring the changes to the source into the kept build tree.
+
+        Whatever the build added to the tree is left in place, but what was
+        removed from the source is removed from the tree too.
+        """
+
+        build_basedir = self.code.build_basedir
+        build_sources = _read_build_sources(self._build_sources_file())
+
+        def delete(path):
+            return os.path.relpath(path, build_basedir) in build_sources
+
+        changes = file_utils.sync_tree(
+            self.code.sourcedir, build_basedir, ignore=ignore,
+            copy_function=shutil.copy2, delete=delete)
+        logger.debug('{} entries changed in {!r}'.format(
+            changes, build_basedir))
+        tracing.count('changed', changes)
 
-        self.mark_build_done()
+    def _build_sources_file(self):
+        return os.path.join(self.statedir, 'build.sources')
 
-    def mark_build_done(self):
+    def mark_build_done(self, *, incremental=False):
         build_properties = self.code.get_build_properties()
+        # The build is made from what was pulled, not from whatever the
+        # source may have become since.
+        pull_state = self.get_state('pull')
+        source_fingerprint = getattr(pull_state, 'assets', {}).get(
+            'source-fingerprint')
 
         self.mark_done('build', states.BuildState(
             build_properties, self._part_properties,
-            self._project_options))
+            self._project_options, source_fingerprint=source_fingerprint,
+            incremental=incremental))
+
+    def clean_build(self, hint='', *, incremental=False):
+        """Clean the build step.
+
+        With incremental, parts with the incremental build attribute keep
+        their build tree for the next build to carry on from.
+        """
 
-    def clean_build(self, hint=''):
         if self.is_clean('build'):
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning build for',
                                       hint)
             return
 
+        if os.path.exists(self.installdir):
+            shutil.rmtree(self.installdir)
+
+        if incremental and self._build_attributes.incremental():
+            self.notify_part_progress('Keeping build tree for', hint)
+            self.mark_cleaned('build')
+            return
+
         self.notify_part_progress('Cleaning build for', hint)
 
         if os.path.exists(self.code.build_basedir):
             shutil.rmtree(self.code.build_basedir)
 
-        if os.path.exists(self.installdir):
-            shutil.rmtree(self.installdir)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._build_sources_file())
 
         self.code.clean_build()
         self.mark_cleaned('build')
@@ -453,11 +699,13 @@ class PluginHandler:
 
         _organize_filesets(fileset.copy(), self.code.installdir)
 
-    def stage(self, force=False):
+    def stage(self, force=False, project_state=None):
         self.makedirs()
         self.notify_part_progress('Staging')
-        self._organize()
-        snap_files, snap_dirs = self.migratable_fileset_for('stage')
+        with self._trace('organize'):
+            self._organize()
+        with self._trace('collect files'):
+            snap_files, snap_dirs = self.migratable_fileset_for('stage')
 
         def fixup_func(file_path):
             if os.path.islink(file_path):
@@ -466,12 +714,17 @@ class PluginHandler:
                 return
             repo.fix_pkg_config(self.stagedir, file_path, self.code.installdir)
 
-        _migrate_files(snap_files, snap_dirs, self.code.installdir,
-                       self.stagedir, fixup_func=fixup_func)
+        migrate_files, migrate_dirs = self._update_shared_area(
+            'stage', snap_files, snap_dirs, self.code.installdir,
+            self.stagedir, project_state)
+        with self._trace('migrate files'):
+            _migrate_files(migrate_files, migrate_dirs, self.code.installdir,
+                           self.stagedir, fixup_func=fixup_func)
         # TODO once `snappy try` is in place we will need to copy
         # dependencies here too
 
         self.mark_stage_done(snap_files, snap_dirs)
+        self._forget_previous_state('stage')
 
     def mark_stage_done(self, snap_files, snap_dirs):
         self.mark_done('stage', states.StageState(
@@ -479,7 +732,8 @@ class PluginHandler:
             self._project_options))
 
     def clean_stage(self, project_staged_state, hint=''):
-        if self.is_clean('stage'):
+        previous = self.get_previous_state('stage')
+        if self.is_clean('stage') and not previous:
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning staging area for',
                                       hint)
@@ -490,22 +744,35 @@ class PluginHandler:
         state = self.get_state('stage')
 
         try:
-            self._clean_shared_area(self.stagedir, state,
-                                    project_staged_state)
+            if not self.is_clean('stage'):
+                self._clean_shared_area(self.stagedir, state,
+                                        project_staged_state)
+            if previous:
+                self._clean_shared_area(self.stagedir, previous,
+                                        project_staged_state)
         except AttributeError:
             raise MissingState(
                 "Failed to clean step 'stage': Missing necessary state. "
                 "This won't work until a complete clean has occurred.")
 
+        self._forget_previous_state('stage')
         self.mark_cleaned('stage')
 
-    def prime(self, force=False):
+    def prime(self, force=False, project_state=None):
         self.makedirs()
         self.notify_part_progress('Priming')
-        snap_files, snap_dirs = self.migratable_fileset_for('prime')
-        _migrate_files(snap_files, snap_dirs, self.stagedir, self.snapdir)
-
-        dependencies = _find_dependencies(self.snapdir, snap_files)
+        with self._trace('collect files'):
+            snap_files, snap_dirs = self.migratable_fileset_for('prime')
+        migrate_files, migrate_dirs = self._update_shared_area(
+            'prime', snap_files, snap_dirs, self.stagedir, self.snapdir,
+            project_state)
+        with self._trace('migrate files'):
+            _migrate_files(migrate_files, migrate_dirs, self.stagedir,
+                           self.snapdir)
+
+        with self._trace('find dependencies'):
+            dependencies = _find_dependencies(self.snapdir, snap_files,
+                                              self.stagedir)
 
         # Split the necessary dependencies into their corresponding location.
         # We'll both migrate and track the system dependencies, but we'll only
@@ -528,10 +795,12 @@ class PluginHandler:
                 # Lots of dependencies are linked with a symlink, so we need to
                 # make sure we follow those symlinks when we migrate the
                 # dependencies.
-                _migrate_files(system, system_dependency_paths, '/',
-                               self.snapdir, follow_symlinks=True)
+                with self._trace('migrate files'):
+                    _migrate_files(system, system_dependency_paths, '/',
+                                   self.snapdir, follow_symlinks=True)
 
         self.mark_prime_done(snap_files, snap_dirs, dependency_paths)
+        self._forget_previous_state('prime')
 
     def mark_prime_done(self, snap_files, snap_dirs, dependency_paths):
         self.mark_done('prime', states.PrimeState(
@@ -539,7 +808,8 @@ class PluginHandler:
             self._project_options))
 
     def clean_prime(self, project_primed_state, hint=''):
-        if self.is_clean('prime'):
+        previous = self.get_previous_state('prime')
+        if self.is_clean('prime') and not previous:
             hint = '{} {}'.format(hint, '(already clean)').strip()
             self.notify_part_progress('Skipping cleaning priming area for',
                                       hint)
@@ -550,19 +820,66 @@ class PluginHandler:
         state = self.get_state('prime')
 
         try:
-            self._clean_shared_area(self.snapdir, state,
-                                    project_primed_state)
+            if not self.is_clean('prime'):
+                self._clean_shared_area(self.snapdir, state,
+                                        project_primed_state)
+            if previous:
+                self._clean_shared_area(self.snapdir, previous,
+                                        project_primed_state)
         except AttributeError:
             raise MissingState(
                 "Failed to clean step 'prime': Missing necessary state. "
                 "This won't work until a complete clean has occurred.")
 
+        self._forget_previous_state('prime')
         self.mark_cleaned('prime')
 
+    def _update_shared_area(self, step, snap_files, snap_dirs, srcdir,
+                            dstdir, project_state):
+        """Return the files and directories step has to migrate.
+
+        Without a previous state that is all of them. Otherwise the files
+        that are no longer part of the step are removed, and only the new
+        or changed files and the new directories are returned.
+        """
+
+        previous = self.get_previous_state(step)
+        if not previous:
+            return snap_files, snap_dirs
+
+        with self._trace('remove files'):
+            self._remove_from_shared_area(
+                dstdir, previous.files - snap_files,
+                previous.directories - snap_dirs, project_state or {})
+        with self._trace('compare files'):
+            migrate_files = _changed_files(snap_files, srcdir, dstdir)
+            migrate_dirs = {d for d in snap_dirs
+                            if d not in previous.directories or
+                            not os.path.isdir(os.path.join(dstdir, d))}
+
+        logger.debug('{} of {} files to {} for {!r} changed'.format(
+            len(migrate_files), len(snap_files), step, self.name))
+        if tracing.is_enabled():
+            tracing.count('unchanged', len(snap_files) - len(migrate_files))
+
+        return migrate_files, migrate_dirs
+
+    def _supersede_shared_step(self, step, area, hint):
+        if self.is_clean(step):
+            hint = '{} {}'.format(hint, '(already clean)').strip()
+            self.notify_part_progress(
+                'Skipping cleaning {} area for'.format(area), hint)
+            return
+
+        self.notify_part_progress('Updating {} area for'.format(area), hint)
+        self.supersede(step)
+
     def _clean_shared_area(self, shared_directory, part_state, project_state):
-        primed_files = part_state.files
-        primed_directories = part_state.directories
+        self._remove_from_shared_area(shared_directory, part_state.files,
+                                      part_state.directories, project_state)
 
+    def _remove_from_shared_area(self, shared_directory, primed_files,
+                                 primed_directories, project_state):
         # We want to make sure we don't remove a file or directory that's
         # being used by another part. So we'll examine the state for all parts
         # in the project and leave any files or directories found to be in
@@ -591,7 +908,13 @@ class PluginHandler:
         return self.code.env(root)
 
     def clean(self, project_staged_state=None, project_primed_state=None,
-              step=None, hint=''):
+              step=None, hint='', *, incremental=False):
+        """Clean step and the steps after it, all of them by default.
+
+        With incremental, the files staged and primed are left in place to
+        be updated when the steps run again, see supersede().
+        """
+
         if not project_staged_state:
             project_staged_state = {}
 
@@ -600,7 +923,7 @@ class PluginHandler:
 
         try:
             self._clean_steps(project_staged_state, project_primed_state,
-                              step, hint)
+                              step, hint, incremental)
         except MissingState:
             # If one of the step cleaning rules is missing state, it must be
             # running on the output of an old Snapcraft. In that case, if we
@@ -621,7 +944,7 @@ class PluginHandler:
             os.rmdir(self.code.partdir)
 
     def _clean_steps(self, project_staged_state, project_primed_state,
-                     step=None, hint=None):
+                     step=None, hint=None, incremental=False):
         index = None
         if step:
             if step not in common.COMMAND_ORDER:
@@ -632,16 +955,47 @@ class PluginHandler:
             index = common.COMMAND_ORDER.index(step)
 
         if not index or index <= common.COMMAND_ORDER.index('prime'):
-            self.clean_prime(project_primed_state, hint)
+            if incremental:
+                self._supersede_shared_step('prime', 'priming', hint)
+            else:
+                self.clean_prime(project_primed_state, hint)
 
         if not index or index <= common.COMMAND_ORDER.index('stage'):
-            self.clean_stage(project_staged_state, hint)
+            if incremental:
+                self._supersede_shared_step('stage', 'staging', hint)
+            else:
+                self.clean_stage(project_staged_state, hint)
 
         if not index or index <= common.COMMAND_ORDER.index('build'):
-            self.clean_build(hint)
+            if incremental:
+                self.clean_build(hint, incremental=True)
+            else:
+                self.clean_build(hint)
 
         if not index or index <= common.COMMAND_ORDER.index('pull'):
-            self.clean_pull(hint)
+            self.clean_pull(hint, incremental=incremental)
+
+
+def _read_build_sources(path):
+    try:
+        with open(path) as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        return set()
+
+
+def _write_build_sources(path, sourcedir, ignore):
+    build_sources = []
+    for root, directories, files in os.walk(sourcedir):
+        ignored = ignore(root, directories + files)
+        directories[:] = [d for d in directories if d not in ignored]
+        build_sources.extend(
+            os.path.relpath(os.path.join(root, name), sourcedir)
+            for name in directories + files if name not in ignored)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(build_sources, f)
 
 
 def _split_dependencies(dependencies, installdir, stagedir, snapdir):
@@ -822,7 +1176,7 @@ def _load_local(module_name, local_plugin_dir):
 
 def load_plugin(part_name, *, plugin_name, part_properties=None,
                 project_options=None, part_schema=None,
-                definitions_schema=None):
+                definitions_schema=None, state_store=None):
     if part_properties is None:
         part_properties = {}
     if part_schema is None:
@@ -840,28 +1194,67 @@ def load_plugin(part_name, *, plugin_name, part_properties=None,
                          part_properties=part_properties,
                          project_options=project_options,
                          part_schema=part_schema,
-                         definitions_schema=definitions_schema)
+                         definitions_schema=definitions_schema,
+                         state_store=state_store)
 
 
 def _migratable_filesets(fileset, srcdir):
     includes, excludes = _get_file_list(fileset)
 
-    include_files = _generate_include_set(srcdir, includes)
-    exclude_files, exclude_dirs = _generate_exclude_set(srcdir, excludes)
+    matcher = FilesetMatcher(includes, excludes)
+    snap_files, snap_dirs = matcher.scan(srcdir)
+
+    if tracing.is_enabled():
+        tracing.count('scanned', matcher.scanned)
+        tracing.count('matched', matcher.matched)
+
+    return snap_files, snap_dirs
+
+
+def _glob_migratable_filesets(fileset, srcdir):
+    # How filesets were worked out before FilesetMatcher, globbing every
+    # pattern and walking every included directory. Only kept as the
+    # reference FilesetMatcher is tested against.
+    includes, excludes = _get_file_list(fileset)
+
+    def existing(pattern):
+        # glob gives the start of a '**' even when it does not exist.
+        return {x for x in iglob(os.path.join(srcdir, pattern),
+                                 recursive=True)
+                if os.path.lexists(x.rstrip('/'))}
+
+    include_files = set()
+    for include in includes:
+        if '*' in include:
+            include_files |= existing(include)
+        else:
+            include_files.add(os.path.join(srcdir, include))
+
+    include_dirs = [x for x in include_files if os.path.isdir(x)]
+    include_files = {os.path.relpath(x, srcdir) for x in include_files}
+    for include_dir in include_dirs:
+        for root, dirs, files in os.walk(include_dir):
+            include_files |= {os.path.relpath(os.path.join(root, d), srcdir)
+                              for d in dirs}
+            include_files |= {os.path.relpath(os.path.join(root, f), srcdir)
+                              for f in files}
+
+    exclude_files = set()
+    for exclude in excludes:
+        exclude_files |= existing(exclude)
+    exclude_dirs = [os.path.relpath(x, srcdir)
+                    for x in exclude_files if os.path.isdir(x)]
+    exclude_files = {os.path.relpath(x, srcdir) for x in exclude_files}
 
-    # And chop files, including whole trees if any dirs are mentioned
     snap_files = include_files - exclude_files
     for exclude_dir in exclude_dirs:
-        snap_files = set([x for x in snap_files
-                          if not x.startswith(exclude_dir + '/')])
+        snap_files = {x for x in snap_files
+                      if not x.startswith(exclude_dir + '/')}
 
-    # Separate dirs from files
-    snap_dirs = set([x for x in snap_files
-                     if os.path.isdir(os.path.join(srcdir, x)) and
-                     not os.path.islink(os.path.join(srcdir, x))])
+    snap_dirs = {x for x in snap_files
+                 if os.path.isdir(os.path.join(srcdir, x)) and
+                 not os.path.islink(os.path.join(srcdir, x))}
     snap_files = snap_files - snap_dirs
-
-    # Make sure we also obtain the parent directories of files
     for snap_file in snap_files:
         dirname = os.path.dirname(snap_file)
         while dirname:
@@ -874,36 +1267,118 @@ def _migratable_filesets(fileset, srcdir):
 def _migrate_files(snap_files, snap_dirs, srcdir, dstdir, missing_ok=False,
                    follow_symlinks=False, fixup_func=lambda *args: None):
 
-    for directory in snap_dirs:
-        src = os.path.join(srcdir, directory)
-        dst = os.path.join(dstdir, directory)
+    directories = [(os.path.join(srcdir, d), os.path.join(dstdir, d))
+                   for d in snap_dirs]
+    for snap_file in snap_files:
+        directories.append(
+            (os.path.dirname(os.path.join(srcdir, snap_file)),
+             os.path.dirname(os.path.join(dstdir, snap_file))))
+    _create_similar_directories(directories)
+
+    snap_files = sorted(snap_files)
+    batches = [snap_files[i:i + _MIGRATION_BATCH_SIZE]
+               for i in range(0, len(snap_files), _MIGRATION_BATCH_SIZE)]
+
+    def migrate_batch(batch):
+        written = 0
+        for snap_file in batch:
+            written += _migrate_file(
+                os.path.join(srcdir, snap_file),
+                os.path.join(dstdir, snap_file),
+                missing_ok, follow_symlinks, fixup_func)
+        return written
+
+    if len(batches) > 1:
+        # Linking is mostly waiting on the filesystem, which threads do
+        # concurrently.
+        with futures.ThreadPoolExecutor(
+                max_workers=_MIGRATION_WORKERS) as executor:
+            written = sum(executor.map(migrate_batch, batches))
+    else:
+        written = sum(migrate_batch(batch) for batch in batches)
+
+    # Counted here as the spans are only open in this thread.
+    if tracing.is_enabled():
+        tracing.count('bytes', written)
+
 
+def _create_similar_directories(directories):
+    # Sorting creates parents before their children, and every directory is
+    # only created once however many files it holds.
+    created = set()
+    for src, dst in sorted(directories, key=lambda d: d[1]):
+        if dst in created:
+            continue
         snapcraft.file_utils.create_similar_directory(src, dst)
+        created.add(dst)
 
-    for snap_file in snap_files:
-        src = os.path.join(srcdir, snap_file)
-        dst = os.path.join(dstdir, snap_file)
 
-        snapcraft.file_utils.create_similar_directory(os.path.dirname(src),
-                                                      os.path.dirname(dst))
+def _migrate_file(src, dst, missing_ok, follow_symlinks, fixup_func):
+    if missing_ok and not os.path.exists(src):
+        return 0
+
+    # If the file is already here and it's a symlink, leave it alone unless
+    # it was retargeted.
+    if os.path.islink(dst) and not _is_retargeted_symlink(src, dst):
+        return 0
+
+    # Otherwise, remove and re-link it.
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if src.endswith('.pc'):
+        shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+    else:
+        file_utils.link_or_copy(src, dst, follow_symlinks=follow_symlinks)
+
+    fixup_func(dst)
+
+    if tracing.is_enabled():
+        return os.lstat(dst).st_size
+    return 0
 
-        if missing_ok and not os.path.exists(src):
+
+def _changed_files(snap_files, srcdir, dstdir):
+    """Return the snap_files that differ between srcdir and dstdir."""
+
+    changed = set()
+    for snap_file in snap_files:
+        dst = os.path.join(dstdir, snap_file)
+        try:
+            dst_stat = os.lstat(dst)
+            src_stat = os.lstat(os.path.join(srcdir, snap_file))
+        except FileNotFoundError:
+            changed.add(snap_file)
             continue
 
-        # If the file is already here and it's a symlink, leave it alone.
-        if os.path.islink(dst):
+        # Symlinks already there are left alone by _migrate_file, unless
+        # they were retargeted.
+        if S_ISLNK(dst_stat.st_mode):
+            if (S_ISLNK(src_stat.st_mode) and
+                    _is_retargeted_symlink(os.path.join(srcdir, snap_file),
+                                           dst)):
+                changed.add(snap_file)
+            continue
+        # pkg-config files are rewritten when they are migrated.
+        if snap_file.endswith('.pc'):
+            changed.add(snap_file)
+        elif os.path.samestat(src_stat, dst_stat):
             continue
+        # Copies keep the modification time of what they were copied from.
+        elif (src_stat.st_size != dst_stat.st_size or
+              src_stat.st_mtime_ns != dst_stat.st_mtime_ns or
+              not S_ISREG(src_stat.st_mode)):
+            changed.add(snap_file)
 
-        # Otherwise, remove and re-link it.
-        if os.path.exists(dst):
-            os.remove(dst)
+    return changed
+
+
+def _is_retargeted_symlink(src, dst):
+    return os.path.islink(src) and os.readlink(src) != os.readlink(dst)
 
-        if src.endswith('.pc'):
-            shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
-        else:
-            file_utils.link_or_copy(src, dst, follow_symlinks=follow_symlinks)
 
-        fixup_func(dst)
+def _previous_step(step):
+    return '{}.previous'.format(step)
 
 
 def _organize_filesets(fileset, base_dir):
@@ -931,7 +1406,9 @@ def _organize_filesets(fileset, base_dir):
 
 def _clean_migrated_files(snap_files, snap_dirs, directory):
     for snap_file in snap_files:
-        os.remove(os.path.join(directory, snap_file))
+        # A superseded run of the step may have recorded it as well.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, snap_file))
 
     # snap_dirs may not be ordered so that subdirectories come before
     # parents, and we want to be able to remove directories if possible, so
@@ -940,18 +1417,46 @@ def _clean_migrated_files(snap_files, snap_dirs, directory):
 
     for snap_dir in snap_dirs:
         migrated_directory = os.path.join(directory, snap_dir)
-        if not os.listdir(migrated_directory):
+        if (os.path.isdir(migrated_directory) and
+                not os.listdir(migrated_directory)):
             os.rmdir(migrated_directory)
 
 
-def _find_dependencies(root, part_files):
-    ms = magic.open(magic.NONE)
-    if ms.load() != 0:
-        raise RuntimeError('Cannot load magic header detection')
+def _find_dependencies(root, part_files, stagedir=None):
+    signatures = _dependency_signatures(root, part_files)
+    if not signatures:
+        return set()
+
+    # The dependencies found by earlier runs are kept, for as long as the
+    # files and where their libraries are looked for remain the same.
+    ld_library_path = common.run_env().get('LD_LIBRARY_PATH')
+    context = libraries.get_search_context(
+        ld_library_path, [stagedir] if stagedir else [],
+        [p for p in signatures if libraries.is_library_name(p)])
+    dependency_cache = cache.DependencyCache()
+    found = dependency_cache.get(context, signatures)
+    if tracing.is_enabled():
+        tracing.count('cached', len(found))
+
+    missing = [p for p in signatures if p not in found]
+    resolved = _resolve_dependencies(_find_elf_files(missing),
+                                     ld_library_path)
+    # Files that are not dynamically linked are cached too, so that they
+    # are not read again.
+    dependency_cache.cache(context, {
+        p: (signatures[p], resolved.get(p, [])) for p in missing})
 
-    elf_files = set()
+    dependencies = set()
+    for file_dependencies in found.values():
+        dependencies.update(file_dependencies)
+    for file_dependencies in resolved.values():
+        dependencies.update(file_dependencies)
 
-    fs_encoding = sys.getfilesystemencoding()
+    return dependencies
+
+
+def _dependency_signatures(root, part_files):
+    signatures = {}
 
     for part_file in part_files:
         # Filter out object (*.o) files-- we only care about binaries.
@@ -960,23 +1465,59 @@ def _find_dependencies(root, part_files):
 
         # No need to crawl links-- the original should be here, too.
         path = os.path.join(root, part_file)
-        if os.path.islink(path):
+        try:
+            stat = os.lstat(path)
+        except FileNotFoundError:
+            continue
+        if S_ISLNK(stat.st_mode):
             logger.debug('Skipped link {!r} while finding dependencies'.format(
                 path))
             continue
 
-        path = path.encode(fs_encoding, errors='surrogateescape')
-        # Finally, make sure this is actually an ELF before queueing it up
-        # for an ldd call.
-        file_m = ms.file(path)
-        if file_m.startswith('ELF') and 'dynamically linked' in file_m:
-            elf_files.add(path)
+        signatures[path] = '{}:{}:{}:{}'.format(
+            stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    return signatures
+
 
-    dependencies = []
-    for elf_file in elf_files:
-        dependencies += libraries.get_dependencies(elf_file)
+def _resolve_dependencies(elf_files, ld_library_path):
+    # The libraries are resolved the way ldd would resolve them when run, and
+    # ldd is only run for the files that cannot be resolved that way.
+    resolver = libraries.DependencyResolver(ld_library_path)
 
-    return set(dependencies)
+    def get_dependencies(path):
+        try:
+            dependencies = resolver.get_dependencies(path)
+        except elf.ElfError as e:
+            logger.debug(str(e))
+            dependencies = None
+        if dependencies is None:
+            fs_encoding = sys.getfilesystemencoding()
+            dependencies = libraries.get_dependencies(
+                path.encode(fs_encoding, errors='surrogateescape'))
+        return dependencies
+
+    with futures.ThreadPoolExecutor(
+            max_workers=_DEPENDENCY_WORKERS) as executor:
+        return dict(zip(elf_files, executor.map(get_dependencies,
+                                                elf_files)))
+
+
+def _find_elf_files(paths):
+    elf_files = []
+
+    for path in sorted(paths):
+        # Make sure this is actually a dynamically linked ELF before looking
+        # for its dependencies.
+        try:
+            elf_file = elf.read(path)
+        except elf.ElfError as e:
+            logger.debug(str(e))
+            continue
+        if elf_file and elf_file.dynamic:
+            elf_files.append(path)
+
+    return elf_files
 
 
 def _get_file_list(stage_set):
@@ -998,49 +1539,6 @@ def _get_file_list(stage_set):
     return includes, excludes
 
 
-def _generate_include_set(directory, includes):
-    include_files = set()
-    for include in includes:
-        if '*' in include:
-            pattern = os.path.join(directory, include)
-            matches = iglob(pattern, recursive=True)
-            include_files |= set(matches)
-        else:
-            include_files |= set([os.path.join(directory, include), ])
-
-    include_dirs = [x for x in include_files if os.path.isdir(x)]
-    include_files = set([os.path.relpath(x, directory) for x in include_files])
-
-    # Expand includeFiles, so that an exclude like '*/*.so' will still match
-    # files from an include like 'lib'
-    for include_dir in include_dirs:
-        for root, dirs, files in os.walk(include_dir):
-            include_files |= \
-                set([os.path.relpath(os.path.join(root, d), directory)
-                     for d in dirs])
-            include_files |= \
-                set([os.path.relpath(os.path.join(root, f), directory)
-                     for f in files])
-
-    return include_files
-
-
-def _generate_exclude_set(directory, excludes):
-    exclude_files = set()
-
-    for exclude in excludes:
-        pattern = os.path.join(directory, exclude)
-        matches = iglob(pattern, recursive=True)
-        exclude_files |= set(matches)
-
-    exclude_dirs = [os.path.relpath(x, directory)
-                    for x in exclude_files if os.path.isdir(x)]
-    exclude_files = set([os.path.relpath(x, directory)
-                         for x in exclude_files])
-
-    return exclude_files, exclude_dirs
-
-
 def _validate_relative_paths(files):
     for d in files:
         if os.path.isabs(d):
@@ -1049,7 +1547,14 @@ def _validate_relative_paths(files):
 
 def _file_collides(file_this, file_other):
     if not file_this.endswith('.pc'):
-        return not filecmp.cmp(file_this, file_other, shallow=False)
+        stat_this = os.stat(file_this)
+        stat_other = os.stat(file_other)
+        if os.path.samestat(stat_this, stat_other):
+            return False
+        if stat_this.st_size != stat_other.st_size:
+            return True
+        return _file_digest(file_this, stat_this) != _file_digest(
+            file_other, stat_other)
 
     pc_file_1 = open(file_this)
     pc_file_2 = open(file_other)
@@ -1069,36 +1574,81 @@ def _file_collides(file_this, file_other):
     return False
 
 
+def _file_digest(path, stat):
+    # Every stage checks for collisions again, mostly between the same
+    # files, so their digests are kept for as long as they are unchanged.
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    digest = _file_digests.get(key)
+    if digest is None:
+        digest = file_utils.calculate_sha3_384(path)
+        _file_digests[key] = digest
+    return digest
+
+
+def fetch_stage_packages(parts):
+    """Fetch the stage packages of all the parts at once.
+
+    Each part gets its own packages when it is pulled, but the apt solves
+    share one archive and common packages are downloaded once.
+    """
+
+    StagePackageHandler.fetch_all(
+        [part._stage_package_handler for part in parts])
+
+
 def check_for_collisions(parts):
     """Raises an EnvironmentError if conflicts are found between two parts."""
-    parts_files = {}
+
+    index = CollisionIndex()
     for part in parts:
+        index.add(part)
+
+
+class CollisionIndex:
+    """The files of parts, to check the parts added next against them.
+
+    Every path is only compared with the earlier parts having it too, so
+    adding parts one at a time, as they are staged, costs no more than
+    checking them all at once.
+    """
+
+    def __init__(self):
+        self._owners = {}
+        self._parts = []
+
+    def add(self, part):
+        """Check part against the parts added so far, then add it.
+
+        :raises SnapcraftPartConflictError: If part has files in common
+                                            with one of them, with different
+                                            contents. The part is not added.
+        """
+
         # Gather our own files up
         part_files, _ = part.migratable_fileset_for('stage')
 
-        # Scan previous parts for collisions
-        for other_part_name in parts_files:
-            common = part_files & parts_files[other_part_name]['files']
-            conflict_files = []
-            for f in common:
-                this = os.path.join(part.installdir, f)
-                other = os.path.join(
-                    parts_files[other_part_name]['installdir'],
-                    f)
+        conflicts = collections.defaultdict(list)
+        for f in part_files:
+            this = os.path.join(part.installdir, f)
+            for other_part in self._owners.get(f, []):
+                other = os.path.join(other_part.installdir, f)
                 if os.path.islink(this) and os.path.islink(other):
                     continue
                 if _file_collides(this, other):
-                    conflict_files.append(f)
+                    conflicts[other_part.name].append(f)
 
-            if conflict_files:
+        # The conflicts with the earliest part are reported.
+        for other_part in self._parts:
+            if other_part.name in conflicts:
                 raise SnapcraftPartConflictError(
-                    other_part_name=other_part_name,
+                    other_part_name=other_part.name,
                     part_name=part.name,
-                    conflict_files=conflict_files)
+                    conflict_files=conflicts[other_part.name])
 
-        # And add our files to the list
-        parts_files[part.name] = {'files': part_files,
-                                  'installdir': part.installdir}
+        # And add our files to the index
+        for f in part_files:
+            self._owners.setdefault(f, []).append(part)
+        self._parts.append(part)
 
 
 def _get_includes(fileset):
@@ -22,3 +22,9 @@ class BuildAttributes:
 
     def no_system_libraries(self):
         return 'no-system-libraries' in self._attributes
+
+    def incremental(self):
+        return 'incremental' in self._attributes
+
+    def ccache(self):
+        return 'ccache' in self._attributes
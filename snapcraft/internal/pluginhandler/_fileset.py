@@ -0,0 +1,253 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import fnmatch
+import os
+import re
+
+_MAGIC = re.compile('[*?[]')
+
+_RECURSIVE = 'recursive'
+_GLOB = 'glob'
+_LITERAL = 'literal'
+
+
+class _Pattern:
+
+    def __init__(self, pattern, *, literal=False):
+        # Includes without a '*' name a path whether or not it exists,
+        # anything else is matched the way glob(recursive=True) does.
+        self.literal = literal
+        self.dir_only = False
+        if literal:
+            self.path = os.path.normpath(pattern)
+            self.outside = self.path == '..' or self.path.startswith('../')
+            parts = [] if self.path == '.' else self.path.split('/')
+            self.components = [(_LITERAL, part) for part in parts]
+            return
+
+        parts = pattern.split('/')
+        # A trailing '/' or '/.' only matches directories.
+        self.dir_only = parts[-1] in ('', '.')
+        self.components = [_compile_component(part) for part in parts
+                           if part not in ('', '.')]
+
+    def closure(self, index):
+        """Return the states index stands for, '**' matching nothing."""
+
+        states = [index]
+        while (index < len(self.components) and
+               self.components[index][0] == _RECURSIVE):
+            index += 1
+            states.append(index)
+        return states
+
+
+def _compile_component(part):
+    if part == '**':
+        return (_RECURSIVE, None)
+    if _MAGIC.search(part):
+        # Like glob, wildcards leave out hidden names unless asked for.
+        return (_GLOB, (re.compile(fnmatch.translate(part)).match,
+                        part.startswith('.')))
+    return (_LITERAL, part)
+
+
+class FilesetMatcher:
+    """Select the files of a directory with include and exclude patterns.
+
+    All patterns are evaluated together while the directory is scanned once,
+    only descending into directories some pattern can still match in.
+    Included directories bring in their whole tree and excluded directories
+    take it out, as with the fileset of the stage and prime keywords.
+
+    Basic example:
+    >>> matcher = FilesetMatcher(['*'], ['usr/share/doc'])
+    >>> files, dirs = matcher.scan('install')
+    >>> matcher.scanned, matcher.matched
+    """
+
+    def __init__(self, includes, excludes):
+        """Compile the patterns of a fileset.
+
+        :param list includes: Patterns of the paths to select.
+        :param list excludes: Patterns of the paths to leave out.
+        """
+
+        self._includes = [_Pattern(include, literal='*' not in include)
+                          for include in includes]
+        self._excludes = [_Pattern(exclude) for exclude in excludes]
+        self.scanned = 0
+        self.matched = 0
+
+    def scan(self, directory):
+        """Return the selected files and directories below directory.
+
+        Paths are relative to directory. Symlinks are files unless they
+        are followed as directories by a pattern matching below them.
+
+        :returns: A (files, dirs) tuple of sets.
+        """
+
+        self.scanned = 0
+        files = set()
+        dirs = set()
+
+        includes, root_included = self._start(self._includes)
+        excludes, root_excluded = self._start(self._excludes)
+        if root_included and not root_excluded:
+            dirs.add('.')
+        for pattern in self._includes:
+            if pattern.literal and pattern.outside:
+                # Nothing to scan for it, but it is still asked for.
+                files.add(pattern.path)
+
+        pending = [('', directory, includes, excludes, root_included)]
+        while pending:
+            self._scan_directory(pending, files, dirs, *pending.pop())
+
+        self.matched = len(files) + len(dirs)
+
+        # Make sure we also obtain the parent directories of files
+        parents = set()
+        for path in files:
+            dirname = os.path.dirname(path)
+            while dirname and dirname not in parents:
+                parents.add(dirname)
+                dirname = os.path.dirname(dirname)
+        dirs |= parents
+
+        return files, dirs
+
+    def _start(self, patterns):
+        states = set()
+        matched = False
+        for pattern in patterns:
+            if pattern.literal and pattern.outside:
+                continue
+            for index in pattern.closure(0):
+                states.add((pattern, index))
+                matched |= index == len(pattern.components)
+
+        return states, matched
+
+    def _scan_directory(self, pending, files, dirs, relpath, path,
+                        includes, excludes, walk):
+        entries = _list_directory(path)
+        self.scanned += len(entries)
+
+        missing = {(pattern, index) for pattern, index in includes
+                   if pattern.literal and index < len(pattern.components)}
+
+        for entry in entries:
+            is_dir = _is_dir(entry)
+            included, next_includes = _step(includes, entry.name, is_dir,
+                                            missing)
+            excluded, next_excludes = _step(excludes, entry.name, is_dir)
+            # An excluded directory takes its whole tree out.
+            if excluded:
+                continue
+
+            entry_relpath = os.path.join(relpath, entry.name)
+            is_link = entry.is_symlink()
+            if included or walk:
+                if is_dir and not is_link:
+                    dirs.add(entry_relpath)
+                else:
+                    files.add(entry_relpath)
+
+            # Symlinks are only followed when they are included themselves,
+            # or when a pattern goes on below them.
+            entry_walk = is_dir and (included or (walk and not is_link))
+            if entry_walk or next_includes:
+                pending.append((entry_relpath, entry.path, next_includes,
+                                next_excludes, entry_walk))
+
+        # Includes naming a path that does not exist are kept as files.
+        for pattern, index in missing:
+            files.add(pattern.path)
+
+
+def _list_directory(path):
+    try:
+        return list(os.scandir(path))
+    except OSError:
+        return []
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _step(states, name, is_dir, missing=None):
+    """Match name against states, returning (matched, next_states)."""
+
+    matched = False
+    next_states = set()
+    hidden = name.startswith('.')
+    for state in states:
+        pattern, index = state
+        components = pattern.components
+        if index == len(components):
+            continue
+        kind = components[index][0]
+        next_index = _advance(components[index], index, name, hidden)
+        if next_index is None:
+            continue
+
+        last = index == len(components) - 1
+        if last and (is_dir or not pattern.dir_only):
+            matched = True
+        if is_dir:
+            matched |= _descend(pattern, next_index, next_states)
+        elif (kind == _LITERAL and not pattern.dir_only and
+              pattern.closure(next_index)[-1] == len(components)):
+            # Like glob, a trailing '**' also matches the file it follows.
+            matched = True
+        if missing is not None and (last or is_dir):
+            missing.discard(state)
+
+    return matched, next_states
+
+
+def _advance(component, index, name, hidden):
+    """Return the index past component matching name, None on no match."""
+
+    kind, value = component
+    if kind == _RECURSIVE:
+        # '**' stays where it is, to match further names too.
+        return None if hidden else index
+    if kind == _GLOB:
+        match, hidden_ok = value
+        if (hidden and not hidden_ok) or not match(name):
+            return None
+        return index + 1
+    return index + 1 if name == value else None
+
+
+def _descend(pattern, index, next_states):
+    """Add the states below a directory, returning whether one is final."""
+
+    matched = False
+    for next_index in pattern.closure(index):
+        if next_index == len(pattern.components):
+            matched = True
+        else:
+            next_states.add((pattern, next_index))
+    return matched
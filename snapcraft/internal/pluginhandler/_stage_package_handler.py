@@ -55,6 +55,30 @@ class StagePackageHandler:
         self._project_options = project_options
         self.__stage_packages = None
         self.__ubuntu = None
+        self.__fetched = None
+
+    @classmethod
+    def fetch_all(cls, handlers):
+        """Fetch the stage packages of several handlers at once.
+
+        Handlers using the same sources are solved against one archive, and
+        the packages they have in common are only fetched once. The next
+        fetch() of each handler returns what was fetched for it.
+
+        :param list handlers: The StagePackageHandlers to fetch for.
+        """
+
+        handlers = [h for h in handlers if h._stage_packages]
+        if not handlers:
+            return
+
+        logger.debug('Fetching stage-packages of {} parts'.format(
+            len(handlers)))
+        pkg_lists = repo.get_packages(
+            [(h._ubuntu, h._stage_packages) for h in handlers])
+        for handler, pkg_list in zip(handlers, pkg_lists):
+            # The handlers left out fetch their packages themselves.
+            handler.__fetched = pkg_list
 
     @property
     def _ubuntu(self):
@@ -82,7 +106,9 @@ class StagePackageHandler:
         """
 
         pkg_list = []
-        if self._stage_packages:
+        if self.__fetched is not None:
+            pkg_list, self.__fetched = self.__fetched, None
+        elif self._stage_packages:
             logger.debug('Fetching stage-packages {!r}'.format(
                 self._stage_packages))
             pkg_list = self._ubuntu.get(self._stage_packages)
@@ -14,8 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import contextlib
-import fileinput
 import glob
 import hashlib
 import itertools
@@ -28,8 +28,13 @@ import stat
 import string
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import urllib
+import urllib.parse
 import urllib.request
+from concurrent import futures
 
 import apt
 from xml.etree import ElementTree
@@ -38,6 +43,8 @@ import snapcraft
 from snapcraft import file_utils
 from snapcraft.internal import (
     cache,
+    deb,
+    fetcher,
 )
 from snapcraft.internal.errors import MissingCommandError
 from snapcraft.internal.indicators import is_dumb_terminal
@@ -50,6 +57,11 @@ _BIN_PATHS = (
     'usr/sbin',
 )
 
+_XML_TOOLS = (
+    os.path.join('usr', 'bin', 'xml2-config'),
+    os.path.join('usr', 'bin', 'xslt-config'),
+)
+
 logger = logging.getLogger(__name__)
 
 _DEFAULT_SOURCES = \
@@ -65,6 +77,40 @@ deb http://${security}.ubuntu.com/${suffix} ${release}-security multiverse
 '''
 _GEOIP_SERVER = "http://geoip.ubuntu.com/lookup"
 
+# The number of packages downloaded at the same time.
+_DOWNLOAD_JOBS = 8
+
+# The apt settings the fetcher cannot honor, apt downloads the packages
+# itself when any of them is set.
+_APT_TRANSPORT_OPTIONS = (
+    'Acquire::http::Proxy',
+    'Acquire::https::Proxy',
+    'Acquire::http::Proxy-Auto-Detect',
+    'Acquire::http::ProxyAutoDetect',
+    'Acquire::https::Proxy-Auto-Detect',
+    'Acquire::https::CaInfo',
+    'Acquire::https::SslCert',
+    'Acquire::https::SslKey',
+    'Acquire::https::Verify-Peer',
+    'Acquire::https::Verify-Host',
+)
+
+# apt_pkg's configuration is process wide, so only one archive can be set up
+# and used at a time, even when parts are processed concurrently.
+_apt_lock = threading.RLock()
+
+# The archive last used stays open for the next use of the same sources, as
+# opening one means parsing all of its package indexes. It is a (cache_dir,
+# apt.Cache) tuple.
+_open_archive = None
+# The cache dirs of the archives updated by this process.
+_updated_archives = set()
+
+# Package indexes updated less than this many seconds ago are used as they
+# are, unless SNAPCRAFT_APT_INDEX_TTL says otherwise.
+_INDEX_TTL = 10 * 60
+_UPDATE_STAMP = 'update-stamp'
+
 
 def is_package_installed(package):
     """Return True if a package is installed on the system.
@@ -172,6 +218,12 @@ class _AptCache:
         self._sources_list = sources_list
         self._use_geoip = use_geoip
 
+        self.progress = apt.progress.text.AcquireProgress()
+        if is_dumb_terminal():
+            # Make output more suitable for logging.
+            self.progress.pulse = lambda owner: True
+            self.progress._width = 0
+
     def _setup_apt(self, cache_dir):
         # Do not install recommends
         apt.apt_pkg.config.set('Apt::Install-Recommends', 'False')
@@ -204,12 +256,6 @@ class _AptCache:
         # on the system.
         apt.apt_pkg.config.clear('APT::Update::Post-Invoke-Success')
 
-        self.progress = apt.progress.text.AcquireProgress()
-        if is_dumb_terminal():
-            # Make output more suitable for logging.
-            self.progress.pulse = lambda owner: True
-            self.progress._width = 0
-
         sources_list_file = os.path.join(
             cache_dir, 'etc', 'apt', 'sources.list')
 
@@ -230,26 +276,54 @@ class _AptCache:
             logger.warning(
                 "Cannot find 'dpkg' command needed to support multiarch")
 
-        apt_cache = apt.Cache(rootdir=cache_dir, memonly=True)
-        apt_cache.update(fetch_progress=self.progress,
-                         sources_list=sources_list_file)
+        return apt.Cache(rootdir=cache_dir, memonly=True), sources_list_file
 
-        return apt_cache
+    def was_updated(self, cache_dir):
+        """Return True if this process updated the indexes in cache_dir."""
+
+        return cache_dir in _updated_archives
 
     @contextlib.contextmanager
-    def archive(self, cache_dir):
-        try:
-            apt_cache = self._setup_apt(cache_dir)
-            apt_cache.open()
+    def archive(self, cache_dir, *, update=False):
+        """Yield the archive of the sources, kept in cache_dir.
 
-            try:
-                yield apt_cache
-            finally:
-                apt_cache.close()
+        Its package indexes are only updated when they are older than the
+        index TTL, and it stays open for the next use of the same sources.
+
+        :param bool update: Update the package indexes whatever their age.
+        """
+
+        try:
+            with _apt_lock:
+                apt_cache = self._open(cache_dir, update)
+                try:
+                    yield apt_cache
+                finally:
+                    # The next use starts from the archive as it was opened.
+                    apt_cache.clear()
         except Exception as e:
             logger.debug('Exception occured: {!r}'.format(e))
             raise e
 
+    def _open(self, cache_dir, update):
+        global _open_archive
+
+        update = update or not _indexes_are_fresh(cache_dir)
+        if _open_archive and _open_archive[0] == cache_dir and not update:
+            return _open_archive[1]
+
+        close_archive()
+        apt_cache, sources_list_file = self._setup_apt(cache_dir)
+        if update:
+            apt_cache.update(fetch_progress=self.progress,
+                             sources_list=sources_list_file)
+            _touch(os.path.join(cache_dir, _UPDATE_STAMP))
+            _updated_archives.add(cache_dir)
+            apt_cache.open()
+
+        _open_archive = (cache_dir, apt_cache)
+        return apt_cache
+
     def sources_digest(self):
         return hashlib.sha384(self._collected_sources_list().encode(
             sys.getfilesystemencoding())).hexdigest()
@@ -264,6 +338,85 @@ class _AptCache:
         return _get_local_sources_list()
 
 
+def close_archive():
+    """Close the archive kept open for the next use of its sources."""
+
+    global _open_archive
+    with _apt_lock:
+        if _open_archive:
+            _open_archive[1].close()
+        _open_archive = None
+
+
+def _indexes_are_fresh(cache_dir):
+    try:
+        ttl = int(os.environ.get('SNAPCRAFT_APT_INDEX_TTL', _INDEX_TTL))
+    except ValueError:
+        ttl = _INDEX_TTL
+    try:
+        updated = os.stat(os.path.join(cache_dir, _UPDATE_STAMP)).st_mtime
+    except FileNotFoundError:
+        return False
+    return 0 <= time.time() - updated < ttl
+
+
+def _touch(path):
+    with open(path, 'w'):
+        pass
+
+
+def get_packages(requests):
+    """Fetch the packages of several Ubuntu instances at once.
+
+    The requests using the same sources are resolved against one archive,
+    and the packages they have in common are only fetched once.
+
+    :param list requests: (Ubuntu, package names) tuples.
+    :returns: The list of packages fetched for each request, None for the
+              requests that could not be fetched this way (their get() tells
+              why).
+    """
+
+    results = [None] * len(requests)
+    by_sources = collections.OrderedDict()
+    for index, (ubuntu, _) in enumerate(requests):
+        by_sources.setdefault(ubuntu._cache.base_dir, []).append(index)
+
+    for indexes in by_sources.values():
+        try:
+            pkg_lists = _get_packages([requests[i] for i in indexes])
+        except apt.cache.FetchFailedException as e:
+            logger.debug('Could not fetch packages at once: {}'.format(e))
+            continue
+        for index, pkg_list in zip(indexes, pkg_lists):
+            results[index] = pkg_list
+
+    return results
+
+
+def _get_packages(requests):
+    ubuntu = requests[0][0]
+    with ubuntu._apt.archive(ubuntu._cache.base_dir) as apt_cache:
+        resolved = []
+        for other, package_names in requests:
+            try:
+                resolved.append(other._resolve(apt_cache, package_names))
+            except PackageNotFoundError:
+                resolved.append(None)
+            # Every request is solved on its own.
+            apt_cache.clear()
+
+        union = collections.OrderedDict()
+        for candidates in resolved:
+            for candidate in candidates or []:
+                union.setdefault(str(candidate), candidate)
+        downloads = ubuntu._download(union.values())
+
+    return [other._link(candidates, downloads) if candidates is not None
+            else None
+            for (other, _), candidates in zip(requests, resolved)]
+
+
 class Ubuntu:
 
     def __init__(self, rootdir, recommends=False, sources=None,
@@ -278,6 +431,7 @@ class Ubuntu:
         self._apt = _AptCache(
             project_options.deb_arch, sources_list=sources,
             use_geoip=project_options.use_geoip)
+        self._jobs = project_options.parallel_build_count
 
         self._cache = cache.AptStagePackageCache(
             sources_digest=self._apt.sources_digest())
@@ -287,10 +441,25 @@ class Ubuntu:
             return package_name in apt_cache
 
     def get(self, package_names):
-        with self._apt.archive(self._cache.base_dir) as apt_cache:
-            self._mark_install(apt_cache, package_names)
-            self._filter_base_packages(apt_cache, package_names)
-            return self._get(apt_cache)
+        try:
+            return self._fetch(package_names)
+        except (PackageNotFoundError, apt.cache.FetchFailedException) as e:
+            # Indexes still within their TTL may be behind the archive.
+            if self._apt.was_updated(self._cache.base_dir):
+                raise
+            logger.debug('Updating the package indexes after: {}'.format(e))
+            return self._fetch(package_names, update=True)
+
+    def _fetch(self, package_names, *, update=False):
+        with self._apt.archive(self._cache.base_dir,
+                               update=update) as apt_cache:
+            candidates = self._resolve(apt_cache, package_names)
+            return self._link(candidates, self._download(candidates))
+
+    def _resolve(self, apt_cache, package_names):
+        self._mark_install(apt_cache, package_names)
+        self._filter_base_packages(apt_cache, package_names)
+        return [package.candidate for package in apt_cache.get_changes()]
 
     def _mark_install(self, apt_cache, package_names):
         for name in package_names:
@@ -336,7 +505,7 @@ class Ubuntu:
             logger.debug('Skipping blacklisted from manifest packages: '
                          '{!r}'.format(skipped_blacklisted))
 
-    def _get(self, apt_cache):
+    def _download(self, candidates):
         # Ideally we'd use apt.Cache().fetch_archives() here, but it seems to
         # mangle some package names on disk such that we can't match it up to
         # the archive later. We could get around this a few different ways:
@@ -346,15 +515,54 @@ class Ubuntu:
         # 2. Download packages in a different manner.
         #
         # In the end, (2) was chosen for minimal overhead and a simpler cache
-        # implementation. So we're using fetch_binary() here instead.
-        # Downloading each package individually has the drawback of witholding
-        # any clue of how long the whole pulling process will take, but that's
-        # something we'll have to live with.
+        # implementation. Packages are downloaded under the name
+        # fetch_binary() would give them, several at a time over pooled
+        # connections, and fetch_binary() is only used for the URIs the
+        # fetcher does not handle, or when apt is set up to download in a
+        # way the fetcher does not know about.
+        use_fetcher = not _has_apt_transport_config()
+        downloads = {}
+        fetched = []
+        to_fetch = []
+        hits = 0
+        for candidate in candidates:
+            destination = os.path.join(
+                self._cache.packages_dir, os.path.basename(candidate.filename))
+            if os.path.exists(destination):
+                hits += 1
+            if use_fetcher and _is_fetchable(candidate):
+                fetched.append(candidate)
+                to_fetch.append(fetcher.Download(
+                    uri=candidate.uri, destination=destination,
+                    size=candidate.size, sha256=candidate.sha256))
+                downloads[str(candidate)] = destination
+            else:
+                downloads[str(candidate)] = candidate.fetch_binary(
+                    self._cache.packages_dir, progress=self._apt.progress)
+
+        deb_fetcher = fetcher.Fetcher(jobs=_DOWNLOAD_JOBS)
+        try:
+            deb_fetcher.fetch(to_fetch, message='Downloading stage packages ')
+        except fetcher.FetchError as e:
+            # apt gets another go, and raises like it does when it fails too,
+            # so that get() updates the indexes and retries.
+            logger.debug('{}, downloading with apt'.format(e.message))
+            for candidate in fetched:
+                candidate.fetch_binary(
+                    self._cache.packages_dir, progress=self._apt.progress)
+        finally:
+            deb_fetcher.close()
+
+        self._cache.record_use([self._cache.base_dir], hits=hits,
+                               misses=len(downloads) - hits)
+
+        return downloads
+
+    def _link(self, candidates, downloads):
         pkg_list = []
-        for package in apt_cache.get_changes():
-            pkg_list.append(str(package.candidate))
-            source = package.candidate.fetch_binary(
-                self._cache.packages_dir, progress=self._apt.progress)
+        for candidate in candidates:
+            pkg_list.append(str(candidate))
+            source = downloads[str(candidate)]
             destination = os.path.join(
                 self._downloaddir, os.path.basename(source))
             with contextlib.suppress(FileNotFoundError):
@@ -364,17 +572,30 @@ class Ubuntu:
         return pkg_list
 
     def unpack(self, rootdir):
-        pkgs_abs_path = glob.glob(os.path.join(self._downloaddir, '*.deb'))
-        for pkg in pkgs_abs_path:
-            # TODO needs elegance and error control
-            try:
-                subprocess.check_call(['dpkg-deb', '--extract', pkg, rootdir])
-            except subprocess.CalledProcessError:
-                raise UnpackError(pkg)
-
-        _fix_artifacts(rootdir)
-        _fix_xml_tools(rootdir)
-        _fix_shebangs(rootdir)
+        # Packages are extracted once into the unpacked cache, several at a
+        # time, and then copied into rootdir one after the other, so that
+        # the last one wins wherever they overlap, as when extracting them
+        # in turn.
+        pkgs_abs_path = sorted(
+            glob.glob(os.path.join(self._downloaddir, '*.deb')))
+        unpacked_cache = cache.UnpackedStagePackageCache()
+
+        with futures.ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            unpacked = list(executor.map(
+                lambda pkg: _get_unpacked(pkg, unpacked_cache),
+                pkgs_abs_path))
+
+        members = collections.OrderedDict()
+        for (tree, pkg_members), _ in unpacked:
+            _copy_members(tree, pkg_members, rootdir)
+            members.update((m, None) for m in pkg_members)
+
+        _fix_unpacked(rootdir, members)
+
+        hits = sum(1 for _, hit in unpacked if hit)
+        unpacked_cache.record_use(
+            (os.path.dirname(tree) for (tree, _), _ in unpacked),
+            hits=hits, misses=len(unpacked) - hits)
 
     def _manifest_dep_names(self, apt_cache):
         manifest_dep_names = set()
@@ -389,6 +610,26 @@ class Ubuntu:
         return manifest_dep_names
 
 
+def _has_apt_transport_config():
+    # Proxies, credentials and TLS settings only apply to what apt
+    # downloads itself.
+    config = apt.apt_pkg.config
+    if any(config.exists(option) for option in _APT_TRANSPORT_OPTIONS):
+        return True
+
+    auth_file = config.find_file('Dir::Etc::netrc')
+    auth_dir = config.find_dir('Dir::Etc::netrcparts')
+    return bool(auth_file and os.path.isfile(auth_file) or
+                auth_dir and os.path.isdir(auth_dir) and
+                os.listdir(auth_dir))
+
+
+def _is_fetchable(candidate):
+    uri = candidate.uri
+    return (uri and candidate.sha256 and
+            urllib.parse.urlparse(uri).scheme in fetcher.SCHEMES)
+
+
 def _get_local_sources_list():
     sources_list = glob.glob('/etc/apt/sources.list.d/*.list')
     sources_list.append('/etc/apt/sources.list')
@@ -449,54 +690,145 @@ def fix_pkg_config(root, pkg_config_file, prefix_trim=None):
             '^prefix={}(?P<prefix>.*)'.format(prefix_trim))
     pattern = re.compile('^prefix=(?P<prefix>.*)')
 
-    with fileinput.input(pkg_config_file, inplace=True) as input_file:
-        for line in input_file:
-            match = pattern.search(line)
-            if prefix_trim:
-                match_trim = pattern_trim.search(line)
-            if prefix_trim and match_trim:
-                print('prefix={}{}'.format(root, match_trim.group('prefix')))
-            elif match:
-                print('prefix={}{}'.format(root, match.group('prefix')))
-            else:
-                print(line, end='')
+    with open(pkg_config_file) as input_file:
+        lines = input_file.readlines()
+
+    fixed_lines = []
+    for line in lines:
+        match = pattern.search(line)
+        if prefix_trim:
+            match_trim = pattern_trim.search(line)
+        if prefix_trim and match_trim:
+            line = 'prefix={}{}\n'.format(root, match_trim.group('prefix'))
+        elif match:
+            line = 'prefix={}{}\n'.format(root, match.group('prefix'))
+        fixed_lines.append(line)
+
+    if fixed_lines == lines:
+        return
 
+    # The file can be hard-linked from elsewhere, like the installdir, so
+    # it is replaced rather than written to. Unlike fileinput, this is safe
+    # to run from several threads at once.
+    fd, fixed_file = tempfile.mkstemp(
+        dir=os.path.dirname(pkg_config_file),
+        prefix='.{}.'.format(os.path.basename(pkg_config_file)))
+    try:
+        with os.fdopen(fd, 'w') as output_file:
+            output_file.writelines(fixed_lines)
+        shutil.copymode(pkg_config_file, fixed_file)
+        os.replace(fixed_file, pkg_config_file)
+    except Exception:
+        with contextlib.suppress(OSError):
+            os.remove(fixed_file)
+        raise
+
+
+def _get_unpacked(pkg, unpacked_cache):
+    # Returns the cached (tree, members) tuple, and whether it was cached
+    # already.
+    digest = file_utils.calculate_sha256(pkg)
+    unpacked = unpacked_cache.get(digest=digest)
+    if unpacked:
+        logger.debug('Using the unpacked cache for {!r}'.format(pkg))
+        return unpacked, True
+
+    try:
+        return unpacked_cache.cache(
+            digest=digest, extract=lambda tree: _extract(pkg, tree)), False
+    except OSError as e:
+        logger.debug('Failed to cache {!r}: {}'.format(pkg, e))
+        raise UnpackError(pkg)
+
+
+def _extract(pkg, pkgdir):
+    try:
+        members = deb.extract(pkg, pkgdir)
+    except deb.UnsupportedDebError as e:
+        logger.debug('{}, using dpkg-deb'.format(e.message))
+        try:
+            subprocess.check_call(['dpkg-deb', '--extract', pkg, pkgdir])
+        except subprocess.CalledProcessError:
+            raise UnpackError(pkg)
+        members = _list_tree(pkgdir)
+    except (deb.DebError, OSError) as e:
+        logger.debug('Failed to extract {!r}: {}'.format(pkg, e))
+        raise UnpackError(pkg)
+
+    for member in members:
+        _fix_member(os.path.join(pkgdir, member), member)
+
+    return members
+
+
+def _list_tree(root):
+    members = []
+    for directory, dirs, files in os.walk(root):
+        for entry in itertools.chain(dirs, files):
+            members.append(os.path.relpath(
+                os.path.join(directory, entry), root))
+    return members
+
+
+def _copy_members(tree, members, rootdir):
+    # Plugins change the files of their installdir in place, so these are
+    # copies of the cached tree, sharing its data only where the filesystem
+    # can clone files.
+    for member in members:
+        source = os.path.join(tree, member)
+        destination = os.path.join(rootdir, member)
+        if os.path.isdir(source) and not os.path.islink(source):
+            os.makedirs(destination, exist_ok=True)
+            shutil.copymode(source, destination)
+            continue
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if (os.path.isdir(destination) and
+                not os.path.islink(destination)):
+            shutil.rmtree(destination)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(destination)
+        file_utils.clone_or_copy(source, destination)
 
-def _fix_artifacts(debdir):
-    '''
-    Sometimes debs will contain absolute symlinks (e.g. if the relative
-    path would go all the way to root, they just do absolute).  We can't
-    have that, so instead clean those absolute symlinks.
 
-    Some unpacked items will also contain suid binaries which we do not want in
-    the resulting snap.
+def _fix_member(path, member):
     '''
-    for root, dirs, files in os.walk(debdir):
-        # Symlinks to directories will be in dirs, while symlinks to
-        # non-directories will be in files.
-        for entry in itertools.chain(files, dirs):
-            path = os.path.join(root, entry)
-            if os.path.islink(path) and os.path.isabs(os.readlink(path)):
-                _fix_symlink(path, debdir, root)
-            elif os.path.exists(path):
-                _fix_filemode(path)
-
-            if path.endswith('.pc') and not os.path.islink(path):
-                fix_pkg_config(debdir, path)
-
-
-def _fix_xml_tools(root):
-    xml2_config_path = os.path.join(root, 'usr', 'bin', 'xml2-config')
-    with contextlib.suppress(FileNotFoundError):
-        file_utils.search_and_replace_contents(
-            xml2_config_path, re.compile(r'prefix=/usr'),
-            'prefix={}/usr'.format(root))
+    Fix what can be fixed in a member of a package wherever it is: some
+    unpacked items contain suid binaries which we do not want in the
+    resulting snap, and python scripts in _BIN_PATHS get their hard coded
+    shebangs changed to use env.
+    '''
+    if os.path.islink(path):
+        return
 
-    xslt_config_path = os.path.join(root, 'usr', 'bin', 'xslt-config')
-    with contextlib.suppress(FileNotFoundError):
+    _fix_filemode(path)
+    if (os.path.isfile(path) and
+            any(member.startswith(p + os.sep) for p in _BIN_PATHS)):
         file_utils.search_and_replace_contents(
-            xslt_config_path, re.compile(r'prefix=/usr'),
-            'prefix={}/usr'.format(root))
+            path, re.compile(r'#!.*python\n'), r'#!/usr/bin/env python\n')
+
+
+def _fix_unpacked(debdir, members):
+    '''
+    Fix what depends on where the members of the packages were unpacked.
+
+    Sometimes debs will contain absolute symlinks (e.g. if the relative
+    path would go all the way to root, they just do absolute).  We can't
+    have that, so instead clean those absolute symlinks. pkg-config files
+    and xml tools get their prefix moved into debdir.
+    '''
+    for member in members:
+        path = os.path.join(debdir, member)
+        if os.path.islink(path):
+            if os.path.isabs(os.readlink(path)):
+                _fix_symlink(path, debdir, os.path.dirname(path))
+        elif path.endswith('.pc'):
+            fix_pkg_config(debdir, path)
+        elif member in _XML_TOOLS:
+            file_utils.search_and_replace_contents(
+                path, re.compile(r'prefix=/usr'),
+                'prefix={}/usr'.format(debdir))
 
 
 def _fix_symlink(path, debdir, root):
@@ -521,15 +853,6 @@ def _fix_filemode(path):
         os.chmod(path, mode & 0o1777)
 
 
-def _fix_shebangs(path):
-    """Changes hard coded shebangs for files in _BIN_PATHS to use env."""
-    paths = [p for p in _BIN_PATHS if os.path.exists(os.path.join(path, p))]
-    for p in [os.path.join(path, p) for p in paths]:
-        file_utils.replace_in_file(p, re.compile(r''),
-                                   re.compile(r'#!.*python\n'),
-                                   r'#!/usr/bin/env python\n')
-
-
 def _try_copy_local(path, target):
     real_path = os.path.realpath(path)
     if os.path.exists(real_path):
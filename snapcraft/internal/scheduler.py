@@ -0,0 +1,121 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+from concurrent import futures
+
+from snapcraft.internal.errors import SchedulerCycleError
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Run the nodes of a dependency graph in a bounded pool of workers.
+
+    A node is handed to a worker as soon as every node it requires has
+    completed, so independent nodes run concurrently. Nodes that become
+    ready at the same time are started in the order they were added.
+
+    Basic example:
+    >>> scheduler = Scheduler(jobs=2)
+    >>> scheduler.add('a')
+    >>> scheduler.add('b')
+    >>> scheduler.add('c', requires=['a', 'b'])
+    >>> scheduler.run(print)
+    """
+
+    def __init__(self, *, jobs=1):
+        """Create a new Scheduler.
+
+        :param int jobs: Maximum number of nodes to run at the same time.
+        """
+
+        self._jobs = max(1, jobs)
+        self._requires = collections.OrderedDict()
+
+    def add(self, node, requires=None):
+        """Add node to the graph.
+
+        :param node: Hashable node to be passed to the run function.
+        :param list requires: Nodes that must complete before this one runs.
+                              Nodes not added to the graph are ignored.
+        """
+
+        self._requires.setdefault(node, set()).update(requires or [])
+
+    def __contains__(self, node):
+        return node in self._requires
+
+    def __len__(self):
+        return len(self._requires)
+
+    def run(self, func):
+        """Call func for every node, honoring the dependencies between them.
+
+        If a call raises, no further nodes are started; the nodes already
+        running are waited for and the first exception is re-raised.
+
+        :param callable func: Function taking a node as its only argument.
+        :raises SchedulerCycleError: If the graph contains a cycle.
+        """
+
+        pending, dependents = self._index()
+        ready = collections.deque(
+            node for node, requires in pending.items() if not requires)
+        running = {}
+        error = None
+
+        with futures.ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            while True:
+                while ready and not error and len(running) < self._jobs:
+                    node = ready.popleft()
+                    del pending[node]
+                    logger.debug('Scheduling {!r}'.format(node))
+                    running[executor.submit(func, node)] = node
+
+                if not running:
+                    break
+
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if future.exception():
+                        error = error or future.exception()
+                        continue
+                    for dependent in dependents[node]:
+                        pending[dependent].discard(node)
+                        if not pending[dependent]:
+                            ready.append(dependent)
+
+        if error:
+            raise error
+        if pending:
+            raise SchedulerCycleError(nodes=list(pending))
+
+    def _index(self):
+        # Only keep requirements that are part of the graph, and build the
+        # reverse index so completing a node is proportional to its
+        # dependents rather than to the size of the graph.
+        pending = collections.OrderedDict()
+        dependents = {node: [] for node in self._requires}
+        for node, requires in self._requires.items():
+            pending[node] = {r for r in requires if r in self._requires}
+            for required in pending[node]:
+                dependents[required].append(node)
+
+        return pending, dependents
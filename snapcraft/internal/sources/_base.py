@@ -18,6 +18,7 @@ import os
 import requests
 import shutil
 
+import snapcraft.file_utils
 import snapcraft.internal.common
 from snapcraft.internal.indicators import (
     download_requests_stream,
@@ -27,6 +28,10 @@ from snapcraft.internal.indicators import (
 
 class Base:
 
+    # Whether pull() only updates what changed in source_dir, which can then
+    # be kept from one pull to the next.
+    incremental_pull = False
+
     def __init__(self, source, source_dir, source_tag=None, source_commit=None,
                  source_branch=None, source_depth=None,
                  source_checksum=None, command=None):
@@ -40,6 +45,15 @@ class Base:
 
         self.command = command
 
+    def get_fingerprint(self):
+        """Return a string that changes whenever the source does.
+
+        Returns None if the source cannot be fingerprinted without fetching
+        it, in which case it is assumed to be unchanged.
+        """
+
+        return None
+
 
 class FileBase(Base):
 
@@ -51,6 +65,12 @@ class FileBase(Base):
 
         self.provision(self.source_dir)
 
+    def get_fingerprint(self):
+        if snapcraft.internal.common.isurl(self.source):
+            return self.source_checksum
+
+        return snapcraft.file_utils.calculate_sha3_384(self.source)
+
     def download(self):
         self.file = os.path.join(
                 self.source_dir, os.path.basename(self.source))
@@ -48,15 +48,17 @@ class Git(Base):
             self.kwargs['stdout'] = subprocess.DEVNULL
             self.kwargs['stderr'] = subprocess.DEVNULL
 
-    def _pull_existing(self):
-        refspec = 'HEAD'
+    def _get_refspec(self):
         if self.source_branch:
-            refspec = 'refs/heads/' + self.source_branch
+            return 'refs/heads/' + self.source_branch
         elif self.source_tag:
-            refspec = 'refs/tags/' + self.source_tag
+            return 'refs/tags/' + self.source_tag
         elif self.source_commit:
-            refspec = self.source_commit
+            return self.source_commit
+        return 'HEAD'
 
+    def _pull_existing(self):
+        refspec = self._get_refspec()
         reset_spec = refspec if refspec != 'HEAD' else 'origin/master'
 
         subprocess.check_call([self.command, '-C', self.source_dir,
@@ -90,3 +92,18 @@ class Git(Base):
             self._pull_existing()
         else:
             self._clone_new()
+
+    def get_fingerprint(self):
+        # Only a repository on disk can be asked for its HEAD without
+        # fetching from the network.
+        if not os.path.isdir(self.source):
+            return None
+
+        try:
+            return subprocess.check_output(
+                [self.command, '-C', self.source, 'rev-parse', '--verify',
+                 self._get_refspec()],
+                stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        except subprocess.CalledProcessError:
+            # Not a repository, or the ref to build is not in it.
+            return None
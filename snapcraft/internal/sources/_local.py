@@ -16,36 +16,46 @@
 
 import copy
 import glob
+import logging
 import os
-import shutil
 
 from snapcraft import file_utils
-from snapcraft.internal import common
+from snapcraft.internal import (
+    common,
+    tracing,
+)
 from ._base import Base
 
+logger = logging.getLogger(__name__)
+
 
 class Local(Base):
 
+    incremental_pull = True
+
     def pull(self):
-        if os.path.islink(self.source_dir) or os.path.isfile(self.source_dir):
-            os.remove(self.source_dir)
-        elif os.path.isdir(self.source_dir):
-            shutil.rmtree(self.source_dir)
-
-        current_dir = os.getcwd()
-        source_abspath = os.path.abspath(self.source)
-
-        def ignore(directory, files):
-            if directory == source_abspath or \
-               directory == current_dir:
-                ignored = copy.copy(common.SNAPCRAFT_FILES)
-                snaps = glob.glob(os.path.join(directory, '*.snap'))
-                if snaps:
-                    snaps = [os.path.basename(s) for s in snaps]
-                    ignored += snaps
-                return ignored
-            else:
-                return []
-
-        shutil.copytree(source_abspath, self.source_dir, symlinks=True,
-                        copy_function=file_utils.link_or_copy, ignore=ignore)
+        # Only what changed since the last pull is synced, which for big
+        # trees is much less work than copying them again.
+        changes = file_utils.sync_tree(
+            os.path.abspath(self.source), self.source_dir,
+            ignore=self._ignore)
+
+        logger.debug('{} entries changed in {!r}'.format(
+            changes, self.source_dir))
+        tracing.count('changed', changes)
+
+    def get_fingerprint(self):
+        return file_utils.calculate_tree_hash(
+            os.path.abspath(self.source), ignore=self._ignore)
+
+    def _ignore(self, directory, files):
+        if directory == os.path.abspath(self.source) or \
+           directory == os.getcwd():
+            ignored = copy.copy(common.SNAPCRAFT_FILES)
+            snaps = glob.glob(os.path.join(directory, '*.snap'))
+            if snaps:
+                snaps = [os.path.basename(s) for s in snaps]
+                ignored += snaps
+            return ignored
+        else:
+            return []
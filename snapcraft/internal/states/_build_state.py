@@ -39,11 +39,17 @@ def _schema_properties():
 class BuildState(State):
     yaml_tag = u'!BuildState'
 
-    def __init__(self, property_names, part_properties=None, project=None):
+    def __init__(self, property_names, part_properties=None, project=None,
+                 source_fingerprint=None, incremental=False):
         # Save this off before calling super() since we'll need it
         # FIXME: for 3.x the name `schema_properties` is leaking
         #        implementation details from a higher layer.
         self.schema_properties = property_names
+        self.assets = {
+            'source-fingerprint': source_fingerprint,
+            # Whether the build carried on from the previous build tree.
+            'incremental': incremental,
+        }
 
         super().__init__(part_properties, project)
 
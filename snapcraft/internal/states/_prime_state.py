@@ -28,6 +28,7 @@ yaml.add_constructor(u'!PrimeState', _prime_state_constructor)
 
 class PrimeState(State):
     yaml_tag = u'!PrimeState'
+    file_set_attributes = ('files', 'directories', 'dependency_paths')
 
     def __init__(self, files, directories, dependency_paths=None,
                  part_properties=None, project=None):
@@ -44,13 +44,14 @@ class PullState(State):
     yaml_tag = u'!PullState'
 
     def __init__(self, property_names, part_properties=None, project=None,
-                 stage_packages=None):
+                 stage_packages=None, source_fingerprint=None):
         # Save this off before calling super() since we'll need it
         # FIXME: for 3.x the name `schema_properties` is leaking
         #        implementation details from a higher layer.
         self.schema_properties = property_names
         self.assets = {
             'stage-packages': stage_packages,
+            'source-fingerprint': source_fingerprint,
         }
 
         super().__init__(part_properties, project)
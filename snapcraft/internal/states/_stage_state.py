@@ -28,6 +28,7 @@ yaml.add_constructor(u'!StageState', _stage_state_constructor)
 
 class StageState(State):
     yaml_tag = u'!StageState'
+    file_set_attributes = ('files', 'directories')
 
     def __init__(self, files, directories, part_properties=None, project=None):
         super().__init__(part_properties, project)
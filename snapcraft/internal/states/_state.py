@@ -16,8 +16,14 @@
 
 import yaml
 
+# libyaml emits big states several times faster than the Python emitter.
+_Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
 
 class State(yaml.YAMLObject):
+    # Attributes holding sets of paths.
+    file_set_attributes = ()
+
     def __init__(self, part_properties, project):
         if not part_properties:
             part_properties = {}
@@ -51,6 +57,10 @@ class State(yaml.YAMLObject):
             self.project_options, self.project_options_of_interest(
                 other_project_options))
 
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        return dumper.represent_mapping(cls.yaml_tag, data.__dict__)
+
     def __repr__(self):
         items = sorted(self.__dict__.items())
         strings = (': '.join((key, repr(value))) for key, value in items)
@@ -65,6 +75,16 @@ class State(yaml.YAMLObject):
         return False
 
 
+yaml.add_multi_representer(
+    State, lambda dumper, data: data.to_yaml(dumper, data), Dumper=_Dumper)
+
+
+def dump(state):
+    """Return state as YAML, as written to the state file of a step."""
+
+    return yaml.dump(state, Dumper=_Dumper)
+
+
 def _get_differing_keys(dict1, dict2):
     differing_keys = set()
     for key, dict1_value in dict1.items():
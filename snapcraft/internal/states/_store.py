@@ -0,0 +1,168 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS states (
+    part TEXT NOT NULL,
+    step TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (part, step))"""
+
+
+class StateStore:
+    """Project wide index of the states of every part and step.
+
+    The YAML state file of each step (parts/<part>/state/<step>) remains the
+    readable export of a state, and is what older versions of snapcraft
+    read. Parsing those files is slow for big parts though, so the states
+    are also kept pickled in a single database indexed by part and step.
+    A state is only taken from the database if its state file has not
+    changed since it was stored; otherwise the file is loaded and the
+    database updated, which also migrates states from the old layout the
+    first time they are read. States are stored as loaded from their file,
+    so both ways of getting them give the same result.
+
+    A project shares a single store between all its parts. The database is
+    only opened when a state is first looked up, and then kept open, one
+    connection per thread.
+    """
+
+    def __init__(self, path):
+        """Create a new StateStore.
+
+        :param str path: Path to the database, created when first written.
+        """
+
+        self.path = path
+        self._local = threading.local()
+
+    def get(self, part_name, step, state_file):
+        """Return the state stored in state_file, None if there is none.
+
+        :param str part_name: Name of the part the state belongs to.
+        :param str step: Step the state belongs to.
+        :param str state_file: Path to the YAML export of the state.
+        """
+
+        signature = _signature(state_file)
+        if not signature:
+            return None
+
+        row = self._execute(
+            'SELECT state FROM states WHERE part = ? AND step = ? AND '
+            'signature = ?', (part_name, step, signature))
+        if row:
+            try:
+                return pickle.loads(row[0])
+            except (pickle.UnpicklingError, AttributeError, ImportError,
+                    EOFError) as e:
+                # Stored by another version of snapcraft, or damaged: the
+                # file is loaded and stored again.
+                logger.debug('Unable to load the stored state of {} for '
+                             '{!r}: {}'.format(step, part_name, e))
+
+        with open(state_file, 'r') as f:
+            state = yaml.load(f.read())
+        self._execute('INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?)',
+                      (part_name, step, signature, pickle.dumps(state)))
+
+        return state
+
+    def put(self, part_name, step, state_file, state):
+        """Store state, just written to state_file.
+
+        Storing a state as it is written saves loading its file back on the
+        next run. It must be what loading state_file gives, like a state
+        returned by get(), for both ways of getting it to give the same
+        result.
+        """
+
+        signature = _signature(state_file)
+        if signature:
+            self._execute(
+                'INSERT OR REPLACE INTO states VALUES (?, ?, ?, ?)',
+                (part_name, step, signature, pickle.dumps(state)))
+
+    def remove(self, part_name, step):
+        """Forget the state of step for part_name."""
+
+        if not os.path.exists(self.path):
+            return
+
+        self._execute('DELETE FROM states WHERE part = ? AND step = ?',
+                      (part_name, step))
+
+    def _execute(self, statement, parameters):
+        try:
+            connection = self._connection()
+            with connection:
+                return connection.execute(statement, parameters).fetchone()
+        except sqlite3.Error as e:
+            # The state files are the reference, failing to use the index
+            # only makes looking states up slower.
+            logger.debug('Unable to use the state store {!r}: {}'.format(
+                self.path, e))
+            self._close()
+            return None
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Cleaning removes the parts directory, and the database with it.
+        if connection and not os.path.exists(self.path):
+            self._close()
+            connection = None
+        if connection:
+            return connection
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # sqlite connections cannot be shared between threads, so each one
+        # gets its own.
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            # Losing the latest writes to an index on a crash is harmless.
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute(_SCHEMA)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        self._local.connection = connection
+
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection:
+            connection.close()
+            self._local.connection = None
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return '{}:{}:{}'.format(stat.st_ino, stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,203 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record where the time of a lifecycle run goes.
+
+Spans are only recorded between a call to start() and the matching call to
+stop(), so the instrumentation left in the code is close to free otherwise.
+
+Basic example:
+    >>> tracing.start()
+    >>> with tracing.span('build', category='step', part='foo'):
+    ...     tracing.count('bytes', 42)
+    >>> tracer = tracing.stop()
+    >>> tracer.write('trace.json')
+"""
+
+import collections
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+from tabulate import tabulate
+
+_tracer = None
+
+
+class Tracer:
+    """Collect spans as complete events of the Chrome trace-event format.
+
+    Every span records its wall time and the CPU time used by the child
+    processes that finished while it was open. The latter is accounted for
+    the whole process, so spans running concurrently share it.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, *, category, **args):
+        """Record the time spent in the body of the with statement.
+
+        :param str name: Name of the span, e.g. the step or phase.
+        :param str category: Category of the span, e.g. 'step' or 'phase'.
+        :param args: Extra arguments to record with the span.
+        """
+
+        counters = collections.Counter()
+        stack = self._stack()
+        stack.append(counters)
+        start = time.perf_counter()
+        cpu_start = _children_cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = _children_cpu_time() - cpu_start
+            stack.pop()
+
+            args = dict(args, cpu=round(cpu, 6), **counters)
+            event = collections.OrderedDict([
+                ('name', name),
+                ('cat', category),
+                ('ph', 'X'),
+                ('ts', _microseconds(start - self._start)),
+                ('dur', _microseconds(wall)),
+                ('pid', os.getpid()),
+                ('tid', threading.get_ident()),
+                ('args', args),
+            ])
+            with self._lock:
+                self._events.append(event)
+
+    def count(self, counter, value):
+        """Add value to counter for all the spans open in this thread."""
+
+        for counters in self._stack():
+            counters[counter] += value
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    @property
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def write(self, path):
+        """Write the recorded spans to path as a Chrome trace-event file.
+
+        The file can be loaded in chrome://tracing.
+        """
+
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events,
+                       'displayTimeUnit': 'ms'}, trace_file, indent=1)
+
+    def summary(self):
+        """Return a table of the steps run, slowest first.
+
+        The phases of the steps are summed up over all parts in a second
+        table.
+        """
+
+        steps = []
+        phases = collections.OrderedDict()
+        for event in self.events:
+            wall = event['dur'] / 1e6
+            cpu = event['args']['cpu']
+            written = event['args'].get('bytes', 0)
+            if event['cat'] == 'step':
+                steps.append((event['args']['part'], event['name'],
+                              wall, cpu, written))
+            elif event['cat'] == 'phase':
+                total = phases.get(event['name'], (0.0, 0.0, 0))
+                phases[event['name']] = (
+                    total[0] + wall, total[1] + cpu, total[2] + written)
+
+        steps.sort(key=lambda row: row[2], reverse=True)
+        phases = sorted(((name,) + total for name, total in phases.items()),
+                        key=lambda row: row[1], reverse=True)
+
+        return '\n\n'.join([
+            tabulate(steps, headers=['Part', 'Step', 'Wall (s)',
+                                     'Child CPU (s)', 'Written (bytes)'],
+                     floatfmt='.3f', tablefmt='plain'),
+            tabulate(phases, headers=['Phase', 'Wall (s)', 'Child CPU (s)',
+                                      'Written (bytes)'],
+                     floatfmt='.3f', tablefmt='plain'),
+        ])
+
+
+def start():
+    """Start recording spans into a new Tracer."""
+
+    global _tracer
+    _tracer = Tracer()
+
+
+def stop():
+    """Stop recording spans and return the Tracer holding them."""
+
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_enabled():
+    """Return True if spans are being recorded."""
+
+    return _tracer is not None
+
+
+def span(name, *, category, **args):
+    """Record the time spent in a with statement, if tracing is enabled.
+
+    See Tracer.span for the arguments.
+    """
+
+    tracer = _tracer
+    if tracer is None:
+        return contextlib.ExitStack()
+
+    return tracer.span(name, category=category, **args)
+
+
+def count(counter, value):
+    """Add value to counter for the open spans, if tracing is enabled."""
+
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(counter, value)
+
+
+def _children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _microseconds(seconds):
+    return int(seconds * 1e6)
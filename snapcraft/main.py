@@ -56,6 +56,8 @@ Usage:
   snapcraft [options] define <part-name>
   snapcraft [options] search [<query> ...]
   snapcraft [options] enable-ci [<ci-system>] [--refresh]
+  snapcraft [options] cache stats
+  snapcraft [options] cache prune [--max-size=<size>] [--max-age=<days>]
   snapcraft [options] help (topics | <plugin> | <topic>) [--devel]
   snapcraft (-h | --help)
   snapcraft --version
@@ -70,6 +72,13 @@ Options:
   --target-arch ARCH                    EXPERIMENTAL: sets the target
                                         architecture. Very few plugins support
                                         this.
+  -j <jobs>, --jobs <jobs>              run up to <jobs> lifecycle steps of
+                                        independent parts at the same time
+                                        [default: 1].
+  --trace <trace-file>                  record the time spent in each
+                                        lifecycle step to <trace-file> (in
+                                        Chrome trace-event format) and print a
+                                        summary at the end.
 
 Options specific to cleanbuild:
   --remote <remote> Use a specific lxd remote to run the cleanbuild on.
@@ -84,6 +93,11 @@ Options specific to building:
   --no-parallel-build                   use only a single build job per part
                                         (the default number of jobs per part is
                                         equal to the number of CPUs)
+  --job-memory <MiB>                    memory each build job is expected to
+                                        use; the build jobs of all parts
+                                        together are limited to what the
+                                        available memory allows
+                                        [default: 1024].
 
 Options specific to cleaning:
   -s <step>, --step <step>              only clean the specified step and those
@@ -94,6 +108,13 @@ Options specific to snapping:
   -o <snap-file>, --output <snap-file>  used in case you want to rename the
                                         snap.
 
+Options specific to cache pruning:
+  --max-size <size>     evict the entries used least recently until the
+                        caches fit in <size>, like 10G (defaults to
+                        $SNAPCRAFT_CACHE_MAX_SIZE or 10G).
+  --max-age <days>      evict the entries not used for <days> (defaults to
+                        $SNAPCRAFT_CACHE_MAX_AGE or 30).
+
 Options specific to store interaction:
   --release <channels>  Comma separated list of channels to release to.
   --series <series>     Snap series [default: {DEFAULT_SERIES}].
@@ -126,6 +147,8 @@ The available commands are:
   close           Close one or more channels of a snap.
   enable-ci       EXPERIMENTAL enable continuous-integration systems to build and
                   release snaps to the Ubuntu Store.
+  cache           Show how the caches of snapcraft are used (stats), or evict
+                  the entries that are too old or too many (prune).
 
 The available lifecycle commands are:
   clean        Remove content - cleans downloads, builds or install artifacts.
@@ -164,8 +187,10 @@ import sys
 from docopt import docopt
 
 import snapcraft
+from snapcraft.formatting_utils import humanize_size
 from snapcraft.integrations import enable_ci
 from snapcraft.internal import (
+    cache,
     deprecations,
     lifecycle,
     log,
@@ -227,10 +252,41 @@ def _get_project_options(args):
     options['parallel_builds'] = not args['--no-parallel-build']
     options['target_deb_arch'] = args['--target-arch']
     options['debug'] = args['--debug']
+    options['jobs'] = _get_jobs(args['--jobs'])
+    options['trace_file'] = args['--trace']
+    options['job_memory'] = _get_job_memory(args['--job-memory'])
 
     return snapcraft.ProjectOptions(**options)
 
 
+def _get_jobs(value):
+    try:
+        jobs = int(value)
+    except (TypeError, ValueError):
+        jobs = 0
+
+    if jobs < 1:
+        raise EnvironmentError(
+            'The number of jobs must be a positive integer, not {!r}'.format(
+                value))
+
+    return jobs
+
+
+def _get_job_memory(value):
+    try:
+        job_memory = int(value)
+    except (TypeError, ValueError):
+        job_memory = 0
+
+    if job_memory < 1:
+        raise EnvironmentError(
+            'The memory of a build job must be a positive number of MiB, '
+            'not {!r}'.format(value))
+
+    return job_memory
+
+
 def main(argv=None):
     doc = __doc__.format(DEFAULT_SERIES=DEFAULT_SERIES)
     args = docopt(doc, version=snapcraft.__version__, argv=argv)
@@ -241,7 +297,6 @@ def main(argv=None):
         log_level = logging.DEBUG
 
     log.configure(log_level=log_level)
-    project_options = _get_project_options(args)
 
     logger.debug("Starting snapcraft {} from {}.".format(
         snapcraft.__version__, os.path.dirname(__file__)))
@@ -250,6 +305,7 @@ def main(argv=None):
         logger.warning("DEPRECATED: use 'prime' instead of 'strip'")
         args['prime'] = True
     try:
+        project_options = _get_project_options(args)
         return run(args, project_options)
     except Exception as e:
         if args['--debug']:
@@ -302,6 +358,8 @@ def run(args, project_options):  # noqa
                              args['--devel'], args['topics'])
     elif args['enable-ci']:
         enable_ci(args['<ci-system>'], args['--refresh'])
+    elif args['cache']:
+        _run_cache_command(args)
     elif args['update']:
         parts.update()
     elif args['define']:
@@ -323,6 +381,24 @@ def _run_clean(args, project_options):
     lifecycle.clean(project_options, args['<part>'], step)
 
 
+def _run_cache_command(args):
+    if args['prune']:
+        pruned = cache.CacheManager(
+            max_size=args['--max-size'], max_age=args['--max-age']).prune()
+        print('Evicted {} cache entries, reclaiming {}.'.format(
+            len(pruned.entries), humanize_size(pruned.size)))
+        return
+
+    print('{:<24} {:>8} {:>12} {:>8} {:>8} {:>8}'.format(
+        'Cache', 'Entries', 'Size', 'Hits', 'Misses', 'Hit rate'))
+    for stats in cache.CacheManager().get_stats():
+        lookups = stats.hits + stats.misses
+        print('{:<24} {:>8} {:>12} {:>8} {:>8} {:>8}'.format(
+            stats.kind, '-' if stats.entries is None else stats.entries,
+            humanize_size(stats.size), stats.hits, stats.misses,
+            '{:.0%}'.format(stats.hits / lookups) if lookups else '-'))
+
+
 def _is_store_command(args):
     commands = (
         'list-registered', 'registered', 'list-keys', 'keys', 'create-key',
@@ -565,6 +565,13 @@ deb http://${{security}}.ubuntu.com/${{suffix}} {0}-security main universe
             '-DCMAKE_C_COMPILER={}'.format(compilers.c_compiler_path),
             '-DCMAKE_CXX_COMPILER={}'.format(compilers.cxx_compiler_path)
         ])
+        # These compilers are not found through PATH, so they cannot be put
+        # behind ccache the way the others are.
+        if 'ccache' in getattr(self.options, 'build_attributes', []):
+            catkincmd.extend([
+                '-DCMAKE_C_COMPILER_LAUNCHER=ccache',
+                '-DCMAKE_CXX_COMPILER_LAUNCHER=ccache',
+            ])
 
         # This command must run in bash due to a bug in Catkin that causes it
         # to explode if there are spaces in the cmake args (which there are).
@@ -27,7 +27,7 @@ import threading
 import testscenarios
 import testtools
 
-from snapcraft.internal import common
+from snapcraft.internal import common, repo
 from snapcraft.tests import fake_servers, fixture_setup
 
 
@@ -116,6 +116,8 @@ class TestCase(testscenarios.WithScenarios, testtools.TestCase):
         self.addCleanup(common.set_librariesdir, common.get_librariesdir())
         self.addCleanup(common.set_tourdir, common.get_tourdir())
         self.addCleanup(common.reset_env)
+        # The archive kept open by repo would otherwise outlive the test.
+        self.addCleanup(repo.close_archive)
         common.set_schemadir(os.path.join(__file__,
                              '..', '..', '..', 'schema'))
         self.fake_logger = fixtures.FakeLogger(level=logging.ERROR)
@@ -132,6 +134,13 @@ class TestCase(testscenarios.WithScenarios, testtools.TestCase):
         patcher.start()
         self.addCleanup(patcher.stop)
 
+        # The caches are within the project here, pruning them at the end of
+        # a lifecycle run would make its sources look changed.
+        patcher = mock.patch('snapcraft.internal.lifecycle.CacheManager')
+        self.cache_manager = patcher.start()
+        self.cache_manager.return_value.prune_if_due.return_value = None
+        self.addCleanup(patcher.stop)
+
         # These are what we expect by default
         self.snap_dir = os.path.join(os.getcwd(), 'snap')
         self.prime_dir = os.path.join(os.getcwd(), 'prime')
@@ -0,0 +1,85 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark running commands in the build environment.
+
+Not part of the unit tests, run it with:
+    ./runtests.sh unit bench_common.py
+or print the timings with:
+    python3 -m snapcraft.tests.bench_common
+"""
+
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from snapcraft.internal import common
+
+_CALL_COUNT = 1000
+# About the size of the build env of a part with a few dependencies.
+_ENV = (['PATH="/stage{}/usr/bin:$PATH"'.format(i) for i in range(20)] +
+        ['CFLAGS="$CFLAGS -I/stage{}/usr/include"'.format(i)
+         for i in range(20)] +
+        ['SNAPCRAFT_PART_INSTALL=/parts/part/install'])
+
+
+def _run_output_with_script(cmd):
+    # How run_output used to run every command.
+    with tempfile.NamedTemporaryFile(mode='w+') as f:
+        f.write(common.assemble_env())
+        f.write('\n')
+        f.write('exec "$@"')
+        f.flush()
+        output = subprocess.check_output(['/bin/sh', f.name] + cmd)
+        return output.decode(sys.getfilesystemencoding()).strip()
+
+
+def _time(run_output):
+    start = time.perf_counter()
+    for _ in range(_CALL_COUNT):
+        run_output(['true'])
+
+    return time.perf_counter() - start
+
+
+def run():
+    """Time _CALL_COUNT calls to run_output, before and after.
+
+    :returns: A (resolved env, script per call) tuple of seconds.
+    """
+
+    common.set_env(_ENV)
+    try:
+        return _time(common.run_output), _time(_run_output_with_script)
+    finally:
+        common.reset_env()
+
+
+class RunOutputBenchmark(unittest.TestCase):
+
+    def test_run_output_is_faster(self):
+        resolved, script = run()
+
+        self.assertGreater(script / resolved, 1.2)
+
+
+if __name__ == '__main__':
+    resolved, script = run()
+    print('{} run_output calls: {:.3f}s with a resolved env, {:.3f}s with a '
+          'script per call ({:.1f}x faster)'.format(
+              _CALL_COUNT, resolved, script, script / resolved))
@@ -0,0 +1,110 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+
+from xdg import BaseDirectory
+
+from snapcraft.internal import cache
+from snapcraft import tests
+
+
+def _make_executable(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+
+class CompilerCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.bin_dir = os.path.join(self.path, 'bin')
+        self.ccache = os.path.join(self.bin_dir, 'ccache')
+        _make_executable(self.ccache)
+        _make_executable(os.path.join(self.bin_dir, 'gcc'))
+        _make_executable(os.path.join(self.bin_dir, 'g++'))
+        self.wrappers_dir = os.path.join(self.path, 'wrappers')
+        self.compiler_cache = cache.CompilerCache()
+
+    def test_env(self):
+        env = self.compiler_cache.env(self.wrappers_dir, 'ccache.log')
+
+        self.assertEqual(env, [
+            'PATH="{}:$PATH"'.format(self.wrappers_dir),
+            'CCACHE_DIR="{}"'.format(os.path.join(
+                BaseDirectory.xdg_cache_home, 'snapcraft', 'ccache')),
+            'CCACHE_MAXSIZE="${CCACHE_MAXSIZE:-5G}"',
+            'CCACHE_LOGFILE="ccache.log"',
+        ])
+
+    def test_setup_wraps_compilers_found(self):
+        path = os.pathsep.join([self.wrappers_dir, self.bin_dir])
+
+        self.assertTrue(self.compiler_cache.setup(
+            self.wrappers_dir, ['gcc', 'g++', 'clang'], path))
+
+        self.assertEqual(sorted(os.listdir(self.wrappers_dir)),
+                         ['g++', 'gcc'])
+        self.assertThat(os.path.join(self.wrappers_dir, 'gcc'),
+                        tests.LinkExists(self.ccache))
+        self.assertTrue(
+            os.path.isdir(self.compiler_cache.compiler_cache_root))
+
+    def test_setup_removes_stale_wrappers(self):
+        os.makedirs(self.wrappers_dir)
+        os.symlink(self.ccache, os.path.join(self.wrappers_dir, 'clang'))
+
+        self.compiler_cache.setup(self.wrappers_dir, ['gcc', 'clang'],
+                                  self.bin_dir)
+
+        self.assertEqual(os.listdir(self.wrappers_dir), ['gcc'])
+
+    def test_setup_without_ccache(self):
+        os.remove(self.ccache)
+
+        self.assertFalse(self.compiler_cache.setup(
+            self.wrappers_dir, ['gcc'], self.bin_dir))
+
+        self.assertFalse(os.path.exists(self.wrappers_dir))
+
+    def test_get_stats(self):
+        with open('ccache.log', 'w') as f:
+            # ccache 3
+            f.write('[2017-06-01T10:00:00.000000 1] Result: cache miss\n')
+            f.write('[2017-06-01T10:00:01.000000 2] '
+                    'Result: cache hit (direct)\n')
+            f.write('[2017-06-01T10:00:02.000000 3] '
+                    'Result: cache hit (preprocessed)\n')
+            f.write('[2017-06-01T10:00:03.000000 4] '
+                    'Result: called for link\n')
+            # ccache 4
+            f.write('[2017-06-01T10:00:04.000000 5] '
+                    'Result: direct_cache_miss\n')
+            f.write('[2017-06-01T10:00:04.000000 5] '
+                    'Result: preprocessed_cache_miss\n')
+            f.write('[2017-06-01T10:00:04.000000 5] Result: cache_miss\n')
+            f.write('[2017-06-01T10:00:05.000000 6] '
+                    'Result: direct_cache_hit\n')
+            f.write('[2017-06-01T10:00:06.000000 7] Compiler: gcc\n')
+
+        self.assertEqual(self.compiler_cache.get_stats('ccache.log'), (3, 2))
+        self.assertFalse(os.path.exists('ccache.log'))
+
+    def test_get_stats_without_log(self):
+        self.assertEqual(self.compiler_cache.get_stats('ccache.log'), (0, 0))
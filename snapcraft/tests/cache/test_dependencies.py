@@ -0,0 +1,114 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+from snapcraft import tests
+from snapcraft.internal import cache
+
+
+class DependencyCacheTestCase(tests.TestCase):
+
+    def test_get_without_cache(self):
+        dependency_cache = cache.DependencyCache()
+
+        self.assertEqual(dependency_cache.get('context', {'bin/foo': 's1'}),
+                         {})
+        self.assertFalse(os.path.exists(dependency_cache.path))
+
+    def test_cache_and_get(self):
+        dependency_cache = cache.DependencyCache()
+        dependency_cache.cache('context', {
+            'bin/foo': ('s1', {'/lib/libfoo.so.1', '/lib/libbar.so.1'}),
+            'bin/bar': ('s2', []),
+        })
+
+        self.assertEqual(
+            cache.DependencyCache().get(
+                'context', {'bin/foo': 's1', 'bin/bar': 's2'}),
+            {'bin/foo': ['/lib/libbar.so.1', '/lib/libfoo.so.1'],
+             'bin/bar': []})
+
+    def test_changed_files_are_not_cached(self):
+        dependency_cache = cache.DependencyCache()
+        dependency_cache.cache('context', {
+            'bin/foo': ('s1', ['/lib/libfoo.so.1']),
+            'bin/bar': ('s2', []),
+        })
+
+        self.assertEqual(
+            dependency_cache.get('context',
+                                 {'bin/foo': 's3', 'bin/bar': 's2'}),
+            {'bin/bar': []})
+
+    def test_lookups_are_recorded(self):
+        dependency_cache = cache.DependencyCache()
+        dependency_cache.cache('context', {'bin/foo': ('s1', [])})
+
+        dependency_cache.get('context', {'bin/foo': 's1', 'bin/bar': 's2'})
+
+        stats = {s.kind: s for s in cache.CacheManager().get_stats()}
+        self.assertEqual((stats['dependencies'].hits,
+                          stats['dependencies'].misses), (1, 1))
+
+    def test_other_contexts_are_not_cached(self):
+        dependency_cache = cache.DependencyCache()
+        dependency_cache.cache('context', {
+            'bin/foo': ('s1', ['/lib/libfoo.so.1'])})
+
+        self.assertEqual(
+            dependency_cache.get('other-context', {'bin/foo': 's1'}), {})
+
+    @mock.patch('time.time')
+    def test_unused_entries_are_evicted(self, time_mock):
+        dependency_cache = cache.DependencyCache(max_age=100)
+        time_mock.return_value = 1000
+        dependency_cache.cache('context', {
+            'bin/foo': ('s1', []), 'bin/bar': ('s2', [])})
+        time_mock.return_value = 1050
+        dependency_cache.get('context', {'bin/foo': 's1'})
+
+        time_mock.return_value = 1120
+        dependency_cache.prune()
+
+        self.assertEqual(
+            dependency_cache.get('context', {'bin/foo': 's1',
+                                             'bin/bar': 's2'}),
+            {'bin/foo': []})
+
+    @mock.patch('time.time')
+    def test_oldest_entries_are_evicted(self, time_mock):
+        dependency_cache = cache.DependencyCache(max_entries=2)
+        for index, path in enumerate(['bin/foo', 'bin/bar', 'bin/baz']):
+            time_mock.return_value = 1000 + index
+            dependency_cache.cache('context', {path: ('s', [])})
+
+        self.assertEqual(
+            dependency_cache.get('context', {'bin/foo': 's', 'bin/bar': 's',
+                                             'bin/baz': 's'}),
+            {'bin/bar': [], 'bin/baz': []})
+
+    def test_broken_cache_is_ignored(self):
+        dependency_cache = cache.DependencyCache()
+        os.makedirs(os.path.dirname(dependency_cache.path))
+        with open(dependency_cache.path, 'w') as f:
+            f.write('not a database')
+
+        dependency_cache.cache('context', {'bin/foo': ('s1', [])})
+
+        self.assertEqual(dependency_cache.get('context', {'bin/foo': 's1'}),
+                         {})
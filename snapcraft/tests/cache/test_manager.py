@@ -0,0 +1,146 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+from unittest import mock
+
+import fixtures
+
+from snapcraft import tests
+from snapcraft.internal import cache
+
+_DAY = 24 * 60 * 60
+
+
+class CacheManagerTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache_root = cache.CacheManager().cache_root
+
+    def _make_entry(self, path, size, *, days_ago):
+        entry = os.path.join(self.cache_root, path)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        with open(entry, 'wb') as f:
+            f.write(b'x' * size)
+        used = int(time.time()) - days_ago * _DAY
+        with mock.patch('time.time', return_value=used):
+            cache.SnapCache(project_name='test').record_use([entry])
+        return entry
+
+    def _make_tree(self, digest, size, *, days_ago):
+        entry = os.path.join(self.cache_root, 'stage-packages', 'unpacked',
+                             digest)
+        self._make_entry(os.path.join(entry, 'tree', 'file'), size,
+                         days_ago=days_ago)
+        used = int(time.time()) - days_ago * _DAY
+        with mock.patch('time.time', return_value=used):
+            cache.UnpackedStagePackageCache().record_use([entry])
+        return entry
+
+    def _snap(self, name):
+        return os.path.join('projects', 'test', 'snap_hashes', 'amd64', name)
+
+    def test_invalid_max_size(self):
+        raised = self.assertRaises(
+            EnvironmentError, cache.CacheManager, max_size='lots')
+
+        self.assertIn("not 'lots'", str(raised))
+
+    def test_invalid_max_age(self):
+        self.assertRaises(EnvironmentError, cache.CacheManager, max_age='-1')
+
+    def test_limits_from_the_environment(self):
+        self.useFixture(
+            fixtures.EnvironmentVariable('SNAPCRAFT_CACHE_MAX_SIZE', '2M'))
+        self.useFixture(
+            fixtures.EnvironmentVariable('SNAPCRAFT_CACHE_MAX_AGE', '1.5'))
+
+        manager = cache.CacheManager()
+
+        self.assertEqual(manager.max_size, 2 * 1024 * 1024)
+        self.assertEqual(manager.max_age, 1.5 * _DAY)
+
+    def test_prune_old_entries(self):
+        old = self._make_entry(self._snap('old'), 10, days_ago=40)
+        recent = self._make_entry(self._snap('recent'), 10, days_ago=1)
+
+        pruned = cache.CacheManager(max_age='30').prune()
+
+        self.assertEqual(pruned.entries, [old])
+        self.assertEqual(pruned.size, 10)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+
+    def test_prune_least_recently_used_across_caches(self):
+        snap = self._make_entry(self._snap('snap'), 100, days_ago=3)
+        tree = self._make_tree('digest', 100, days_ago=2)
+        recent = self._make_entry(self._snap('recent'), 100, days_ago=1)
+
+        pruned = cache.CacheManager(max_size='150').prune()
+
+        self.assertEqual(pruned.entries, [snap, tree])
+        self.assertEqual(pruned.size, 200)
+        self.assertTrue(os.path.exists(recent))
+
+    def test_prune_keeps_what_was_used_since(self):
+        old = self._make_entry(self._snap('old'), 100, days_ago=3)
+        kept = self._make_entry(self._snap('kept'), 100, days_ago=1)
+
+        pruned = cache.CacheManager(max_size='0').prune(
+            keep_since=int(time.time()) - 2 * _DAY)
+
+        self.assertEqual(pruned.entries, [old])
+        self.assertTrue(os.path.exists(kept))
+
+    def test_prune_read_only_tree(self):
+        tree = self._make_tree('digest', 10, days_ago=40)
+        os.chmod(os.path.join(tree, 'tree'), 0o555)
+
+        pruned = cache.CacheManager().prune()
+
+        self.assertEqual(pruned.entries, [tree])
+        self.assertFalse(os.path.exists(tree))
+
+    def test_size_leaves_out_files_linked_elsewhere(self):
+        tree = self._make_tree('digest', 100, days_ago=40)
+        os.link(os.path.join(tree, 'tree', 'file'), 'linked')
+
+        pruned = cache.CacheManager().prune()
+
+        self.assertEqual(pruned.size, 0)
+
+    def test_prune_if_due(self):
+        self._make_entry(self._snap('old'), 10, days_ago=40)
+        manager = cache.CacheManager()
+
+        self.assertEqual(len(manager.prune_if_due().entries), 1)
+        self._make_entry(self._snap('other'), 10, days_ago=40)
+        self.assertIsNone(manager.prune_if_due())
+
+    def test_get_stats(self):
+        self._make_tree('digest', 100, days_ago=1)
+        cache.UnpackedStagePackageCache().record_use(hits=3, misses=1)
+
+        stats = {s.kind: s for s in cache.CacheManager().get_stats()}
+
+        self.assertEqual(stats['unpacked-stage-packages'],
+                         cache.CacheStats(kind='unpacked-stage-packages',
+                                          entries=1, size=100, hits=3,
+                                          misses=1))
+        self.assertEqual(stats['snaps'].entries, 0)
+        self.assertIsNone(stats['dependencies'].entries)
@@ -0,0 +1,73 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from snapcraft import tests
+from snapcraft.internal import cache
+
+
+def _extract(tree):
+    os.makedirs(os.path.join(tree, 'usr', 'bin'))
+    open(os.path.join(tree, 'usr', 'bin', 'foo'), 'w').close()
+    return ['usr', 'usr/bin', 'usr/bin/foo']
+
+
+class UnpackedStagePackageCacheTestCase(tests.TestCase):
+
+    def test_get_without_cache(self):
+        unpacked_cache = cache.UnpackedStagePackageCache()
+
+        self.assertIsNone(unpacked_cache.get(digest='digest'))
+
+    def test_cache_and_get(self):
+        unpacked_cache = cache.UnpackedStagePackageCache()
+
+        tree, members = unpacked_cache.cache(digest='digest',
+                                             extract=_extract)
+
+        self.assertEqual(tree, os.path.join(
+            unpacked_cache.unpacked_root, 'digest', 'tree'))
+        self.assertEqual(members, ['usr', 'usr/bin', 'usr/bin/foo'])
+        self.assertTrue(os.path.isfile(os.path.join(tree, 'usr/bin/foo')))
+        self.assertEqual(cache.UnpackedStagePackageCache().get(
+            digest='digest'), (tree, members))
+
+    def test_tree_cached_first_is_kept(self):
+        unpacked_cache = cache.UnpackedStagePackageCache()
+        unpacked_cache.cache(digest='digest', extract=_extract)
+
+        def _extract_other(tree):
+            open(os.path.join(tree, 'other'), 'w').close()
+            return ['other']
+
+        tree, members = unpacked_cache.cache(digest='digest',
+                                             extract=_extract_other)
+
+        self.assertEqual(members, ['usr', 'usr/bin', 'usr/bin/foo'])
+        self.assertEqual(os.listdir(unpacked_cache.unpacked_root),
+                         ['digest'])
+
+    def test_failed_extraction_is_not_cached(self):
+        unpacked_cache = cache.UnpackedStagePackageCache()
+
+        def _fail(tree):
+            open(os.path.join(tree, 'partial'), 'w').close()
+            raise OSError('failed')
+
+        self.assertRaises(OSError, unpacked_cache.cache, digest='digest',
+                          extract=_fail)
+        self.assertEqual(os.listdir(unpacked_cache.unpacked_root), [])
@@ -0,0 +1,67 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from snapcraft.main import main
+from snapcraft.internal import cache
+from snapcraft import tests
+from snapcraft.tests import fixture_setup
+
+
+class CacheCommandTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fake_terminal = fixture_setup.FakeTerminal()
+        self.useFixture(self.fake_terminal)
+        unpacked_cache = cache.UnpackedStagePackageCache()
+        self.entry = os.path.join(unpacked_cache.unpacked_root, 'digest')
+        os.makedirs(self.entry)
+        with open(os.path.join(self.entry, 'members'), 'w') as f:
+            f.write('[]')
+        unpacked_cache.record_use([self.entry], hits=3, misses=1)
+
+    def test_stats(self):
+        main(['cache', 'stats'])
+
+        lines = self.fake_terminal.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), [
+            'Cache', 'Entries', 'Size', 'Hits', 'Misses', 'Hit', 'rate'])
+        self.assertIn(
+            'unpacked-stage-packages         1          2 B        3'
+            '        1      75%', lines)
+
+    def test_prune(self):
+        main(['cache', 'prune', '--max-size', '0'])
+
+        self.assertEqual(self.fake_terminal.getvalue(),
+                         'Evicted 1 cache entries, reclaiming 2 B.\n')
+        self.assertFalse(os.path.exists(self.entry))
+
+    def test_prune_keeps_what_fits(self):
+        main(['cache', 'prune'])
+
+        self.assertEqual(self.fake_terminal.getvalue(),
+                         'Evicted 0 cache entries, reclaiming 0 B.\n')
+        self.assertTrue(os.path.exists(self.entry))
+
+    def test_prune_invalid_size(self):
+        raised = self.assertRaises(
+            SystemExit, main, ['cache', 'prune', '--max-size', 'lots'])
+
+        self.assertEqual(raised.code, 1)
+        self.assertTrue(os.path.exists(self.entry))
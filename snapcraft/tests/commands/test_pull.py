@@ -135,17 +135,22 @@ parts:
 
         self.assertTrue(project_options.use_geoip)
 
+    @mock.patch('snapcraft.internal.repo.get_packages')
     @mock.patch('snapcraft.repo.Ubuntu.get')
     @mock.patch('snapcraft.repo.Ubuntu.unpack')
-    def test_pull_multiarch_stage_package(self, mock_unpack, mock_get):
+    def test_pull_multiarch_stage_package(self, mock_unpack, mock_get,
+                                          mock_get_packages):
         yaml_part = """  pull{:d}:
         plugin: nil
         stage-packages: ['mir:arch']"""
 
         self.make_snapcraft_yaml(n=3, yaml_part=yaml_part)
 
-        mock_get.return_value = '[mir=0.0]'
+        mock_get_packages.return_value = [['mir=0.0']]
 
         main(['--debug', 'pull', 'pull1'])
 
-        mock_get.assert_called_once_with({'mir:arch'})
+        # The stage packages of the parts pulled are fetched at once.
+        mock_get_packages.assert_called_once_with(
+            [(mock.ANY, {'mir:arch'})])
+        mock_get.assert_not_called()
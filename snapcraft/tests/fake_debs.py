@@ -0,0 +1,74 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import stat
+import tarfile
+
+_MTIME = 1500000000
+
+
+def make_deb(path, members, *, compression='gz'):
+    """Write a .deb at path, its data.tar holding members.
+
+    :param list members: (name, kind, mode, data) tuples, kind being 'dir',
+                         'file' (data is the contents), 'symlink' or
+                         'hardlink' (data is the target).
+    :param str compression: The compression of data.tar, '' for none.
+    """
+
+    control = _tar([('./control', 'file', 0o644,
+                     b'Package: fake\nVersion: 1.0\n')], 'gz')
+    data = _tar([('.', 'dir', 0o755, None)] + list(members), compression)
+    data_name = 'data.tar.{}'.format(compression) if compression else \
+        'data.tar'
+
+    with open(path, 'wb') as f:
+        f.write(b'!<arch>\n')
+        for name, contents in (('debian-binary', b'2.0\n'),
+                               ('control.tar.gz', control),
+                               (data_name, data)):
+            f.write('{:<16}{:<12}{:<6}{:<6}{:<8}{:<10}`\n'.format(
+                name, _MTIME, 0, 0, 100644, len(contents)).encode())
+            f.write(contents)
+            if len(contents) % 2:
+                f.write(b'\n')
+
+
+def _tar(members, compression):
+    buffer = io.BytesIO()
+    mode = 'w:{}'.format(compression) if compression else 'w'
+    with tarfile.open(fileobj=buffer, mode=mode) as tar:
+        for name, kind, mode, data in members:
+            info = tarfile.TarInfo(
+                name if name.startswith('.') else './' + name)
+            info.mode = stat.S_IMODE(mode)
+            info.mtime = _MTIME
+            fileobj = None
+            if kind == 'dir':
+                info.type = tarfile.DIRTYPE
+            elif kind == 'file':
+                info.size = len(data)
+                fileobj = io.BytesIO(data)
+            elif kind == 'symlink':
+                info.type = tarfile.SYMTYPE
+                info.linkname = data
+            elif kind == 'hardlink':
+                info.type = tarfile.LNKTYPE
+                info.linkname = os.path.join('.', data)
+            tar.addfile(info, fileobj)
+    return buffer.getvalue()
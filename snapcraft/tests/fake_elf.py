@@ -0,0 +1,118 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+
+_VADDR = 0x10000
+
+
+def write_elf(path, *, elf_class=2, big_endian=False, machine=62,
+              interpreter=None, dynamic=True, needed=(), soname=None,
+              rpath=None, runpath=None, flags_1=0):
+    """Write an ELF file with only the headers the dynamic linker reads."""
+
+    order = '>' if big_endian else '<'
+    if elf_class == 2:
+        header_format, segment_format, entry_format = (
+            'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ')
+    else:
+        header_format, segment_format, entry_format = (
+            'HHIIIIIHHHHHH', 'IIIIIIII', 'iI')
+    header_size = 16 + struct.calcsize(order + header_format)
+    segment_size = struct.calcsize(order + segment_format)
+
+    strings, entries = _dynamic_entries(needed, soname, rpath, runpath,
+                                        flags_1)
+    segments_count = 1 + bool(interpreter) + bool(dynamic)
+    interpreter_offset = header_size + segments_count * segment_size
+    interpreter_data = (interpreter or '').encode() + b'\0'
+    strtab_offset = interpreter_offset + len(interpreter_data)
+    dynamic_offset = strtab_offset + len(strings)
+    dynamic_offset += -dynamic_offset % 8
+    entries += [(5, _VADDR + strtab_offset), (10, len(strings)), (0, 0)]
+    dynamic_data = b''.join(
+        struct.pack(order + entry_format, *e) for e in entries)
+
+    segments = [(1, 0, dynamic_offset + len(dynamic_data))]
+    if interpreter:
+        segments.append((3, interpreter_offset, len(interpreter_data)))
+    if dynamic:
+        segments.append((2, dynamic_offset, len(dynamic_data)))
+
+    ident = b'\x7fELF' + bytes([elf_class, 2 if big_endian else 1, 1])
+    data = bytearray(ident.ljust(16, b'\0'))
+    data += struct.pack(order + header_format, 3, machine, 1, 0,
+                        header_size, 0, 0, header_size, segment_size,
+                        segments_count, 0, 0, 0)
+    data += _program_headers(segments, elf_class, order + segment_format)
+    data += interpreter_data + strings
+    data = data.ljust(dynamic_offset, b'\0') + dynamic_data
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _dynamic_entries(needed, soname, rpath, runpath, flags_1):
+    # Returns the string table and the (tag, value) entries pointing into it.
+    strings = b'\0'
+    entries = []
+    tagged = [(1, name) for name in needed]
+    if soname:
+        tagged.append((14, soname))
+    tagged += [(tag, value) for tag, value in ((15, rpath), (29, runpath))
+               if value is not None]
+    for tag, value in tagged:
+        entries.append((tag, len(strings)))
+        strings += value.encode() + b'\0'
+    if flags_1:
+        entries.append((0x6ffffffb, flags_1))
+    return strings, entries
+
+
+def _program_headers(segments, elf_class, segment_format):
+    data = b''
+    for p_type, p_offset, p_filesz in segments:
+        if elf_class == 2:
+            values = (p_type, 4, p_offset, _VADDR + p_offset, 0, p_filesz,
+                      p_filesz, 8)
+        else:
+            values = (p_type, p_offset, _VADDR + p_offset, 0, p_filesz,
+                      p_filesz, 4, 8)
+        data += struct.pack(segment_format, *values)
+    return data
+
+
+def write_ld_so_cache(path, entries):
+    """Write an ld.so.cache with (flags, name, path, hwcap) entries."""
+
+    header_size = 48
+    entry_size = 24
+    strings = b''
+    packed_entries = b''
+    strings_offset = header_size + len(entries) * entry_size
+    for flags, name, library_path, hwcap in entries:
+        key = strings_offset + len(strings)
+        strings += name.encode() + b'\0'
+        value = strings_offset + len(strings)
+        strings += library_path.encode() + b'\0'
+        packed_entries += struct.pack('=iIIIQ', flags, key, value, 0, hwcap)
+
+    header = struct.pack('=20sIIB3xI12x', b'glibc-ld.so.cache1.1',
+                         len(entries), len(strings), 2, 0)
+    with open(path, 'wb') as f:
+        f.write(header + packed_entries + strings)
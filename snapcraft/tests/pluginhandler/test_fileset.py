@@ -0,0 +1,134 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+
+from snapcraft.internal import pluginhandler
+from snapcraft.internal.pluginhandler._fileset import FilesetMatcher
+from snapcraft import tests
+
+_NAMES = ['a', 'b', 'ab', 'lib', '.hidden', 'x.so']
+_COMPONENTS = _NAMES + ['*', '**', '?', '.*', '*.so', '[ab]*', 'missing']
+
+
+def _make_tree(rand, directory):
+    paths = []
+    dirs = [directory]
+    for _ in range(rand.randint(1, 25)):
+        parent = rand.choice(dirs)
+        path = os.path.join(parent, rand.choice(_NAMES))
+        if os.path.lexists(path):
+            continue
+        if rand.random() < 0.4 and path.count(os.sep) < 6:
+            os.mkdir(path)
+            dirs.append(path)
+        else:
+            open(path, 'w').close()
+        paths.append(path)
+
+    for _ in range(rand.randint(0, 3)):
+        link = os.path.join(rand.choice(dirs), rand.choice(_NAMES))
+        target = rand.choice(paths + ['dangling'])
+        # Links to their own parents would loop forever.
+        if os.path.lexists(link) or (link + os.sep).startswith(
+                target + os.sep) or link.startswith(target + os.sep):
+            continue
+        os.symlink(os.path.relpath(target, os.path.dirname(link)), link)
+
+
+def _make_pattern(rand):
+    pattern = '/'.join(rand.choice(_COMPONENTS)
+                       for _ in range(rand.randint(1, 3)))
+    if rand.random() < 0.1:
+        pattern += '/'
+    return pattern
+
+
+class FilesetMatcherTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs('install/usr/lib/.cache')
+        os.makedirs('install/usr/share/doc')
+        os.makedirs('install/.hidden')
+        for path in ['bin', 'usr/lib/libfoo.so', 'usr/lib/libfoo.a',
+                     'usr/lib/.cache/data', 'usr/share/doc/README',
+                     '.hidden/file']:
+            open(os.path.join('install', path), 'w').close()
+        os.symlink('usr/lib', 'install/lib')
+
+    def test_everything_but_hidden_toplevel_entries(self):
+        files, dirs = FilesetMatcher(['*'], []).scan('install')
+
+        self.assertEqual({'bin', 'lib', 'lib/libfoo.so', 'lib/libfoo.a',
+                          'lib/.cache/data', 'usr/lib/libfoo.so',
+                          'usr/lib/libfoo.a', 'usr/lib/.cache/data',
+                          'usr/share/doc/README'}, files)
+        self.assertEqual({'lib', 'lib/.cache', 'usr', 'usr/lib',
+                          'usr/lib/.cache', 'usr/share', 'usr/share/doc'},
+                         dirs)
+
+    def test_exclude_removes_whole_directories(self):
+        files, dirs = FilesetMatcher(['usr'], ['usr/share']).scan('install')
+
+        self.assertEqual({'usr/lib/libfoo.so', 'usr/lib/libfoo.a',
+                          'usr/lib/.cache/data'}, files)
+        self.assertEqual({'usr', 'usr/lib', 'usr/lib/.cache'}, dirs)
+
+    def test_recursive_wildcard(self):
+        files, dirs = FilesetMatcher(['usr/**/*.so'], []).scan('install')
+
+        self.assertEqual({'usr/lib/libfoo.so'}, files)
+        self.assertEqual({'usr', 'usr/lib'}, dirs)
+
+    def test_exclude_with_wildcards(self):
+        files, dirs = FilesetMatcher(
+            ['usr/lib'], ['**/*.a', 'usr/lib/.*']).scan('install')
+
+        self.assertEqual({'usr/lib/libfoo.so'}, files)
+        self.assertEqual({'usr', 'usr/lib'}, dirs)
+
+    def test_missing_include_is_kept(self):
+        files, dirs = FilesetMatcher(['usr/missing'], []).scan('install')
+
+        self.assertEqual({'usr/missing'}, files)
+        self.assertEqual({'usr'}, dirs)
+
+    def test_counts(self):
+        matcher = FilesetMatcher(['usr/share'], [])
+        matcher.scan('install')
+
+        # The top level, usr, usr/share and usr/share/doc.
+        self.assertEqual(8, matcher.scanned)
+        self.assertEqual(3, matcher.matched)
+
+    def test_same_as_glob(self):
+        for seed in range(300):
+            rand = random.Random(seed)
+            directory = os.path.join('trees', str(seed))
+            os.makedirs(directory)
+            _make_tree(rand, directory)
+            fileset = [_make_pattern(rand)
+                       for _ in range(rand.randint(0, 2))]
+            fileset += ['-' + _make_pattern(rand)
+                        for _ in range(rand.randint(0, 2))]
+
+            self.assertEqual(
+                pluginhandler._glob_migratable_filesets(fileset, directory),
+                pluginhandler._migratable_filesets(fileset, directory),
+                'fileset {!r} in tree {}'.format(fileset, seed))
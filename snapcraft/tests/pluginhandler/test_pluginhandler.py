@@ -47,6 +47,7 @@ from snapcraft.internal import (
 )
 from snapcraft import tests
 from snapcraft.tests import fixture_setup
+from snapcraft.tests.fake_elf import write_elf
 from snapcraft.plugins import nil
 
 
@@ -340,6 +341,42 @@ class PluginTestCase(tests.TestCase):
         self.assertEqual(stat.S_IMODE(
             os.stat(os.path.join('stage', 'foo', 'bar')).st_mode), new_mode)
 
+    @patch('snapcraft.file_utils.create_similar_directory',
+           wraps=snapcraft.file_utils.create_similar_directory)
+    def test_migrate_files_creates_directories_once(self, create_mock):
+        for directory in ('a', 'b'):
+            os.makedirs(os.path.join('install', directory))
+            for index in range(3):
+                open(os.path.join(
+                    'install', directory, str(index)), 'w').close()
+        os.makedirs('stage')
+
+        files, dirs = pluginhandler._migratable_filesets(['*'], 'install')
+        pluginhandler._migrate_files(files, dirs, 'install', 'stage')
+
+        self.assertEqual(
+            sorted(args[0][1] for args in create_mock.call_args_list),
+            [os.path.join('stage', 'a'), os.path.join('stage', 'b')])
+
+    @patch('snapcraft.internal.pluginhandler._MIGRATION_BATCH_SIZE', new=2)
+    def test_migrate_files_in_batches(self):
+        os.makedirs(os.path.join('install', 'dir'))
+        os.makedirs('stage')
+        for index in range(7):
+            with open(os.path.join('install', 'dir', str(index)), 'w') as f:
+                f.write(str(index))
+        os.symlink('0', os.path.join('install', 'dir', 'link'))
+
+        files, dirs = pluginhandler._migratable_filesets(['*'], 'install')
+        pluginhandler._migrate_files(files, dirs, 'install', 'stage')
+
+        for index in range(7):
+            path = os.path.join('stage', 'dir', str(index))
+            self.assertTrue(os.path.samefile(
+                path, os.path.join('install', 'dir', str(index))))
+        self.assertEqual(
+            '0', os.readlink(os.path.join('stage', 'dir', 'link')))
+
     @patch('importlib.import_module')
     @patch('snapcraft.internal.pluginhandler._load_local')
     @patch('snapcraft.internal.pluginhandler._get_plugin')
@@ -1219,8 +1256,8 @@ class StateTestCase(StateBaseTestCase):
         self.handler.prime()
 
         self.assertEqual('prime', self.handler.last_step())
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1', 'bin/2'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1', 'bin/2'}, self.handler.stagedir)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -1263,8 +1300,8 @@ class StateTestCase(StateBaseTestCase):
         self.assertEqual('prime', self.handler.last_step())
         # bin/2 shouldn't be in this list as it was already primed by another
         # part.
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1'}, self.handler.stagedir)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -1307,7 +1344,7 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/1', 'bin/2'})
+            self.handler.snapdir, {'bin/1', 'bin/2'}, self.handler.stagedir)
         mock_migrate_files.assert_has_calls([
             call({'bin/1', 'bin/2'}, {'bin'}, self.handler.stagedir,
                  self.handler.snapdir),
@@ -1366,7 +1403,7 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/file'})
+            self.handler.snapdir, {'bin/file'}, self.handler.stagedir)
         # Verify that only the part's files were migrated-- not the system
         # dependency.
         mock_migrate_files.assert_called_once_with(
@@ -1408,7 +1445,8 @@ class StateTestCase(StateBaseTestCase):
 
         self.assertEqual('prime', self.handler.last_step())
         mock_find_dependencies.assert_called_once_with(
-            self.handler.snapdir, {'bin/1', 'foo/bar/baz'})
+            self.handler.snapdir, {'bin/1', 'foo/bar/baz'},
+            self.handler.stagedir)
         mock_migrate_files.assert_called_once_with(
             {'bin/1', 'foo/bar/baz'}, {'bin', 'foo', 'foo/bar'},
             self.handler.stagedir, self.handler.snapdir)
@@ -1439,8 +1477,8 @@ class StateTestCase(StateBaseTestCase):
         self.handler.prime()
 
         self.assertEqual('prime', self.handler.last_step())
-        mock_find_dependencies.assert_called_once_with(self.handler.snapdir,
-                                                       {'bin/1'})
+        mock_find_dependencies.assert_called_once_with(
+            self.handler.snapdir, {'bin/1'}, self.handler.stagedir)
         self.assertFalse(mock_copy.called)
 
         state = self.handler.get_state('prime')
@@ -2088,6 +2126,118 @@ class CleanStageTestCase(CleanBaseTestCase):
                          'Expected snapdir to be completely cleaned')
 
 
+class IncrementalStageTestCase(CleanBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.handler = mocks.loadplugin('part1')
+        self.handler.makedirs()
+        self.installdir = self.handler.code.installdir
+        os.makedirs(os.path.join(self.installdir, 'bin'))
+        os.makedirs(os.path.join(self.installdir, 'lib'))
+        for path in ('bin/1', 'bin/2', 'lib/3'):
+            open(os.path.join(self.installdir, path), 'w').close()
+
+        self.handler.mark_done('build')
+        self.handler.stage()
+
+    def test_build_supersedes_stage(self):
+        self.handler.mark_done('build')
+
+        self.assertTrue(self.handler.is_clean('stage'))
+        self.assertEqual({'bin/1', 'bin/2', 'lib/3'},
+                         self.handler.get_previous_state('stage').files)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.stage_dir, 'bin', '1')))
+
+    @patch('snapcraft.file_utils.link_or_copy')
+    def test_restage_only_migrates_changes(self, mock_link_or_copy):
+        os.remove(os.path.join(self.installdir, 'bin', '2'))
+        shutil.rmtree(os.path.join(self.installdir, 'lib'))
+        open(os.path.join(self.installdir, 'bin', '4'), 'w').close()
+        self.handler.mark_done('build')
+
+        self.handler.stage()
+
+        mock_link_or_copy.assert_called_once_with(
+            os.path.join(self.installdir, 'bin', '4'),
+            os.path.join(self.stage_dir, 'bin', '4'), follow_symlinks=False)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.stage_dir, 'bin', '2')))
+        self.assertFalse(os.path.exists(os.path.join(self.stage_dir, 'lib')))
+        self.assertEqual({'bin/1', 'bin/4'},
+                         self.handler.get_state('stage').files)
+        self.assertIsNone(self.handler.get_previous_state('stage'))
+
+    def test_restage_replaces_changed_copies(self):
+        # Copies are what linking across devices ends up with.
+        staged = os.path.join(self.stage_dir, 'bin', '1')
+        os.remove(staged)
+        with open(staged, 'w') as f:
+            f.write('old')
+        self.handler.mark_done('build')
+
+        self.handler.stage()
+
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.installdir, 'bin', '1'), staged))
+
+    def test_restage_replaces_retargeted_symlinks(self):
+        libdir = os.path.join(self.installdir, 'lib')
+        for name in ('libfoo.so.1', 'libfoo.so.2'):
+            open(os.path.join(libdir, name), 'w').close()
+        os.symlink('libfoo.so.1', os.path.join(libdir, 'libfoo.so'))
+        self.handler.mark_done('build')
+        self.handler.stage()
+
+        os.remove(os.path.join(libdir, 'libfoo.so.1'))
+        os.remove(os.path.join(libdir, 'libfoo.so'))
+        os.symlink('libfoo.so.2', os.path.join(libdir, 'libfoo.so'))
+        self.handler.mark_done('build')
+        self.handler.stage()
+
+        staged = os.path.join(self.stage_dir, 'lib', 'libfoo.so')
+        self.assertEqual('libfoo.so.2', os.readlink(staged))
+        self.assertTrue(os.path.exists(staged))
+
+    def test_restage_keeps_files_of_other_parts(self):
+        handler2 = mocks.loadplugin('part2')
+        handler2.makedirs()
+        os.makedirs(os.path.join(handler2.code.installdir, 'bin'))
+        open(os.path.join(handler2.code.installdir, 'bin', '2'), 'w').close()
+        handler2.mark_done('build')
+        handler2.stage()
+
+        os.remove(os.path.join(self.installdir, 'bin', '2'))
+        self.handler.mark_done('build')
+        self.handler.stage(project_state={
+            'part1': None, 'part2': handler2.get_state('stage')})
+
+        self.assertTrue(
+            os.path.exists(os.path.join(self.stage_dir, 'bin', '2')))
+
+    def test_clean_stage_removes_superseded_files(self):
+        self.handler.mark_done('build')
+
+        self.handler.clean_stage({})
+
+        self.assertFalse(os.listdir(self.stage_dir))
+        self.assertIsNone(self.handler.get_previous_state('stage'))
+
+    @patch('snapcraft.internal.pluginhandler._find_dependencies')
+    def test_incremental_clean_supersedes(self, mock_find_dependencies):
+        mock_find_dependencies.return_value = set()
+        self.handler.prime()
+
+        self.handler.clean(step='stage', incremental=True)
+
+        self.assertTrue(self.handler.is_clean('stage'))
+        self.assertTrue(os.listdir(self.stage_dir))
+        self.assertTrue(os.listdir(self.prime_dir))
+        self.assertIsNotNone(self.handler.get_previous_state('prime'))
+
+
 class PerStepCleanTestCase(tests.TestCase):
 
     def setUp(self):
@@ -2122,7 +2272,7 @@ class PerStepCleanTestCase(tests.TestCase):
             call.clean_prime({}, 'foo'),
             call.clean_stage({}, 'foo'),
             call.clean_build('foo'),
-            call.clean_pull('foo'),
+            call.clean_pull('foo', incremental=False),
         ])
 
     def test_clean_pull_order(self):
@@ -2134,7 +2284,7 @@ class PerStepCleanTestCase(tests.TestCase):
             call.clean_prime({}, ''),
             call.clean_stage({}, ''),
             call.clean_build(''),
-            call.clean_pull(''),
+            call.clean_pull('', incremental=False),
         ])
 
     def test_clean_build_order(self):
@@ -2148,6 +2298,14 @@ class PerStepCleanTestCase(tests.TestCase):
             call.clean_build(''),
         ])
 
+    def test_incremental_clean_build(self):
+        self.handler.clean(step='build', incremental=True)
+
+        self.assertEqual(1, len(self.manager_mock.mock_calls))
+        self.manager_mock.assert_has_calls([
+            call.clean_build('', incremental=True),
+        ])
+
     def test_clean_stage_order(self):
         self.handler.clean(step='stage')
 
@@ -2173,6 +2331,10 @@ class CollisionTestCase(tests.TestCase):
     def setUp(self):
         super().setUp()
 
+        patcher = patch.dict(pluginhandler._file_digests, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         tmpdirObject = tempfile.TemporaryDirectory()
         self.addCleanup(tmpdirObject.cleanup)
         tmpdir = tmpdirObject.name
@@ -2245,6 +2407,68 @@ class CollisionTestCase(tests.TestCase):
             "common which have different contents:\n    file.pc",
             raised.__str__())
 
+    def test_collisions_with_earliest_part_are_reported(self):
+        raised = self.assertRaises(
+            SnapcraftPartConflictError,
+            pluginhandler.check_for_collisions,
+            [self.part1, self.part4, self.part2])
+
+        self.assertIn(
+            "Parts 'part1' and 'part4' have the following file paths in "
+            "common which have different contents:\n    file.pc",
+            raised.__str__())
+
+    def test_collision_index_checks_parts_as_they_are_added(self):
+        index = pluginhandler.CollisionIndex()
+        index.add(self.part1)
+        index.add(self.part2)
+
+        raised = self.assertRaises(
+            SnapcraftPartConflictError, index.add, self.part3)
+
+        self.assertIn(
+            "Parts 'part2' and 'part3' have the following file paths in "
+            "common which have different contents:\n    1\n    a/2",
+            raised.__str__())
+
+    def test_collision_index_leaves_out_conflicting_parts(self):
+        index = pluginhandler.CollisionIndex()
+        index.add(self.part1)
+        self.assertRaises(
+            SnapcraftPartConflictError, index.add, self.part4)
+
+        # part2 would conflict with part4, which was not added.
+        index.add(self.part2)
+
+    @patch('snapcraft.file_utils.calculate_sha3_384')
+    def test_digests_are_cached(self, mock_digest):
+        mock_digest.side_effect = lambda path: 'digest'
+        part5 = mocks.loadplugin('part5')
+        part5.code.installdir = os.path.join(
+            os.path.dirname(self.part2.installdir), 'install5')
+        os.makedirs(part5.installdir)
+        with open(os.path.join(part5.installdir, '1'), 'w') as f:
+            f.write('1')
+
+        for _ in range(2):
+            pluginhandler.check_for_collisions([self.part2, part5])
+
+        # Each file is only read once.
+        self.assertEqual(2, mock_digest.call_count)
+
+    @patch('snapcraft.file_utils.calculate_sha3_384')
+    def test_hard_links_are_not_read(self, mock_digest):
+        part5 = mocks.loadplugin('part5')
+        part5.code.installdir = os.path.join(
+            os.path.dirname(self.part2.installdir), 'install5')
+        os.makedirs(part5.installdir)
+        os.link(os.path.join(self.part2.installdir, '1'),
+                os.path.join(part5.installdir, '1'))
+
+        pluginhandler.check_for_collisions([self.part2, part5])
+
+        self.assertFalse(mock_digest.called)
+
 
 class StagePackagesTestCase(tests.TestCase):
 
@@ -2272,155 +2496,191 @@ class StagePackagesTestCase(tests.TestCase):
 
 class FindDependenciesTestCase(tests.TestCase):
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_find_dependencies(self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
-
-        linked_elf_path = os.path.join(workdir, 'linked')
-        open(linked_elf_path, 'w').close()
+    def setUp(self):
+        super().setUp()
 
-        linked_elf_path_b = linked_elf_path.encode(sys.getfilesystemencoding())
+        self.workdir = os.path.join(self.path, 'workdir')
+        self.libdir = os.path.join(self.path, 'lib')
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'dynamically linked interpreter /lib64/ld-linux-x86-64.so.2, '
-            'for GNU/Linux 2.6.32, BuildID[sha1]=XYZ, stripped')
+        patcher = patch('snapcraft.internal.libraries._get_system_libs')
+        self.get_system_libs_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get_system_libs_mock.return_value = frozenset()
 
-        mock_dependencies.return_value = ['/usr/lib/libDepends.so']
+        patcher = patch('snapcraft.internal.common.run_env')
+        run_env_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        run_env_mock.return_value = {'LD_LIBRARY_PATH': self.libdir}
 
-        dependencies = pluginhandler._find_dependencies(workdir, {'linked'})
+        patcher = patch('snapcraft.internal.libraries.get_dependencies')
+        self.ldd_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ldd_mock.return_value = ['/usr/lib/libDepends.so']
 
-        mock_ms.file.assert_called_once_with(linked_elf_path_b)
-        self.assertEqual(dependencies, {'/usr/lib/libDepends.so'})
+    def test_find_dependencies(self):
+        write_elf(os.path.join(self.workdir, 'linked'),
+                  interpreter='/lib64/ld-linux-x86-64.so.2',
+                  needed=['libfoo.so.1'])
+        write_elf(os.path.join(self.libdir, 'libfoo.so.1'))
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_find_dependencies_skip_object_files(self, mock_dependencies,
-                                                 mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
-        open(os.path.join(workdir, 'object_file.o'), 'w').close()
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'linked'})
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'dynamically linked interpreter /lib64/ld-linux-x86-64.so.2, '
-            'for GNU/Linux 2.6.32, BuildID[sha1]=XYZ, stripped')
+        self.assertFalse(self.ldd_mock.called,
+                         'ldd is not needed for resolvable files')
+        self.assertEqual(dependencies,
+                         {os.path.join(self.libdir, 'libfoo.so.1')})
 
-        mock_dependencies.return_value = ['/usr/lib/libDepends.so']
+    def test_find_dependencies_falls_back_to_ldd(self):
+        linked_elf_path = os.path.join(self.workdir, 'linked')
+        write_elf(linked_elf_path, needed=['libmissing.so.1'])
 
         dependencies = pluginhandler._find_dependencies(
-            workdir, {'object_file.o'})
+            self.workdir, {'linked'})
 
-        self.assertFalse(mock_ms.file.called,
-                         'Expected object file to be skipped')
-        self.assertEqual(dependencies, set())
+        self.ldd_mock.assert_called_once_with(
+            linked_elf_path.encode(sys.getfilesystemencoding()))
+        self.assertEqual(dependencies, {'/usr/lib/libDepends.so'})
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_non_dynamically_linked(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+    def test_find_dependencies_of_many_files(self):
+        write_elf(os.path.join(self.libdir, 'libfoo.so.1'))
+        write_elf(os.path.join(self.libdir, 'libbar.so.1'))
+        write_elf(os.path.join(self.workdir, 'foo'), needed=['libfoo.so.1'])
+        write_elf(os.path.join(self.workdir, 'bar'), needed=['libbar.so.1'])
+        write_elf(os.path.join(self.workdir, 'baz'),
+                  needed=['libmissing.so.1'])
 
-        statically_linked_elf_path = os.path.join(workdir, 'statically-linked')
-        open(statically_linked_elf_path, 'w').close()
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'foo', 'bar', 'baz'})
 
-        statically_linked_elf_path_b = statically_linked_elf_path.encode(
-            sys.getfilesystemencoding())
+        self.assertEqual(dependencies, {
+            os.path.join(self.libdir, 'libfoo.so.1'),
+            os.path.join(self.libdir, 'libbar.so.1'),
+            '/usr/lib/libDepends.so'})
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = (
-            'ELF 64-bit LSB executable, x86-64, version 1 (SYSV), '
-            'statically linked, for GNU/Linux 2.6.32, '
-            'BuildID[sha1]=XYZ, stripped')
+    def test_find_dependencies_skip_object_files(self):
+        write_elf(os.path.join(self.workdir, 'object_file.o'),
+                  needed=['libmissing.so.1'])
 
         dependencies = pluginhandler._find_dependencies(
-            workdir, {'statically-linked'})
+            self.workdir, {'object_file.o'})
+
+        self.assertFalse(self.ldd_mock.called,
+                         'Expected object file to be skipped')
+        self.assertEqual(dependencies, set())
+
+    def test_no_find_dependencies_of_non_dynamically_linked(self):
+        write_elf(os.path.join(self.workdir, 'statically-linked'),
+                  dynamic=False)
 
-        mock_ms.file.assert_called_once_with(statically_linked_elf_path_b)
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'statically-linked'})
 
         self.assertFalse(
-            mock_dependencies.called,
+            self.ldd_mock.called,
             'statically linked files should not have library dependencies')
 
         self.assertFalse(dependencies)
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_non_elf_files(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+    def test_no_find_dependencies_of_non_elf_files(self):
+        os.makedirs(self.workdir)
+        with open(os.path.join(self.workdir, 'non-elf'), 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe1 JPEG image data')
 
-        non_elf_path = os.path.join(workdir, 'non-elf')
-        open(non_elf_path, 'w').close()
-
-        non_elf_path_b = non_elf_path.encode(sys.getfilesystemencoding())
-
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
-        mock_ms.file.return_value = 'JPEG image data, Exif standard: ...'
-
-        dependencies = pluginhandler._find_dependencies(workdir, {'non-elf'})
-
-        mock_ms.file.assert_called_once_with(non_elf_path_b)
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'non-elf'})
 
         self.assertFalse(
-            mock_dependencies.called,
+            self.ldd_mock.called,
             'non elf files should not have library dependencies')
 
         self.assertFalse(
             dependencies,
             'non elf files should not have library dependencies')
 
-    @patch('magic.open')
-    @patch('snapcraft.internal.libraries.get_dependencies')
-    def test_no_find_dependencies_of_symlinks(
-            self, mock_dependencies, mock_magic):
-        workdir = os.path.join(os.getcwd(), 'workdir')
-        os.makedirs(workdir)
+    def test_no_find_dependencies_of_unreadable_elf_files(self):
+        broken_path = os.path.join(self.workdir, 'broken')
+        write_elf(broken_path, needed=['libmissing.so.1'])
+        with open(broken_path, 'r+b') as f:
+            f.truncate(20)
 
-        symlinked_path = os.path.join(workdir, 'symlinked')
-        os.symlink('/bin/dash', symlinked_path)
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'broken'})
+
+        self.assertFalse(self.ldd_mock.called)
+        self.assertFalse(dependencies)
 
-        mock_ms = Mock()
-        mock_magic.return_value = mock_ms
-        mock_ms.load.return_value = 0
+    def test_no_find_dependencies_of_symlinks(self):
+        os.makedirs(self.workdir)
+        symlinked_path = os.path.join(self.workdir, 'symlinked')
+        os.symlink('/bin/dash', symlinked_path)
 
-        dependencies = pluginhandler._find_dependencies(workdir, {'symlinked'})
+        with patch('snapcraft.internal.elf.read') as read_mock:
+            dependencies = pluginhandler._find_dependencies(
+                self.workdir, {'symlinked'})
 
         self.assertFalse(
-            mock_ms.file.called, 'magic is not needed for symlinks')
+            read_mock.called, 'symlinks are not read')
 
         self.assertFalse(
-            mock_dependencies.called,
+            self.ldd_mock.called,
             'statically linked files should not have library dependencies')
 
         self.assertFalse(
             dependencies,
             'statically linked files should not have library dependencies')
 
-    @patch('magic.open')
-    def test_fail_to_load_magic_raises_exception(self, mock_magic):
-        mock_magic.return_value.load.return_value = 1
-
-        raised = self.assertRaises(
-            RuntimeError,
-            pluginhandler._find_dependencies, '.', set())
+    def test_find_dependencies_cached(self):
+        write_elf(os.path.join(self.workdir, 'linked'),
+                  needed=['libfoo.so.1'])
+        write_elf(os.path.join(self.workdir, 'unresolved'),
+                  needed=['libmissing.so.1'])
+        write_elf(os.path.join(self.libdir, 'libfoo.so.1'))
+        pluginhandler._find_dependencies(
+            self.workdir, {'linked', 'unresolved'})
+        self.ldd_mock.reset_mock()
+
+        with patch('snapcraft.internal.elf.read') as read_mock:
+            dependencies = pluginhandler._find_dependencies(
+                self.workdir, {'linked', 'unresolved'})
+
+        self.assertFalse(read_mock.called, 'cached files are not read')
+        self.assertFalse(self.ldd_mock.called)
+        self.assertEqual(dependencies, {
+            os.path.join(self.libdir, 'libfoo.so.1'),
+            '/usr/lib/libDepends.so'})
+
+    def test_find_dependencies_of_changed_files(self):
+        linked_path = os.path.join(self.workdir, 'linked')
+        write_elf(linked_path, needed=['libfoo.so.1'])
+        write_elf(os.path.join(self.libdir, 'libfoo.so.1'))
+        write_elf(os.path.join(self.libdir, 'libbar.so.1'))
+        pluginhandler._find_dependencies(self.workdir, {'linked'})
+
+        os.remove(linked_path)
+        write_elf(linked_path, needed=['libbar.so.1'])
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'linked'})
+
+        self.assertEqual(dependencies,
+                         {os.path.join(self.libdir, 'libbar.so.1')})
+
+    def test_find_dependencies_when_staged_libraries_change(self):
+        write_elf(os.path.join(self.workdir, 'linked'),
+                  needed=['libfoo.so.1'])
+        stagedir = os.path.join(self.path, 'stage')
+        os.makedirs(stagedir)
+        pluginhandler._find_dependencies(self.workdir, {'linked'}, stagedir)
+        self.assertTrue(self.ldd_mock.called)
+
+        # Staging a library in the library path changes what is found.
+        write_elf(os.path.join(stagedir, 'lib', 'libfoo.so.1'))
+        os.symlink(os.path.join(stagedir, 'lib'), self.libdir)
+        dependencies = pluginhandler._find_dependencies(
+            self.workdir, {'linked'}, stagedir)
 
-        self.assertEqual(
-            raised.__str__(), 'Cannot load magic header detection')
+        self.assertEqual(dependencies,
+                         {os.path.join(self.libdir, 'libfoo.so.1')})
 
     def test__combine_filesets_explicit_wildcard(self):
         fileset_1 = ['a', 'b']
@@ -2600,3 +2860,145 @@ class CleanBuildTestCase(tests.TestCase):
 
         # Make sure the install directory is gone
         self.assertFalse(os.path.exists(handler.code.installdir))
+
+
+class IncrementalBuildTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.handler = mocks.loadplugin(
+            'test-part', part_properties={'build-attributes': ['incremental']})
+        self.sourcedir = self.handler.sourcedir
+        self.build_basedir = self.handler.code.build_basedir
+        os.makedirs(os.path.join(self.sourcedir, 'src'))
+        for path in ('Makefile', 'src/1.c', 'src/2.c'):
+            with open(os.path.join(self.sourcedir, path), 'w') as f:
+                f.write(path)
+
+        self.handler.build()
+        # What a build tool leaves behind.
+        open(os.path.join(self.build_basedir, 'src', '1.o'), 'w').close()
+
+    def test_build_keeps_build_artifacts(self):
+        self.handler.build()
+
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '1.o')))
+        self.assertTrue(self.handler.get_state('build').assets['incremental'])
+
+    def test_build_brings_in_source_changes(self):
+        with open(os.path.join(self.sourcedir, 'src', '1.c'), 'w') as f:
+            f.write('changed')
+        open(os.path.join(self.sourcedir, 'src', '3.c'), 'w').close()
+
+        self.handler.build()
+
+        with open(os.path.join(self.build_basedir, 'src', '1.c')) as f:
+            self.assertEqual('changed', f.read())
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '3.c')))
+
+    def test_build_removes_files_removed_from_source(self):
+        os.remove(os.path.join(self.sourcedir, 'src', '2.c'))
+
+        self.handler.build()
+
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '2.c')))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '1.o')))
+
+    def test_first_build_copies_sourcedir(self):
+        self.assertFalse(self.handler.get_state('build').assets['incremental'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '1.c')))
+
+    def test_incremental_clean_keeps_build_tree(self):
+        open(os.path.join(self.handler.installdir, 'installed'), 'w').close()
+
+        self.handler.clean_build(incremental=True)
+
+        self.assertTrue(self.handler.is_clean('build'))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '1.o')))
+        self.assertFalse(os.path.exists(self.handler.installdir))
+
+    def test_clean_removes_build_tree(self):
+        self.handler.clean_build()
+
+        self.assertFalse(os.path.exists(self.build_basedir))
+
+        self.handler.build()
+
+        self.assertFalse(self.handler.get_state('build').assets['incremental'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_basedir, 'src', '1.o')))
+
+    def test_build_without_attribute_starts_over(self):
+        handler = mocks.loadplugin('other-part')
+        os.makedirs(handler.sourcedir)
+        handler.build()
+        open(os.path.join(handler.code.build_basedir, 'built'), 'w').close()
+
+        handler.clean_build(incremental=True)
+        handler.build()
+
+        self.assertFalse(os.path.exists(
+            os.path.join(handler.code.build_basedir, 'built')))
+
+
+class CompilerCacheTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.handler = mocks.loadplugin(
+            'test-part', part_properties={'build-attributes': ['ccache']})
+        self.bin_dir = os.path.join(self.path, 'bin')
+        os.makedirs(self.bin_dir)
+        for name in ('ccache', 'gcc'):
+            path = os.path.join(self.bin_dir, name)
+            open(path, 'w').close()
+            os.chmod(path, 0o755)
+
+        patcher = patch('snapcraft.internal.common.run_env',
+                        return_value={'PATH': self.bin_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ccache_is_a_build_package(self):
+        self.assertIn('ccache', self.handler.code.build_packages)
+
+    def test_env(self):
+        env = self.handler.compiler_cache_env()
+
+        self.assertIn('PATH="{}:$PATH"'.format(
+            os.path.join(self.handler.code.partdir, 'ccache')), env)
+
+    def test_env_without_attribute(self):
+        handler = mocks.loadplugin('other-part')
+
+        self.assertEqual(handler.compiler_cache_env(), [])
+        self.assertNotIn('ccache', handler.code.build_packages)
+
+    @patch.object(nil.NilPlugin, 'build')
+    def test_build_reports_stats(self, mock_build):
+        log_file = os.path.join(self.handler.code.partdir, 'ccache.log')
+
+        def build():
+            with open(log_file, 'a') as f:
+                f.write('Result: cache miss\nResult: cache hit (direct)\n'
+                        'Result: cache hit (preprocessed)\n')
+        mock_build.side_effect = build
+        fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(fake_logger)
+
+        self.handler.build()
+
+        self.assertIn("Compiler cache for 'test-part': 2 hits, 1 misses",
+                      fake_logger.output)
+        self.assertThat(
+            os.path.join(self.handler.code.partdir, 'ccache', 'gcc'),
+            tests.LinkExists(os.path.join(self.bin_dir, 'ccache')))
+        self.assertFalse(os.path.exists(log_file))
@@ -88,3 +88,20 @@ class StagePackageHandlerTestCase(tests.TestCase):
             ['foo'], mock.ANY, mock.ANY)
         self.get_mock.assert_not_called()
         self.unpack_mock.assert_called_with(self.unpack_dir)
+
+    @mock.patch('snapcraft.repo.get_packages')
+    def test_fetch_all(self, mock_get_packages):
+        handlers = [StagePackageHandler(['foo'], self.cache_dir),
+                    StagePackageHandler([], self.cache_dir),
+                    StagePackageHandler(['bar'], self.cache_dir)]
+        mock_get_packages.return_value = [['foo=1'], None]
+
+        StagePackageHandler.fetch_all(handlers)
+
+        mock_get_packages.assert_called_once_with(
+            [(mock.ANY, {'foo'}), (mock.ANY, {'bar'})])
+        self.assertEqual(handlers[0].fetch(), ['foo=1'])
+        self.get_mock.assert_not_called()
+        # Left out of the batch, so fetched on its own.
+        handlers[2].fetch()
+        self.get_mock.assert_called_once_with({'bar'})
@@ -19,6 +19,7 @@ import unittest.mock
 
 import snapcraft
 from snapcraft import tests
+from snapcraft.internal import jobserver
 
 
 class TestBasePlugin(tests.TestCase):
@@ -41,6 +42,21 @@ class TestBasePlugin(tests.TestCase):
             self.project_options, 'parallel_build_count', 2)
         self.assertEqual(plugin.parallel_build_count, 2)
 
+    @unittest.mock.patch('snapcraft.ProjectOptions.parallel_build_count',
+                         new_callable=unittest.mock.PropertyMock,
+                         return_value=4)
+    def test_parallel_build_args(self, mock_parallel_build_count):
+        plugin = snapcraft.BasePlugin('test_plugin', tests.MockOptions(),
+                                      self.project_options)
+        self.assertEqual(plugin.parallel_build_args, ['-j4'])
+
+        jobserver.start(4)
+        self.addCleanup(jobserver.stop)
+        self.assertEqual(plugin.parallel_build_args, [])
+
+        plugin.options.disable_parallel = True
+        self.assertEqual(plugin.parallel_build_args, ['-j1'])
+
     def test_part_name_with_forward_slash_is_one_directory(self):
         plugin = snapcraft.BasePlugin('test/part', options=None)
 
@@ -506,6 +506,26 @@ class CatkinPluginTestCase(CatkinPluginBaseTestCase):
 
         finish_build_mock.assert_called_once_with()
 
+    @mock.patch('snapcraft.plugins.catkin._Compilers')
+    @mock.patch.object(catkin.CatkinPlugin, 'run')
+    @mock.patch.object(catkin.CatkinPlugin, '_run_in_bash')
+    @mock.patch.object(catkin.CatkinPlugin, 'run_output', return_value='foo')
+    @mock.patch.object(catkin.CatkinPlugin, '_prepare_build')
+    @mock.patch.object(catkin.CatkinPlugin, '_finish_build')
+    def test_build_with_ccache(self, finish_build_mock, prepare_build_mock,
+                               run_output_mock, bashrun_mock, run_mock,
+                               compilers_mock):
+        self.properties.build_attributes = ['ccache']
+        plugin = catkin.CatkinPlugin('test-part', self.properties,
+                                     self.project_options)
+        os.makedirs(os.path.join(plugin.sourcedir, 'src'))
+
+        plugin.build()
+
+        args = bashrun_mock.call_args[0][0]
+        self.assertIn('-DCMAKE_C_COMPILER_LAUNCHER=ccache', args)
+        self.assertIn('-DCMAKE_CXX_COMPILER_LAUNCHER=ccache', args)
+
     @mock.patch('snapcraft.plugins.catkin._Compilers')
     @mock.patch.object(catkin.CatkinPlugin, 'run')
     @mock.patch.object(catkin.CatkinPlugin, 'run_output', return_value='foo')
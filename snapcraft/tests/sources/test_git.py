@@ -186,6 +186,58 @@ class TestGit(SourceTestCase):
             "can't specify a source-checksum for a git source")
         self.assertEqual(raised.message, expected_message)
 
+    def test_fingerprint_of_remote_source_is_unknown(self):
+        git = sources.Git('git://my-source', 'source_dir')
+
+        self.assertIsNone(git.get_fingerprint())
+
+    @mock.patch('os.path.isdir')
+    @mock.patch('subprocess.check_output')
+    def test_fingerprint_of_local_source_is_head(self, mock_output,
+                                                 mock_isdir):
+        mock_isdir.return_value = True
+        mock_output.return_value = 'abcdef\n'
+        git = sources.Git('my-source', 'source_dir')
+
+        self.assertEqual('abcdef', git.get_fingerprint())
+        mock_output.assert_called_once_with(
+            ['git', '-C', 'my-source', 'rev-parse', '--verify', 'HEAD'],
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    @mock.patch('os.path.isdir')
+    @mock.patch('subprocess.check_output')
+    def test_fingerprint_of_local_source_is_branch(self, mock_output,
+                                                   mock_isdir):
+        mock_isdir.return_value = True
+        mock_output.return_value = 'abcdef\n'
+        git = sources.Git('my-source', 'source_dir', source_branch='foo')
+
+        self.assertEqual('abcdef', git.get_fingerprint())
+        mock_output.assert_called_once_with(
+            ['git', '-C', 'my-source', 'rev-parse', '--verify',
+             'refs/heads/foo'],
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    @mock.patch('os.path.isdir')
+    @mock.patch('subprocess.check_output')
+    def test_fingerprint_of_local_source_is_tag(self, mock_output,
+                                                mock_isdir):
+        mock_isdir.return_value = True
+        mock_output.return_value = 'abcdef\n'
+        git = sources.Git('my-source', 'source_dir', source_tag='v1')
+
+        git.get_fingerprint()
+        mock_output.assert_called_once_with(
+            ['git', '-C', 'my-source', 'rev-parse', '--verify',
+             'refs/tags/v1'],
+            stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    def test_fingerprint_of_local_directory_not_a_repository(self):
+        os.mkdir('not-a-repository')
+        git = sources.Git('not-a-repository', 'source_dir')
+
+        self.assertIsNone(git.get_fingerprint())
+
 
 class TestGitConflicts(tests.TestCase):
     """Test that git pull errors don't kill the parser"""
@@ -166,6 +166,62 @@ class TestLocal(tests.TestCase):
             os.path.join('destination', 'dir', 'file_symlink'),
             tests.LinkExists('file'))
 
+    def test_pulling_again_only_syncs_changes(self):
+        os.makedirs(os.path.join('src', 'dir'))
+        open(os.path.join('src', 'dir', 'file'), 'w').close()
+        open(os.path.join('src', 'removed'), 'w').close()
+
+        local = sources.Local('src', 'destination')
+        local.pull()
+        inode = os.stat(os.path.join('destination', 'dir')).st_ino
+
+        os.remove(os.path.join('src', 'removed'))
+        open(os.path.join('src', 'added'), 'w').close()
+        with mock.patch('snapcraft.internal.tracing.count') as count_mock:
+            local.pull()
+
+        count_mock.assert_called_once_with('changed', 2)
+        self.assertEqual(
+            inode, os.stat(os.path.join('destination', 'dir')).st_ino)
+        self.assertFalse(os.path.exists(os.path.join('destination',
+                                                     'removed')))
+        self.assertGreater(
+            os.stat(os.path.join('destination', 'added')).st_nlink, 1)
+
+    def test_pulling_again_removes_snapcraft_specific_data(self):
+        os.makedirs(os.path.join('src', 'dir'))
+        os.makedirs(os.path.join('destination', 'parts'))
+        open(os.path.join('destination', 'foo.snap'), 'w').close()
+        open(os.path.join('src', 'foo.snap'), 'w').close()
+
+        sources.Local('src', 'destination').pull()
+
+        self.assertEqual(os.listdir('destination'), ['dir'])
+
+    def test_fingerprint_changes_with_source(self):
+        os.makedirs(os.path.join('src', 'dir'))
+        with open(os.path.join('src', 'dir', 'file'), 'w') as f:
+            f.write('1')
+
+        local = sources.Local('src', 'destination')
+        fingerprint = local.get_fingerprint()
+        self.assertEqual(fingerprint, local.get_fingerprint())
+
+        with open(os.path.join('src', 'dir', 'file'), 'w') as f:
+            f.write('22')
+        self.assertNotEqual(fingerprint, local.get_fingerprint())
+
+    def test_fingerprint_ignores_snapcraft_specific_data(self):
+        os.makedirs(os.path.join('src', 'dir'))
+        open(os.path.join('src', 'dir', 'file'), 'w').close()
+
+        local = sources.Local('src', 'destination')
+        fingerprint = local.get_fingerprint()
+
+        os.makedirs(os.path.join('src', 'parts'))
+        open(os.path.join('src', 'foo.snap'), 'w').close()
+        self.assertEqual(fingerprint, local.get_fingerprint())
+
 
 class TestLocalIgnores(tests.TestCase):
     """Verify that the snapcraft root dir does not get copied into itself."""
@@ -0,0 +1,98 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark looking big states up through the state store.
+
+Not part of the unit tests, run it with:
+    ./runtests.sh unit bench_store.py
+or print the timings with:
+    python3 -m snapcraft.tests.states.bench_store
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+import snapcraft.internal
+
+_PATH_COUNT = 100000
+
+
+def _paths():
+    # Shaped like the install directory of a part with many packages.
+    paths = set()
+    for index in range(_PATH_COUNT):
+        paths.add(os.path.join(
+            'usr', 'lib', 'python3', 'dist-packages',
+            'package{}'.format(index // 500),
+            'module{}'.format(index // 25),
+            'file{}.py'.format(index)))
+
+    return paths
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+
+    return result, time.perf_counter() - start
+
+
+def run():
+    """Write a prime state of many paths, then look it up twice.
+
+    The first lookup loads the state file and stores the state, the second
+    one takes it from the store.
+
+    :returns: A (dump, file, store) tuple of seconds.
+    """
+
+    files = _paths()
+    directories = {os.path.dirname(f) for f in files}
+    state = snapcraft.internal.states.PrimeState(
+        files, directories, {'usr/lib'})
+
+    with tempfile.TemporaryDirectory() as directory:
+        state_file = os.path.join(directory, 'prime')
+        dumped, dump = _timed(snapcraft.internal.states.dump, state)
+        with open(state_file, 'w') as f:
+            f.write(dumped)
+
+        store = snapcraft.internal.states.StateStore(
+            os.path.join(directory, 'state.db'))
+        from_file, load = _timed(store.get, 'part', 'prime', state_file)
+        from_store, lookup = _timed(store.get, 'part', 'prime', state_file)
+
+    if not from_file == from_store == state:
+        raise AssertionError('The state did not survive the round-trip')
+
+    return dump, load, lookup
+
+
+class StateStoreBenchmark(unittest.TestCase):
+
+    def test_store_is_faster_than_state_files(self):
+        _, load, lookup = run()
+
+        self.assertGreater(load / lookup, 20)
+
+
+if __name__ == '__main__':
+    dump, load, lookup = run()
+    print('{} paths: state file written in {:.3f}s and loaded in {:.3f}s, '
+          'state taken from the store in {:.3f}s ({:.0f}x faster)'.format(
+              _PATH_COUNT, dump, load, lookup, load / lookup))
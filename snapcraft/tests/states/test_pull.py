@@ -48,6 +48,16 @@ class PullStateTestCase(PullStateBaseTestCase):
 
         self.assertTrue(self.state == other, 'Expected states to be identical')
 
+    def test_source_fingerprint(self):
+        state = snapcraft.internal.states.PullState(
+            self.property_names, self.part_properties, self.project,
+            source_fingerprint='test-fingerprint')
+
+        state_from_yaml = yaml.load(yaml.dump(state))
+        self.assertEqual(
+            'test-fingerprint', state_from_yaml.assets['source-fingerprint'])
+        self.assertFalse(self.state == state, 'Expected states to differ')
+
     def test_properties_of_interest(self):
         self.part_properties.update({
             'plugin': 'test-plugin',
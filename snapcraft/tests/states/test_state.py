@@ -14,6 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
+
+import yaml
+
+import snapcraft.internal
 from snapcraft.internal.states._state import State
 from snapcraft import tests
 
@@ -66,3 +71,21 @@ class StateTestCase(tests.TestCase):
         differing_properties = self.state.diff_project_options_of_interest(
             _TestProject(self.new))
         self.assertEqual(differing_properties, {'foo'})
+
+
+class StateDumpTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.state = snapcraft.internal.states.PrimeState(
+            {'bin/foo', 'lib/libfoo.so'}, {'bin', 'lib'}, {'lib'})
+
+    def test_file_sets_are_dumped_as_yaml_sets(self):
+        dumped = snapcraft.internal.states.dump(self.state)
+
+        self.assertIn('files: !!set', dumped)
+        self.assertEqual(self.state, yaml.load(dumped))
+
+    def test_pickle_round_trip(self):
+        self.assertEqual(self.state, pickle.loads(pickle.dumps(self.state)))
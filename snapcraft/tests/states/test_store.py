@@ -0,0 +1,139 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import threading
+from unittest import mock
+
+import yaml
+
+import snapcraft.internal
+from snapcraft import tests
+
+
+class StateStoreTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.store = snapcraft.internal.states.StateStore(
+            os.path.join('parts', 'state.db'))
+        self.state = snapcraft.internal.states.StageState(
+            {'file1', 'file2'}, {'dir'}, {'foo': 'bar'})
+        self.state_file = os.path.join('parts', 'part1', 'state', 'stage')
+        os.makedirs(os.path.dirname(self.state_file))
+        self.write_state(self.state)
+
+    def write_state(self, state):
+        with open(self.state_file, 'w') as f:
+            f.write(yaml.dump(state))
+
+    def test_get_missing_state(self):
+        os.remove(self.state_file)
+
+        self.assertIsNone(self.store.get('part1', 'stage', self.state_file))
+        self.assertFalse(os.path.exists(self.store.path))
+
+    def test_get_loads_state_file_once(self):
+        with mock.patch('yaml.load', wraps=yaml.load) as mock_load:
+            for _ in range(3):
+                self.assertEqual(
+                    self.state,
+                    self.store.get('part1', 'stage', self.state_file))
+
+        self.assertEqual(1, mock_load.call_count)
+        self.assertTrue(os.path.exists(self.store.path))
+
+    def test_get_reloads_changed_state_file(self):
+        self.store.get('part1', 'stage', self.state_file)
+
+        state = snapcraft.internal.states.StageState(
+            {'file1', 'file2', 'file3'}, {'dir'}, {'foo': 'bar'})
+        self.write_state(state)
+
+        self.assertEqual(
+            state, self.store.get('part1', 'stage', self.state_file))
+
+    def test_get_is_shared_by_stores(self):
+        self.store.get('part1', 'stage', self.state_file)
+
+        store = snapcraft.internal.states.StateStore(self.store.path)
+        with mock.patch('yaml.load') as mock_load:
+            self.assertEqual(
+                self.state, store.get('part1', 'stage', self.state_file))
+        mock_load.assert_not_called()
+
+    def test_remove(self):
+        self.store.get('part1', 'stage', self.state_file)
+
+        self.store.remove('part1', 'stage')
+
+        with mock.patch('yaml.load', wraps=yaml.load) as mock_load:
+            self.store.get('part1', 'stage', self.state_file)
+        self.assertEqual(1, mock_load.call_count)
+
+    def test_get_with_corrupted_database(self):
+        os.makedirs('parts', exist_ok=True)
+        with open(self.store.path, 'w') as f:
+            f.write('not a database')
+
+        self.assertEqual(
+            self.state, self.store.get('part1', 'stage', self.state_file))
+
+    def test_get_with_unreadable_stored_state(self):
+        self.store.get('part1', 'stage', self.state_file)
+        connection = sqlite3.connect(self.store.path)
+        with connection:
+            connection.execute("UPDATE states SET state = x'80049500'")
+        connection.close()
+
+        with mock.patch('yaml.load', wraps=yaml.load) as mock_load:
+            for _ in range(2):
+                self.assertEqual(
+                    self.state,
+                    self.store.get('part1', 'stage', self.state_file))
+
+        # The state is stored again once loaded from its file.
+        self.assertEqual(1, mock_load.call_count)
+
+    def test_connection_is_kept_open(self):
+        with mock.patch('sqlite3.connect',
+                        wraps=sqlite3.connect) as mock_connect:
+            for step in ('pull', 'build', 'stage'):
+                self.store.get('part1', 'stage', self.state_file)
+                self.store.remove('part1', step)
+
+        self.assertEqual(1, mock_connect.call_count)
+
+    def test_connection_per_thread(self):
+        self.store.get('part1', 'stage', self.state_file)
+
+        states = []
+        thread = threading.Thread(target=lambda: states.append(
+            self.store.get('part1', 'stage', self.state_file)))
+        thread.start()
+        thread.join()
+
+        self.assertEqual([self.state], states)
+
+    def test_get_after_database_is_removed(self):
+        self.store.get('part1', 'stage', self.state_file)
+        os.remove(self.store.path)
+
+        self.assertEqual(
+            self.state, self.store.get('part1', 'stage', self.state_file))
+        self.assertTrue(os.path.exists(self.store.path))
@@ -15,6 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import subprocess
+from unittest import mock
+
+import fixtures
 
 from snapcraft.internal import common
 from snapcraft import tests
@@ -47,6 +51,73 @@ class CommonTestCase(tests.TestCase):
         self.assertFalse(common.isurl('/foo'))
         self.assertFalse(common.isurl('/fo:o'))
 
+    def test_resolve_env(self):
+        self.useFixture(fixtures.EnvironmentVariable('PATH', '/bin'))
+        self.useFixture(fixtures.EnvironmentVariable('FOO', 'foo'))
+
+        env = common.resolve_env(['PATH="/usr/bin:$PATH"',
+                                  'BAR="bar $FOO"'])
+
+        self.assertEqual('/usr/bin:/bin', env['PATH'])
+        self.assertEqual('bar foo', env['BAR'])
+        self.assertEqual('foo', env['FOO'])
+
+
+class RunTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.useFixture(fixtures.EnvironmentVariable('FOO', 'foo'))
+        common.set_env(['BAR="bar $FOO"'])
+        self.addCleanup(common.reset_env)
+        common._resolve_env_cached.cache_clear()
+
+    def test_run_output_with_env(self):
+        self.assertEqual(
+            'bar foo', common.run_output(['sh', '-c', 'echo $BAR']))
+
+    def test_run_output_with_env_on_top_of_given_env(self):
+        env = dict(os.environ, FOO='baz')
+
+        self.assertEqual(
+            'bar baz', common.run_output(['sh', '-c', 'echo $BAR'], env=env))
+
+    def test_run_output_env_change(self):
+        common.run_output(['true'])
+        common.set_env(['BAR=changed'])
+
+        self.assertEqual(
+            'changed', common.run_output(['sh', '-c', 'echo $BAR']))
+
+    def test_run_with_env(self):
+        common.run(['sh', '-c', 'echo $BAR > output'])
+
+        with open('output') as f:
+            self.assertEqual('bar foo\n', f.read())
+
+    def test_run_missing_command(self):
+        raised = self.assertRaises(
+            subprocess.CalledProcessError, common.run, ['not-a-command'])
+
+        self.assertEqual(127, raised.returncode)
+
+    def test_run_output_missing_command(self):
+        raised = self.assertRaises(
+            subprocess.CalledProcessError, common.run_output,
+            ['not-a-command'])
+
+        self.assertEqual(127, raised.returncode)
+
+    @mock.patch('snapcraft.internal.common.resolve_env')
+    def test_env_resolved_once(self, mock_resolve_env):
+        mock_resolve_env.return_value = dict(os.environ)
+        common.set_env(['ONCE=1'])
+
+        for _ in range(3):
+            common.run_output(['true'])
+
+        self.assertEqual(1, mock_resolve_env.call_count)
+
 
 class CommonMigratedTestCase(tests.TestCase):
 
@@ -0,0 +1,146 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import stat
+import subprocess
+import unittest
+from unittest import mock
+
+from snapcraft.internal import deb
+from snapcraft import tests
+from snapcraft.tests.fake_debs import make_deb
+
+_MEMBERS = [
+    ('usr', 'dir', 0o755, None),
+    ('usr/bin', 'dir', 0o755, None),
+    ('usr/bin/hello', 'file', 0o755, b'#!/bin/sh\necho hello\n'),
+    ('usr/bin/hi', 'hardlink', 0o755, 'usr/bin/hello'),
+    ('usr/bin/su', 'file', 0o4755, b'binary'),
+    ('usr/share', 'dir', 0o755, None),
+    ('usr/share/doc', 'dir', 0o2775, None),
+    ('usr/share/doc/readme', 'file', 0o444, b'readme\n'),
+    ('usr/share/doc/relative', 'symlink', 0o777, 'readme'),
+    ('usr/share/doc/absolute', 'symlink', 0o777, '/usr/bin/hello'),
+    ('usr/share/read-only', 'dir', 0o555, None),
+    ('usr/share/read-only/file', 'file', 0o644, b''),
+]
+
+
+def _snapshot(root):
+    tree = {}
+    for directory, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(directory, name)
+            st = os.lstat(path)
+            if os.path.islink(path):
+                contents = os.readlink(path)
+            elif os.path.isdir(path):
+                contents = None
+            else:
+                with open(path, 'rb') as f:
+                    contents = f.read()
+            # Directory times change as they are filled.
+            mtime = None if stat.S_ISDIR(st.st_mode) else st.st_mtime
+            nlink = st.st_nlink if stat.S_ISREG(st.st_mode) else None
+            tree[os.path.relpath(path, root)] = (
+                st.st_mode, contents, mtime, nlink)
+    return tree
+
+
+class ExtractTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Read-only directories have to be writable to be cleaned up.
+        self.addCleanup(subprocess.call, ['chmod', '-R', 'u+w', self.path])
+
+    def test_extract(self):
+        make_deb('fake.deb', _MEMBERS)
+
+        members = deb.extract('fake.deb', 'unpacked')
+
+        self.assertEqual(members, [m[0] for m in _MEMBERS])
+        with open(os.path.join('unpacked', 'usr', 'bin', 'hello')) as f:
+            self.assertEqual(f.read(), '#!/bin/sh\necho hello\n')
+        self.assertEqual(
+            os.stat(os.path.join('unpacked', 'usr', 'bin', 'su')).st_mode &
+            0o7777, 0o4755)
+        self.assertEqual(
+            os.readlink(os.path.join('unpacked', 'usr', 'share', 'doc',
+                                     'absolute')), '/usr/bin/hello')
+        self.assertTrue(os.path.samefile(
+            os.path.join('unpacked', 'usr', 'bin', 'hello'),
+            os.path.join('unpacked', 'usr', 'bin', 'hi')))
+
+    @unittest.skipUnless(shutil.which('dpkg-deb'), 'dpkg-deb is needed')
+    def test_extract_matches_dpkg_deb(self):
+        for compression in ('gz', 'xz', 'bz2', ''):
+            deb_file = 'fake-{}.deb'.format(compression)
+            make_deb(deb_file, _MEMBERS, compression=compression)
+            expected = 'expected-{}'.format(compression)
+            subprocess.check_call(
+                ['dpkg-deb', '--extract', deb_file, expected])
+            extracted = 'extracted-{}'.format(compression)
+
+            deb.extract(deb_file, extracted)
+
+            self.assertEqual(_snapshot(expected), _snapshot(extracted))
+
+    def test_extract_replaces_what_is_in_the_way(self):
+        os.makedirs(os.path.join('unpacked', 'usr', 'bin', 'hello'))
+        os.makedirs(os.path.join('unpacked', 'usr', 'share', 'doc'))
+        os.symlink('elsewhere', os.path.join('unpacked', 'usr', 'share',
+                                             'doc', 'readme'))
+        make_deb('fake.deb', _MEMBERS)
+
+        deb.extract('fake.deb', 'unpacked')
+
+        self.assertTrue(os.path.isfile(
+            os.path.join('unpacked', 'usr', 'bin', 'hello')))
+        self.assertFalse(os.path.islink(
+            os.path.join('unpacked', 'usr', 'share', 'doc', 'readme')))
+
+    def test_unsafe_path(self):
+        make_deb('fake.deb', [('../escape', 'file', 0o644, b'')])
+
+        raised = self.assertRaises(
+            deb.DebError, deb.extract, 'fake.deb', 'unpacked')
+
+        self.assertIn("unsafe path '../escape'", raised.message)
+        self.assertFalse(os.path.exists('escape'))
+
+    def test_not_a_deb(self):
+        with open('fake.deb', 'w') as f:
+            f.write('not a deb')
+
+        raised = self.assertRaises(
+            deb.DebError, deb.extract, 'fake.deb', 'unpacked')
+
+        self.assertEqual(raised.message,
+                         "Cannot extract 'fake.deb': not an ar archive")
+
+    @mock.patch('snapcraft.internal.deb.zstandard', new=None)
+    def test_zstd_needs_zstandard(self):
+        make_deb('fake.deb', [])
+        with open('fake.deb', 'rb') as f:
+            contents = f.read()
+        with open('fake.deb', 'wb') as f:
+            f.write(contents.replace(b'data.tar.gz ', b'data.tar.zst'))
+
+        self.assertRaises(
+            deb.UnsupportedDebError, deb.extract, 'fake.deb', 'unpacked')
@@ -0,0 +1,115 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from snapcraft.internal import elf
+from snapcraft import tests
+from snapcraft.tests.fake_elf import write_elf
+
+
+class ReadTestCase(tests.TestCase):
+
+    scenarios = [
+        ('64-bit little endian', dict(elf_class=2, big_endian=False)),
+        ('64-bit big endian', dict(elf_class=2, big_endian=True)),
+        ('32-bit little endian', dict(elf_class=1, big_endian=False)),
+        ('32-bit big endian', dict(elf_class=1, big_endian=True)),
+    ]
+
+    def test_read_executable(self):
+        write_elf('hello', elf_class=self.elf_class,
+                  big_endian=self.big_endian, machine=183,
+                  interpreter='/lib/ld-linux-aarch64.so.1',
+                  needed=['libfoo.so.1', 'libc.so.6'],
+                  rpath='$ORIGIN/../lib:/opt/lib', flags_1=elf.DF_1_NODEFLIB)
+
+        elf_file = elf.read('hello')
+
+        stat = os.stat('hello')
+        self.assertEqual(elf_file.path, 'hello')
+        self.assertEqual(elf_file.file_id, (stat.st_dev, stat.st_ino))
+        self.assertEqual(elf_file.elf_class, self.elf_class)
+        self.assertEqual(elf_file.machine, 183)
+        self.assertTrue(elf_file.dynamic)
+        self.assertEqual(elf_file.interpreter, '/lib/ld-linux-aarch64.so.1')
+        self.assertEqual(elf_file.needed, ['libfoo.so.1', 'libc.so.6'])
+        self.assertEqual(elf_file.rpath, ['$ORIGIN/../lib', '/opt/lib'])
+        self.assertIsNone(elf_file.runpath)
+        self.assertIsNone(elf_file.soname)
+        self.assertEqual(elf_file.flags_1, elf.DF_1_NODEFLIB)
+
+    def test_read_library(self):
+        write_elf('libfoo.so.1', elf_class=self.elf_class,
+                  big_endian=self.big_endian, soname='libfoo.so.1',
+                  runpath='/usr/lib/foo;/usr/lib/bar')
+
+        elf_file = elf.read('libfoo.so.1')
+
+        self.assertTrue(elf_file.dynamic)
+        self.assertIsNone(elf_file.interpreter)
+        self.assertEqual(elf_file.soname, 'libfoo.so.1')
+        self.assertEqual(elf_file.needed, [])
+        self.assertEqual(elf_file.runpath, ['/usr/lib/foo', '/usr/lib/bar'])
+
+    def test_read_statically_linked(self):
+        write_elf('static', elf_class=self.elf_class,
+                  big_endian=self.big_endian, dynamic=False)
+
+        elf_file = elf.read('static')
+
+        self.assertFalse(elf_file.dynamic)
+        self.assertEqual(elf_file.needed, [])
+
+
+class ReadErrorsTestCase(tests.TestCase):
+
+    def test_non_elf_file(self):
+        with open('script', 'w') as f:
+            f.write('#!/bin/sh\n')
+
+        self.assertIsNone(elf.read('script'))
+
+    def test_empty_file(self):
+        open('empty', 'w').close()
+
+        self.assertIsNone(elf.read('empty'))
+
+    def test_truncated_file(self):
+        write_elf('truncated', needed=['libc.so.6'])
+        with open('truncated', 'r+b') as f:
+            f.truncate(40)
+
+        raised = self.assertRaises(elf.ElfError, elf.read, 'truncated')
+
+        self.assertEqual(raised.path, 'truncated')
+
+    def test_missing_file(self):
+        raised = self.assertRaises(elf.ElfError, elf.read, 'missing')
+
+        self.assertIsInstance(raised.__cause__, FileNotFoundError)
+
+    def test_compatible(self):
+        write_elf('amd64', machine=62)
+        write_elf('other-amd64', machine=62)
+        write_elf('x32', elf_class=1, machine=62)
+        write_elf('arm64', machine=183)
+
+        amd64 = elf.read('amd64')
+
+        self.assertTrue(amd64.is_compatible(elf.read('other-amd64')))
+        self.assertFalse(amd64.is_compatible(elf.read('x32')))
+        self.assertFalse(amd64.is_compatible(elf.read('arm64')))
@@ -0,0 +1,90 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+from unittest import mock
+
+from snapcraft.internal import fetcher
+from snapcraft import tests
+
+# What the fake file server serves.
+_SERVED = b'Test fake compressed file'
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class FetcherTestCase(tests.FakeFileHTTPServerBasedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fetcher = fetcher.Fetcher(jobs=2)
+        self.addCleanup(self.fetcher.close)
+        self.base_uri = 'http://{}:{}'.format(*self.server.server_address)
+
+    def _download(self, name, sha256=_sha256(_SERVED)):
+        return fetcher.Download(
+            uri='{}/{}'.format(self.base_uri, name), destination=name,
+            size=len(_SERVED), sha256=sha256)
+
+    def test_fetch(self):
+        self.fetcher.fetch([self._download('a.deb'), self._download('b.deb'),
+                            self._download('c.deb')])
+
+        for name in ('a.deb', 'b.deb', 'c.deb'):
+            with open(name, 'rb') as f:
+                self.assertEqual(f.read(), _SERVED)
+
+    def test_fetch_file_uri(self):
+        with open('source.deb', 'wb') as f:
+            f.write(b'local')
+
+        self.fetcher.fetch([fetcher.Download(
+            uri='file://{}'.format(os.path.abspath('source.deb')),
+            destination='a.deb', size=5, sha256=_sha256(b'local'))])
+
+        with open('a.deb', 'rb') as f:
+            self.assertEqual(f.read(), b'local')
+
+    def test_checksum_mismatch(self):
+        raised = self.assertRaises(
+            fetcher.FetchError, self.fetcher.fetch,
+            [self._download('a.deb', sha256=_sha256(b'other'))])
+
+        self.assertIn('expected SHA256', raised.message)
+        self.assertFalse(os.path.exists('a.deb'))
+        self.assertFalse(os.path.exists('a.deb.partial'))
+
+    def test_unreachable(self):
+        raised = self.assertRaises(
+            fetcher.FetchError, self.fetcher.fetch,
+            [fetcher.Download(uri='file:///missing.deb', destination='a.deb',
+                              size=1, sha256=_sha256(b''))])
+
+        self.assertEqual(raised.uri, 'file:///missing.deb')
+
+    @mock.patch('snapcraft.internal.fetcher.Fetcher._fetch')
+    def test_files_in_place_are_kept(self, mock_fetch):
+        with open('a.deb', 'wb') as f:
+            f.write(_SERVED)
+        with open('b.deb', 'wb') as f:
+            f.write(b'stale')
+
+        self.fetcher.fetch([self._download('a.deb'), self._download('b.deb')])
+
+        mock_fetch.assert_called_once_with(self._download('b.deb'))
@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import os
 import re
+import shutil
 import subprocess
 from unittest import mock
 
@@ -165,6 +167,213 @@ class TestLinkOrCopy(tests.TestCase):
         file_utils.link_or_copy('foo/bar/baz/4', 'foo2/bar/baz/4')
         self.assertTrue(os.path.isfile('foo2/bar/baz/4'))
 
+    def test_copy_into_directory(self):
+        os.mkdir('qux')
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV,
+                                                       'cross-device')):
+            file_utils.link_or_copy('1', 'qux')
+
+        self.assertTrue(os.path.isfile(os.path.join('qux', '1')))
+
+
+class CopyStrategyTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        with open('source', 'w') as source_file:
+            source_file.write('data')
+        os.chmod('source', 0o750)
+
+        # Make hard links fail as they would across devices.
+        patcher = mock.patch('os.link',
+                             side_effect=OSError(errno.EXDEV, 'cross-device'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for state in (file_utils._copy_strategies, file_utils._copy_stats):
+            patcher = mock.patch.dict(state, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @mock.patch('fcntl.ioctl')
+    def test_reflink(self, mock_ioctl):
+        file_utils.link_or_copy('source', 'destination')
+
+        self.assertEqual(1, mock_ioctl.call_count)
+        self.assertEqual(file_utils._FICLONE, mock_ioctl.call_args[0][1])
+        self.assertEqual({'reflink': 1}, file_utils.get_copy_stats())
+        self.assertEqual(0o750, os.stat('destination').st_mode & 0o777)
+
+    @mock.patch('fcntl.ioctl',
+                side_effect=OSError(errno.EOPNOTSUPP, 'not supported'))
+    def test_fallback_is_cached(self, mock_ioctl):
+        file_utils.link_or_copy('source', 'destination1')
+        file_utils.link_or_copy('source', 'destination2')
+
+        # Once reflinks failed they are not tried again for these devices.
+        self.assertEqual(1, mock_ioctl.call_count)
+        stats = file_utils.get_copy_stats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual(2, sum(stats.values()))
+        self.assertNotIn('reflink', stats)
+        for destination in ('destination1', 'destination2'):
+            with open(destination) as destination_file:
+                self.assertEqual('data', destination_file.read())
+
+    @mock.patch('fcntl.ioctl',
+                side_effect=OSError(errno.EOPNOTSUPP, 'not supported'))
+    def test_userspace_copy_fallback(self, mock_ioctl):
+        strategies = [strategy for strategy in file_utils._COPY_STRATEGIES
+                      if strategy[0] in ('reflink', 'copy')]
+        with mock.patch.object(file_utils, '_COPY_STRATEGIES', strategies):
+            file_utils.link_or_copy('source', 'destination')
+
+        self.assertEqual({'copy': 1}, file_utils.get_copy_stats())
+        with open('destination') as destination_file:
+            self.assertEqual('data', destination_file.read())
+
+    def test_same_file_is_not_truncated(self):
+        os.symlink('source', 'link')
+
+        self.assertRaises(shutil.SameFileError, file_utils.link_or_copy,
+                          'source', 'link')
+        with open('source') as source_file:
+            self.assertEqual('data', source_file.read())
+
+    def test_symlink_is_copied_as_symlink(self):
+        os.symlink('source', 'link')
+
+        file_utils.link_or_copy('link', 'destination')
+
+        self.assertEqual('source', os.readlink('destination'))
+
+
+class CloneOrCopyTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        with open('source', 'w') as source_file:
+            source_file.write('data')
+        os.chmod('source', 0o750)
+
+    def test_clone_or_copy_is_never_a_link(self):
+        file_utils.clone_or_copy('source', 'destination')
+
+        self.assertFalse(os.path.samefile('source', 'destination'))
+        with open('destination', 'r+') as destination_file:
+            self.assertEqual('data', destination_file.read())
+            destination_file.write(' changed')
+        with open('source') as source_file:
+            self.assertEqual('data', source_file.read())
+        self.assertEqual(0o750, os.stat('destination').st_mode & 0o777)
+
+    def test_clone_or_copy_into_directory(self):
+        os.mkdir('directory')
+
+        file_utils.clone_or_copy('source', 'directory')
+
+        self.assertTrue(os.path.isfile(os.path.join('directory', 'source')))
+
+
+class SyncTreeTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs(os.path.join('src', 'dir'))
+        with open(os.path.join('src', 'dir', 'file'), 'w') as f:
+            f.write('file')
+        with open(os.path.join('src', 'other'), 'w') as f:
+            f.write('other')
+        os.symlink('dir', os.path.join('src', 'link'))
+
+    def test_sync_new_tree(self):
+        self.assertEqual(file_utils.sync_tree('src', 'dst'), 5)
+
+        self.assertTrue(os.path.isdir(os.path.join('dst', 'dir')))
+        self.assertTrue(os.path.samefile(os.path.join('src', 'dir', 'file'),
+                                         os.path.join('dst', 'dir', 'file')))
+        self.assertThat(os.path.join('dst', 'link'), tests.LinkExists('dir'))
+
+    def test_sync_unchanged_tree(self):
+        file_utils.sync_tree('src', 'dst')
+
+        with mock.patch('snapcraft.file_utils.link_or_copy') as copy_mock:
+            self.assertEqual(file_utils.sync_tree(
+                'src', 'dst', copy_function=copy_mock), 0)
+        self.assertFalse(copy_mock.called)
+
+    def test_sync_copied_files_compare_metadata(self):
+        file_utils.sync_tree('src', 'dst', copy_function=shutil.copy2)
+        self.assertEqual(file_utils.sync_tree(
+            'src', 'dst', copy_function=shutil.copy2), 0)
+
+        os.chmod(os.path.join('src', 'other'), 0o755)
+
+        self.assertEqual(file_utils.sync_tree(
+            'src', 'dst', copy_function=shutil.copy2), 1)
+        self.assertEqual(
+            os.stat(os.path.join('dst', 'other')).st_mode & 0o777, 0o755)
+
+    def test_sync_changes(self):
+        file_utils.sync_tree('src', 'dst')
+        open(os.path.join('dst', 'stale'), 'w').close()
+        os.remove(os.path.join('src', 'other'))
+        os.makedirs(os.path.join('src', 'other'))
+        os.remove(os.path.join('src', 'link'))
+        os.symlink('other', os.path.join('src', 'link'))
+        # Replacing a file gives it a new inode.
+        os.remove(os.path.join('src', 'dir', 'file'))
+        with open(os.path.join('src', 'dir', 'file'), 'w') as f:
+            f.write('new')
+
+        # The stale file, the directory replacing a file, the new link and
+        # the new file.
+        self.assertEqual(file_utils.sync_tree('src', 'dst'), 4)
+
+        self.assertFalse(os.path.exists(os.path.join('dst', 'stale')))
+        self.assertTrue(os.path.isdir(os.path.join('dst', 'other')))
+        self.assertThat(os.path.join('dst', 'link'),
+                        tests.LinkExists('other'))
+        with open(os.path.join('dst', 'dir', 'file')) as f:
+            self.assertEqual(f.read(), 'new')
+
+    def test_sync_replaces_non_directory_destination(self):
+        open('dst', 'w').close()
+
+        self.assertEqual(file_utils.sync_tree('src', 'dst'), 6)
+
+        self.assertTrue(os.path.isdir('dst'))
+
+    def test_sync_ignore(self):
+        def ignore(directory, names):
+            return ['other'] if directory == 'src' else []
+
+        file_utils.sync_tree('src', 'dst')
+
+        self.assertEqual(file_utils.sync_tree('src', 'dst', ignore=ignore), 1)
+        self.assertFalse(os.path.exists(os.path.join('dst', 'other')))
+
+    def test_sync_delete(self):
+        file_utils.sync_tree('src', 'dst')
+        open(os.path.join('dst', 'built'), 'w').close()
+        os.remove(os.path.join('src', 'other'))
+
+        def delete(path):
+            return path != os.path.join('dst', 'built')
+
+        self.assertEqual(file_utils.sync_tree('src', 'dst', delete=delete), 1)
+        self.assertFalse(os.path.exists(os.path.join('dst', 'other')))
+        self.assertTrue(os.path.exists(os.path.join('dst', 'built')))
+
+    def test_sync_into_source(self):
+        file_utils.sync_tree('src', os.path.join('src', 'dst'))
+
+        self.assertFalse(
+            os.path.exists(os.path.join('src', 'dst', 'dst')))
+
 
 class ExecutableExistsTestCase(tests.TestCase):
 
@@ -302,3 +511,57 @@ class RequiresPathExistsTestCase(tests.TestCase):
             ).__enter__)
 
         self.assertEqual("what? 'foo'", str(raised))
+
+
+class CalculateTreeHashTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs(os.path.join('tree', 'dir'))
+        with open(os.path.join('tree', 'dir', 'file'), 'w') as f:
+            f.write('contents')
+        os.symlink('dir', os.path.join('tree', 'link'))
+        self.tree_hash = file_utils.calculate_tree_hash('tree')
+
+    def test_unchanged_tree(self):
+        self.assertEqual(
+            self.tree_hash, file_utils.calculate_tree_hash('tree'))
+
+    def test_modified_file(self):
+        with open(os.path.join('tree', 'dir', 'file'), 'a') as f:
+            f.write('more contents')
+
+        self.assertNotEqual(
+            self.tree_hash, file_utils.calculate_tree_hash('tree'))
+
+    def test_touched_file(self):
+        path = os.path.join('tree', 'dir', 'file')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        self.assertNotEqual(
+            self.tree_hash, file_utils.calculate_tree_hash('tree'))
+
+    def test_new_empty_directory(self):
+        os.mkdir(os.path.join('tree', 'dir', 'new'))
+
+        self.assertNotEqual(
+            self.tree_hash, file_utils.calculate_tree_hash('tree'))
+
+    def test_changed_symlink(self):
+        os.remove(os.path.join('tree', 'link'))
+        os.symlink(os.path.join('dir', 'file'), os.path.join('tree', 'link'))
+
+        self.assertNotEqual(
+            self.tree_hash, file_utils.calculate_tree_hash('tree'))
+
+    def test_ignored_files(self):
+        open(os.path.join('tree', 'ignored'), 'w').close()
+
+        def ignore(directory, files):
+            return ['ignored'] if directory == 'tree' else []
+
+        self.assertEqual(
+            self.tree_hash,
+            file_utils.calculate_tree_hash('tree', ignore=ignore))
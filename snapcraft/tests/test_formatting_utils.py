@@ -50,3 +50,20 @@ class HumanizeListTestCases(tests.TestCase):
         items = ['foo', 'bar', 'baz', 'qux']
         output = formatting_utils.humanize_list(items, 'or')
         self.assertEqual(output, "'bar', 'baz', 'foo', or 'qux'")
+
+
+class HumanizeSizeTestCase(tests.TestCase):
+
+    def test_bytes(self):
+        self.assertEqual(formatting_utils.humanize_size(1023), '1023 B')
+
+    def test_kibibytes(self):
+        self.assertEqual(formatting_utils.humanize_size(1536), '1.5 KiB')
+
+    def test_gibibytes(self):
+        self.assertEqual(formatting_utils.humanize_size(10 * 1024 ** 3),
+                         '10.0 GiB')
+
+    def test_tebibytes(self):
+        self.assertEqual(formatting_utils.humanize_size(2048 * 1024 ** 4),
+                         '2048.0 TiB')
@@ -0,0 +1,106 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest import mock
+
+from snapcraft.internal import common, jobserver
+from snapcraft import tests
+
+_MiB = 1024 * 1024
+
+
+def _read_tokens(fd):
+    os.set_blocking(fd, False)
+    try:
+        return os.read(fd, 1024)
+    except BlockingIOError:
+        return b''
+
+
+class JobServerTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(jobserver.stop)
+
+    def test_tokens(self):
+        jobserver.start(4)
+
+        server = jobserver.get()
+        self.assertEqual(server.slots, 4)
+        self.assertEqual(_read_tokens(server.fds[0]), b'+++')
+
+    def test_builds_start_with_a_job(self):
+        jobserver.start(4, builds=3)
+
+        self.assertEqual(_read_tokens(jobserver.get().fds[0]), b'+')
+
+    def test_makeflags(self):
+        jobserver.start(2)
+
+        self.assertEqual(jobserver.get().makeflags(),
+                         '-j --jobserver-fds={},{}'.format(
+                             *jobserver.get().fds))
+
+    def test_stop(self):
+        jobserver.start(2)
+        read_fd, _ = jobserver.get().fds
+
+        jobserver.stop()
+
+        self.assertIsNone(jobserver.get())
+        self.assertRaises(OSError, os.fstat, read_fd)
+
+    def test_run_inherits_the_pipe(self):
+        jobserver.start(2)
+        read_fd, write_fd = jobserver.get().fds
+        _read_tokens(read_fd)
+
+        common.run(['/bin/sh', '-c', 'printf + >&{}'.format(write_fd)])
+
+        self.assertEqual(_read_tokens(read_fd), b'+')
+
+
+class GetSlotsTestCase(tests.TestCase):
+
+    @mock.patch('snapcraft.internal.jobserver._get_available_memory',
+                return_value=3 * 1024 * _MiB)
+    def test_memory_limits_slots(self, mock_available_memory):
+        self.assertEqual(jobserver.get_slots(8, job_memory=1024), 3)
+        self.assertEqual(jobserver.get_slots(2, job_memory=1024), 2)
+        self.assertEqual(jobserver.get_slots(8, job_memory=4096), 1)
+
+    @mock.patch('snapcraft.internal.jobserver._get_available_memory',
+                return_value=None)
+    def test_unknown_memory(self, mock_available_memory):
+        self.assertEqual(jobserver.get_slots(8, job_memory=1024), 8)
+
+    def test_available_memory(self):
+        with open('meminfo', 'w') as f:
+            f.write('MemTotal:        8000000 kB\n'
+                    'MemFree:          100000 kB\n'
+                    'MemAvailable:    2097152 kB\n')
+
+        self.assertEqual(jobserver._get_available_memory('meminfo'),
+                         2048 * _MiB)
+
+    def test_available_memory_unknown(self):
+        with open('meminfo', 'w') as f:
+            f.write('MemTotal:        8000000 kB\n')
+
+        self.assertIsNone(jobserver._get_available_memory('meminfo'))
+        self.assertIsNone(jobserver._get_available_memory('missing'))
@@ -17,13 +17,22 @@
 import fixtures
 import logging
 import os
+import shutil
 import subprocess
 import tempfile
+import unittest
 
 from unittest import mock
 
-from snapcraft.internal import libraries
+from snapcraft.internal import (
+    elf,
+    libraries,
+)
 from snapcraft import tests
+from snapcraft.tests.fake_elf import (
+    write_elf,
+    write_ld_so_cache,
+)
 
 
 class TestLdLibraryPathParser(tests.TestCase):
@@ -122,3 +131,232 @@ class TestSystemLibsOnNewRelease(tests.TestCase):
 
     def test_fail_gracefully_if_system_libs_not_found(self):
         self.assertEqual(libraries.get_dependencies('foo'), [])
+
+
+class DependencyResolverTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        patcher = mock.patch('snapcraft.internal.libraries._get_system_libs')
+        self.get_system_libs_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get_system_libs_mock.return_value = frozenset()
+
+        self.ld_so_cache = os.path.join(self.path, 'ld.so.cache')
+        write_ld_so_cache(self.ld_so_cache, [])
+
+    def in_root(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def get_dependencies(self, path, ld_library_path=None):
+        resolver = libraries.DependencyResolver(
+            ld_library_path, ld_so_cache=self.ld_so_cache)
+        return resolver.get_dependencies(path)
+
+    def test_ld_library_path(self):
+        write_elf('bin/hello', interpreter='/lib64/ld-linux-x86-64.so.2',
+                  needed=['libfoo.so.1'])
+        write_elf('lib/libfoo.so.1', soname='libfoo.so.1',
+                  needed=['libbar.so.2', 'ld-linux-x86-64.so.2'])
+        write_elf('usr/lib/libbar.so.2', soname='libbar.so.2')
+
+        ld_library_path = self.in_root('lib') + ':' + self.in_root('usr/lib/')
+
+        self.assertEqual(
+            self.get_dependencies('bin/hello', ld_library_path),
+            [self.in_root('lib', 'libfoo.so.1'),
+             self.in_root('usr', 'lib', 'libbar.so.2')])
+
+    def test_filtered_by_system_libraries(self):
+        self.get_system_libs_mock.return_value = frozenset(['libbar.so.2'])
+        write_elf('hello', needed=['libfoo.so.1', 'libbar.so.2'])
+        write_elf('lib/libfoo.so.1')
+        write_elf('lib/libbar.so.2')
+
+        self.assertEqual(self.get_dependencies('hello', self.in_root('lib')),
+                         [self.in_root('lib', 'libfoo.so.1')])
+
+    def test_rpath_of_the_loaders(self):
+        write_elf('bin/hello', needed=['libfoo.so.1'],
+                  rpath='$ORIGIN/../lib')
+        write_elf('lib/libfoo.so.1', needed=['libbar.so.2'])
+        write_elf('lib/libbar.so.2')
+
+        self.assertEqual(
+            self.get_dependencies(self.in_root('bin', 'hello')),
+            [self.in_root('bin', '..', 'lib', 'libfoo.so.1'),
+             self.in_root('bin', '..', 'lib', 'libbar.so.2')])
+
+    def test_rpath_ignored_with_runpath(self):
+        write_elf('hello', needed=['libfoo.so.1'], rpath='/nonexistent',
+                  runpath=self.in_root('lib'))
+        write_elf('lib/libfoo.so.1')
+        write_elf('rpath/libfoo.so.1')
+
+        self.assertEqual(self.get_dependencies('hello'),
+                         [self.in_root('lib', 'libfoo.so.1')])
+
+    def test_runpath_searched_after_ld_library_path(self):
+        write_elf('hello', needed=['libfoo.so.1'],
+                  runpath=self.in_root('runpath'))
+        write_elf('runpath/libfoo.so.1')
+        write_elf('lib/libfoo.so.1')
+
+        self.assertEqual(self.get_dependencies('hello', self.in_root('lib')),
+                         [self.in_root('lib', 'libfoo.so.1')])
+
+    def test_runpath_not_used_for_indirect_dependencies(self):
+        write_elf('hello', needed=['libfoo.so.1'],
+                  runpath=self.in_root('lib'))
+        write_elf('lib/libfoo.so.1', needed=['libbar.so.2'])
+        write_elf('lib/libbar.so.2')
+
+        self.assertIsNone(self.get_dependencies('hello'))
+
+    def test_ld_so_cache(self):
+        write_ld_so_cache(self.ld_so_cache, [
+            (0x0003, 'libfoo.so.1', self.in_root('lib32', 'libfoo.so.1'), 0),
+            (0x0303, 'libfoo.so.1', self.in_root('lib64', 'libfoo.so.1'), 0),
+        ])
+        write_elf('hello', needed=['libfoo.so.1'])
+        write_elf('lib32/libfoo.so.1', elf_class=1, machine=3)
+        write_elf('lib64/libfoo.so.1')
+
+        self.assertEqual(self.get_dependencies('hello'),
+                         [self.in_root('lib64', 'libfoo.so.1')])
+
+    def test_ld_so_cache_not_used_with_nodeflib(self):
+        write_ld_so_cache(self.ld_so_cache, [
+            (0x0303, 'libfoo.so.1', self.in_root('lib', 'libfoo.so.1'), 0),
+        ])
+        write_elf('hello', needed=['libfoo.so.1'],
+                  flags_1=elf.DF_1_NODEFLIB)
+        write_elf('lib/libfoo.so.1')
+
+        self.assertIsNone(self.get_dependencies('hello'))
+
+    def test_ld_so_cache_with_hwcap_entries_is_not_resolved(self):
+        write_ld_so_cache(self.ld_so_cache, [
+            (0x0303, 'libfoo.so.1', self.in_root('lib', 'libfoo.so.1'), 0),
+            (0x0303, 'libfoo.so.1', self.in_root('lib', 'tls', 'libfoo.so.1'),
+             1 << 62),
+        ])
+        write_elf('hello', needed=['libfoo.so.1'])
+        write_elf('lib/libfoo.so.1')
+
+        self.assertIsNone(self.get_dependencies('hello'))
+
+    def test_incompatible_libraries_are_skipped(self):
+        write_elf('hello', needed=['libfoo.so.1'])
+        write_elf('lib32/libfoo.so.1', elf_class=1)
+        write_elf('lib64/libfoo.so.1')
+
+        self.assertEqual(
+            self.get_dependencies(
+                'hello', self.in_root('lib32') + ':' + self.in_root('lib64')),
+            [self.in_root('lib64', 'libfoo.so.1')])
+
+    def test_libraries_are_loaded_once(self):
+        write_elf('hello', needed=['libfoo.so', 'libfoo.so.1'])
+        write_elf('lib/libfoo.so.1', soname='libfoo.so.1')
+        os.symlink('libfoo.so.1', self.in_root('lib', 'libfoo.so'))
+
+        self.assertEqual(self.get_dependencies('hello', self.in_root('lib')),
+                         [self.in_root('lib', 'libfoo.so')])
+
+    def test_dynamic_linker_is_not_a_dependency(self):
+        write_elf('lib/libfoo.so.1', needed=['ld-linux-x86-64.so.2'])
+
+        self.assertEqual(self.get_dependencies('lib/libfoo.so.1'), [])
+
+    def test_not_found_is_not_resolved(self):
+        write_elf('hello', needed=['libfoo.so.1'])
+
+        self.assertIsNone(self.get_dependencies('hello', self.in_root('lib')))
+
+    def test_hwcap_subdirectories_are_not_resolved(self):
+        write_elf('hello', needed=['libfoo.so.1'])
+        write_elf('lib/libfoo.so.1')
+        write_elf('lib/glibc-hwcaps/x86-64-v3/libfoo.so.1')
+
+        self.assertIsNone(self.get_dependencies('hello', self.in_root('lib')))
+
+    def test_system_dependent_tokens_are_not_resolved(self):
+        write_elf('hello', needed=['libfoo.so.1'], rpath='/usr/$LIB')
+
+        self.assertIsNone(self.get_dependencies('hello'))
+
+    def test_statically_linked_is_not_resolved(self):
+        write_elf('hello', dynamic=False)
+
+        self.assertIsNone(self.get_dependencies('hello'))
+
+    @unittest.skipUnless(shutil.which('ldd') and os.path.exists('/bin/ls'),
+                         'ldd is needed')
+    def test_same_as_ldd(self):
+        resolver = libraries.DependencyResolver(None)
+
+        dependencies = resolver.get_dependencies('/bin/ls')
+
+        if dependencies is None:
+            self.skipTest('/bin/ls cannot be resolved without ldd')
+        self.assertEqual(set(dependencies),
+                         set(libraries.get_dependencies('/bin/ls')))
+
+
+class GetSearchContextTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        patcher = mock.patch('snapcraft.internal.libraries._get_system_libs')
+        self.get_system_libs_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get_system_libs_mock.return_value = frozenset()
+
+        os.makedirs('lib')
+        os.makedirs('stage/usr/lib')
+        write_elf('lib/libfoo.so.1')
+        write_elf('stage/usr/lib/libbar.so.1')
+        self.context = libraries.get_search_context('lib', ['stage'])
+
+    def test_same_context(self):
+        self.assertEqual(libraries.get_search_context('lib', ['stage']),
+                         self.context)
+
+    def test_other_ld_library_path(self):
+        self.assertNotEqual(libraries.get_search_context('lib:', ['stage']),
+                            self.context)
+
+    def test_library_added_to_ld_library_path(self):
+        write_elf('lib/libbaz.so.1')
+
+        self.assertNotEqual(libraries.get_search_context('lib', ['stage']),
+                            self.context)
+
+    def test_other_files_in_ld_library_path_ignored(self):
+        open('lib/README', 'w').close()
+
+        self.assertEqual(libraries.get_search_context('lib', ['stage']),
+                         self.context)
+
+    def test_library_staged(self):
+        os.makedirs('stage/usr/lib/foo')
+        write_elf('stage/usr/lib/foo/libbaz.so')
+
+        self.assertNotEqual(libraries.get_search_context('lib', ['stage']),
+                            self.context)
+
+    def test_library_changed(self):
+        os.remove('stage/usr/lib/libbar.so.1')
+        write_elf('stage/usr/lib/libbar.so.1', needed=['libc.so.6'])
+
+        self.assertNotEqual(libraries.get_search_context('lib', ['stage']),
+                            self.context)
+
+    def test_other_system_libraries(self):
+        self.get_system_libs_mock.return_value = frozenset(['libc.so.6'])
+
+        self.assertNotEqual(libraries.get_search_context('lib', ['stage']),
+                            self.context)
@@ -16,10 +16,13 @@
 
 import contextlib
 import fileinput
+import json
 import logging
 import os
 import re
 import shutil
+import threading
+import time
 from unittest import mock
 
 import fixtures
@@ -31,9 +34,9 @@ from testtools.matchers import (
 )
 
 import snapcraft
-from snapcraft import storeapi
+from snapcraft import file_utils, storeapi
 from snapcraft.file_utils import calculate_sha3_384
-from snapcraft.internal import pluginhandler, lifecycle
+from snapcraft.internal import cache, jobserver, pluginhandler, lifecycle
 from snapcraft import tests
 
 
@@ -169,6 +172,125 @@ grade: stable
             'Pulling part3 \n',
             self.fake_logger.output)
 
+    def test_concurrent_dependency_recursed_correctly(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after:
+      - part1
+  part3:
+    plugin: nil
+    after:
+      - part2
+  part4:
+    plugin: nil
+""")
+
+        project_options = snapcraft.ProjectOptions(jobs=4)
+        lifecycle.execute('pull', project_options)
+
+        output = self.fake_logger.output.split('\n')
+        self.assertLess(output.index('Staging part1 '),
+                        output.index('Preparing to pull part2 '))
+        self.assertLess(output.index('Staging part2 '),
+                        output.index('Preparing to pull part3 '))
+        self.assertEqual(
+            ['Preparing to pull part2 ', 'Pulling part2 ',
+             'Preparing to build part2 ', 'Building part2 ',
+             'Staging part2 '],
+            [line for line in output if line.endswith('part2 ')])
+        self.assertEqual(
+            ['Preparing to pull part4 ', 'Pulling part4 '],
+            [line for line in output if line.endswith('part4 ')])
+        self.assertThat(
+            os.path.join(self.parts_dir, 'part3', 'state', 'pull'),
+            FileExists())
+        self.assertThat(
+            os.path.join(self.parts_dir, 'part3', 'state', 'build'),
+            Not(FileExists()))
+
+    def test_concurrent_exception_when_dependency_is_required(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+    after:
+      - part1
+""")
+
+        raised = self.assertRaises(
+            RuntimeError,
+            lifecycle.execute,
+            'pull', snapcraft.ProjectOptions(jobs=2),
+            part_names=['part2'])
+
+        self.assertEqual(
+            raised.__str__(),
+            "Requested 'pull' of 'part2' but there are unsatisfied "
+            "prerequisites: 'part1'")
+
+    def test_concurrent_stage_checks_each_part_for_collisions_once(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+  part3:
+    plugin: nil
+""")
+        lifecycle.execute('stage', snapcraft.ProjectOptions(jobs=3),
+                          part_names=['part1'])
+
+        checked = []
+        add = pluginhandler.CollisionIndex.add
+
+        def _add(index, part):
+            checked.append(part.name)
+            add(index, part)
+
+        with mock.patch.object(pluginhandler.CollisionIndex, 'add', _add):
+            lifecycle.execute('stage', snapcraft.ProjectOptions(jobs=3))
+
+        # part1 was staged already, so it is only indexed.
+        self.assertCountEqual(['part1', 'part2', 'part3'], checked)
+        self.assertEqual('part1', checked[0])
+
+    def test_concurrent_shared_area_steps_are_serialized(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+  part2:
+    plugin: nil
+  part3:
+    plugin: nil
+""")
+
+        lock = threading.Lock()
+        counts = {'running': 0, 'max': 0}
+        original_stage = pluginhandler.PluginHandler.stage
+
+        def _fake_stage(self, force=False, project_state=None):
+            with lock:
+                counts['running'] += 1
+                counts['max'] = max(counts['max'], counts['running'])
+            time.sleep(0.05)
+            original_stage(self, force, project_state)
+            with lock:
+                counts['running'] -= 1
+
+        with mock.patch.object(pluginhandler.PluginHandler, 'stage',
+                               _fake_stage):
+            lifecycle.execute('prime', snapcraft.ProjectOptions(jobs=3))
+
+        self.assertEqual(1, counts['max'])
+        for part_name in ('part1', 'part2', 'part3'):
+            self.assertThat(
+                os.path.join(self.parts_dir, part_name, 'state', 'prime'),
+                FileExists())
+
     def test_os_type_returned_by_lifecycle(self):
         self.make_snapcraft_yaml("""parts:
   part1:
@@ -233,7 +355,7 @@ grade: stable
                 'Skipping pull part1 (already ran)',
                 'Skipping build part1 (already ran)',
                 'Skipping stage part1 (already ran)',
-                'Cleaning priming area for part1 (out of date)',
+                'Updating priming area for part1 (out of date)',
                 'Priming part1',
             ],
             part1_output)
@@ -273,7 +395,7 @@ grade: stable
                 'Skipping pull part2 (already ran)',
                 'Skipping build part2 (already ran)',
                 'Skipping stage part2 (already ran)',
-                'Cleaning priming area for part2 (out of date)',
+                'Updating priming area for part2 (out of date)',
                 'Priming part2',
             ],
             part2_output)
@@ -283,7 +405,7 @@ grade: stable
                 'Skipping pull part1 (already ran)',
                 'Skipping build part1 (already ran)',
                 'Skipping stage part1 (already ran)',
-                'Cleaning priming area for part1 (out of date)',
+                'Updating priming area for part1 (out of date)',
                 'Priming part1',
             ],
             part1_output)
@@ -332,7 +454,7 @@ grade: stable
                 'Skipping build part1 (already ran)',
                 'Skipping cleaning priming area for part1 (out of date) '
                 '(already clean)',
-                'Cleaning staging area for part1 (out of date)',
+                'Updating staging area for part1 (out of date)',
                 'Staging part1',
             ],
             part1_output)
@@ -373,7 +495,7 @@ grade: stable
                 'Skipping build part2 (already ran)',
                 'Skipping cleaning priming area for part2 (out of date) '
                 '(already clean)',
-                'Cleaning staging area for part2 (out of date)',
+                'Updating staging area for part2 (out of date)',
                 'Staging part2',
             ],
             part2_output)
@@ -384,7 +506,7 @@ grade: stable
                 'Skipping build part1 (already ran)',
                 'Skipping cleaning priming area for part1 (out of date) '
                 '(already clean)',
-                'Cleaning staging area for part1 (out of date)',
+                'Updating staging area for part1 (out of date)',
                 'Staging part1',
             ],
             part1_output)
@@ -469,7 +591,7 @@ grade: stable
             'Skipping build part1 (already ran)\n'
             'Skipping cleaning priming area for part1 (out of date) '
             '(already clean)\n'
-            'Cleaning staging area for part1 (out of date)\n'
+            'Updating staging area for part1 (out of date)\n'
             'Skipping cleaning priming area for part2 (out of date) '
             '(already clean)\n'
             'Skipping cleaning staging area for part2 (out of date) '
@@ -504,8 +626,8 @@ grade: stable
         self.assertEqual(
             'Skipping pull part1 (already ran)\n'
             'Skipping build part1 (already ran)\n'
-            'Cleaning priming area for part1 (out of date)\n'
-            'Cleaning staging area for part1 (out of date)\n'
+            'Updating priming area for part1 (out of date)\n'
+            'Updating staging area for part1 (out of date)\n'
             'Staging part1 \n'
             'Priming part1 \n',
             self.fake_logger.output)
@@ -582,6 +704,262 @@ grade: stable
             "by running: snapcraft clean part1 -s pull\n",
             str(raised))
 
+    def test_changed_source_cleans_part_and_dependents(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    source: src1
+  part2:
+    plugin: nil
+    source: src2
+    after: [part1]
+  part3:
+    plugin: nil
+    source: src3
+""")
+        for source in ('src1', 'src2', 'src3'):
+            os.mkdir(source)
+            open(os.path.join(source, 'file'), 'w').close()
+
+        lifecycle.execute('prime', self.project_options)
+
+        with open(os.path.join('src1', 'file'), 'w') as f:
+            f.write('changed')
+
+        # Reset logging since we only care about the following
+        self.fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(self.fake_logger)
+
+        lifecycle.execute('prime', self.project_options)
+
+        self.assertEqual(
+            'Skipping pull part3 (already ran)\n'
+            'Skipping build part3 (already ran)\n'
+            'Skipping stage part3 (already ran)\n'
+            'Skipping prime part3 (already ran)\n'
+            'Updating priming area for part2 (dependency source changed)\n'
+            'Updating staging area for part2 (dependency source changed)\n'
+            'Cleaning build for part2 (dependency source changed)\n'
+            'Updating priming area for part1 (source changed)\n'
+            'Updating staging area for part1 (source changed)\n'
+            'Cleaning build for part1 (source changed)\n'
+            'Cleaning pulled source for part1 (source changed)\n'
+            'Skipping pull part2 (already ran)\n'
+            'Preparing to pull part1 \n'
+            'Pulling part1 \n'
+            'Preparing to build part1 \n'
+            'Building part1 \n'
+            "'part2' has prerequisites that need to be staged: part1\n"
+            'Staging part1 \n'
+            'Preparing to build part2 \n'
+            'Building part2 \n'
+            'Staging part2 \n'
+            'Priming part1 \n'
+            'Priming part2 \n',
+            self.fake_logger.output)
+
+    def test_unchanged_source_is_not_cleaned(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    source: src1
+""")
+        os.mkdir('src1')
+        open(os.path.join('src1', 'file'), 'w').close()
+
+        lifecycle.execute('build', self.project_options)
+
+        # Reset logging since we only care about the following
+        self.fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(self.fake_logger)
+
+        lifecycle.execute('build', self.project_options)
+
+        self.assertEqual(
+            'Skipping pull part1 (already ran)\n'
+            'Skipping build part1 (already ran)\n',
+            self.fake_logger.output)
+
+    def test_changed_local_source_only_pulls_changes(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    source: src1
+""")
+        os.makedirs(os.path.join('src1', 'dir'))
+        for name in ('file', 'other', os.path.join('dir', 'nested')):
+            with open(os.path.join('src1', name), 'w') as f:
+                f.write('original')
+
+        lifecycle.execute('pull', self.project_options)
+
+        # Replaced rather than written to, as editors do.
+        os.remove(os.path.join('src1', 'file'))
+        with open(os.path.join('src1', 'file'), 'w') as f:
+            f.write('changed')
+
+        sync_tree = file_utils.sync_tree
+        changes = []
+
+        def _sync_tree(*args, **kwargs):
+            changes.append(sync_tree(*args, **kwargs))
+            return changes[-1]
+
+        with mock.patch('snapcraft.file_utils.sync_tree',
+                        side_effect=_sync_tree):
+            lifecycle.execute('pull', self.project_options)
+
+        # The pulled source was kept, so only the changed file was copied.
+        self.assertEqual([1], changes)
+        sourcedir = os.path.join(self.parts_dir, 'part1', 'src')
+        self.assertThat(os.path.join(sourcedir, 'file'),
+                        FileContains('changed'))
+        self.assertThat(os.path.join(sourcedir, 'dir', 'nested'),
+                        FileContains('original'))
+
+    def test_trace(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: dump
+    source: src1
+""")
+        os.mkdir('src1')
+        with open(os.path.join('src1', 'file'), 'w') as f:
+            f.write('contents')
+
+        lifecycle.execute('prime', snapcraft.ProjectOptions(
+            trace_file='trace.json'))
+
+        with open('trace.json') as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        steps = [(e['args']['part'], e['name']) for e in events
+                 if e['cat'] == 'step']
+        self.assertEqual(
+            [('part1', 'pull'), ('part1', 'build'), ('part1', 'stage'),
+             ('part1', 'prime')], steps)
+        phases = {e['name'] for e in events if e['cat'] == 'phase'}
+        self.assertEqual(
+            {'stage packages', 'source pull', 'plugin pull', 'copytree',
+             'plugin build', 'organize', 'collect files', 'migrate files',
+             'find dependencies'}, phases)
+        # Preparing a step is traced as part of it.
+        for step in ('pull', 'build'):
+            step_event, = [e for e in events
+                           if e['cat'] == 'step' and e['name'] == step]
+            start = step_event['ts']
+            end = start + step_event['dur']
+            self.assertEqual(1, len([
+                e for e in events if e['name'] == 'stage packages' and
+                start <= e['ts'] and e['ts'] + e['dur'] <= end]))
+        stage, = [e for e in events
+                  if e['cat'] == 'step' and e['name'] == 'stage']
+        self.assertEqual(8, stage['args']['bytes'])
+        self.assertIn('Time spent in each step, slowest first (trace '
+                      "written to 'trace.json'):\n", self.fake_logger.output)
+
+    @mock.patch('multiprocessing.cpu_count', return_value=4)
+    @mock.patch('snapcraft.internal.jobserver.get_slots', return_value=4)
+    def test_build_env_hands_make_the_jobserver(self, mock_get_slots,
+                                                mock_cpu_count):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    build: echo "$MAKEFLAGS" > makeflags
+""")
+
+        lifecycle.execute('build', snapcraft.ProjectOptions(
+            parallel_builds=True, job_memory=2048))
+
+        mock_get_slots.assert_called_once_with(mock.ANY, job_memory=2048)
+        self.assertIsNone(jobserver.get())
+        with open(os.path.join('parts', 'part1', 'build', 'makeflags')) as f:
+            self.assertRegex(f.read(), r'-j --jobserver-fds=\d+,\d+')
+
+    @mock.patch('snapcraft.internal.jobserver.start')
+    def test_no_jobserver_without_parallel_builds(self, mock_start):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+
+        lifecycle.execute('build', snapcraft.ProjectOptions(
+            parallel_builds=False))
+
+        mock_start.assert_not_called()
+
+    @mock.patch('snapcraft.repo.get_packages')
+    @mock.patch('snapcraft.repo.Ubuntu')
+    def test_stage_packages_of_all_parts_are_fetched_at_once(
+            self, mock_ubuntu, mock_get_packages):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    stage-packages: [foo]
+  part2:
+    plugin: nil
+    stage-packages: [bar]
+  part3:
+    plugin: nil
+""")
+        mock_get_packages.return_value = [['foo=1'], ['bar=1']]
+
+        lifecycle.execute('pull', snapcraft.ProjectOptions())
+
+        requests, = mock_get_packages.call_args[0]
+        self.assertCountEqual(
+            [packages for _, packages in requests], [{'foo'}, {'bar'}])
+        mock_ubuntu.return_value.get.assert_not_called()
+        self.assertEqual(
+            mock_ubuntu.return_value.unpack.call_count, 2)
+
+    @mock.patch('snapcraft.repo.Ubuntu.unpack')
+    @mock.patch('snapcraft.repo.apt.apt_pkg')
+    @mock.patch('snapcraft.repo.apt.Cache')
+    def test_stage_packages_of_all_parts_share_one_archive(
+            self, mock_cache, mock_apt_pkg, mock_unpack):
+        def _fetch_binary(download_dir, **kwargs):
+            path = os.path.join(download_dir, 'foo.deb')
+            open(path, 'w').close()
+            return path
+        mock_package = mock.MagicMock()
+        mock_package.candidate.fetch_binary.side_effect = _fetch_binary
+        mock_package.candidate.uri = None
+        mock_cache.return_value.get_changes.return_value = [mock_package]
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+    stage-packages: [foo]
+  part2:
+    plugin: nil
+    stage-packages: [foo]
+""")
+
+        lifecycle.execute('pull', snapcraft.ProjectOptions(use_geoip=False))
+
+        # One archive solves for both parts, and what they have in common
+        # is only downloaded once.
+        archives = [c for c in mock_cache.call_args_list
+                    if 'rootdir' in c[1]]
+        self.assertEqual(1, len(archives))
+        self.assertEqual(1, mock_package.candidate.fetch_binary.call_count)
+        for part in ('part1', 'part2'):
+            self.assertTrue(os.path.exists(os.path.join(
+                self.parts_dir, part, 'ubuntu', 'download', 'foo.deb')))
+        self.assertEqual(2, mock_unpack.call_count)
+
+    def test_caches_are_pruned_keeping_what_was_used(self):
+        self.make_snapcraft_yaml("""parts:
+  part1:
+    plugin: nil
+""")
+
+        started = int(time.time())
+        lifecycle.execute('pull', self.project_options)
+
+        prune_if_due = self.cache_manager.return_value.prune_if_due
+        keep_since = prune_if_due.call_args[1]['keep_since']
+        self.assertTrue(started <= keep_since <= time.time())
+
     @mock.patch.object(snapcraft.BasePlugin, 'enable_cross_compilation')
     @mock.patch('snapcraft.repo.install_build_packages')
     def test_pull_is_dirty_if_target_arch_changes(
@@ -619,6 +997,37 @@ grade: stable
             str(raised))
 
 
+class PruneCachesTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.fake_logger = fixtures.FakeLogger(level=logging.INFO)
+        self.useFixture(self.fake_logger)
+
+    @mock.patch('snapcraft.internal.lifecycle.CacheManager')
+    def test_prune_caches(self, mock_manager):
+        mock_manager.return_value.prune_if_due.return_value = \
+            cache.Pruned(entries=['a', 'b'], size=2048)
+
+        lifecycle._prune_caches(keep_since=1000)
+
+        mock_manager.return_value.prune_if_due.assert_called_once_with(
+            keep_since=1000)
+        self.assertEqual(
+            'Evicted 2 unused cache entries, reclaiming 2.0 KiB\n',
+            self.fake_logger.output)
+
+    @mock.patch('snapcraft.internal.lifecycle.CacheManager')
+    def test_prune_caches_with_invalid_limits(self, mock_manager):
+        mock_manager.side_effect = EnvironmentError('invalid limits')
+
+        lifecycle._prune_caches(keep_since=1000)
+
+        self.assertEqual('Not pruning the caches: invalid limits\n',
+                         self.fake_logger.output)
+
+
 class CoreSetupTestCase(tests.TestCase):
 
     def setUp(self):
@@ -32,7 +32,7 @@ class TestMain(TestCase):
             snapcraft.main.main([])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, jobs=1, trace_file=None, job_memory=1024)
             self.assertTrue(mock_cmd.called, mock_cmd.called)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
@@ -42,7 +42,7 @@ class TestMain(TestCase):
             self.assertTrue(mock_cmd.called, mock_cmd.called)
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=True)
+                use_geoip=True, jobs=1, trace_file=None, job_memory=1024)
 
     def test_command_error(self):
         fake_logger = fixtures.FakeLogger(level=logging.ERROR)
@@ -87,7 +87,7 @@ class TestMain(TestCase):
             snapcraft.main.main(['--debug'])
             mock_project_options.assert_called_once_with(
                 debug=True, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, jobs=1, trace_file=None, job_memory=1024)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_with_parallel_builds(self, mock_cmd):
@@ -95,7 +95,7 @@ class TestMain(TestCase):
             snapcraft.main.main([])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, jobs=1, trace_file=None, job_memory=1024)
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_disable_parallel_build(self, mock_cmd):
@@ -103,7 +103,63 @@ class TestMain(TestCase):
             snapcraft.main.main(['--no-parallel-build'])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=False, target_deb_arch=None,
-                use_geoip=False)
+                use_geoip=False, jobs=1, trace_file=None, job_memory=1024)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_jobs(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--jobs', '4'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, jobs=4, trace_file=None, job_memory=1024)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_trace(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--trace', 'trace.json'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, jobs=1, trace_file='trace.json',
+                job_memory=1024)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_job_memory(self, mock_cmd):
+        with mock.patch('snapcraft.ProjectOptions') as mock_project_options:
+            snapcraft.main.main(['--job-memory', '2048'])
+            mock_project_options.assert_called_once_with(
+                debug=False, parallel_builds=True, target_deb_arch=None,
+                use_geoip=False, jobs=1, trace_file=None, job_memory=2048)
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_invalid_job_memory(self, mock_cmd):
+        fake_logger = fixtures.FakeLogger(level=logging.ERROR)
+        self.useFixture(fake_logger)
+
+        raised = self.assertRaises(
+            SystemExit,
+            snapcraft.main.main, ['--job-memory', 'lots'])
+
+        self.assertEqual(1, raised.code)
+        self.assertEqual(
+            fake_logger.output,
+            'The memory of a build job must be a positive number of MiB, '
+            "not 'lots'\n")
+        mock_cmd.assert_not_called()
+
+    @mock.patch('snapcraft.internal.lifecycle.snap')
+    def test_command_with_invalid_jobs(self, mock_cmd):
+        fake_logger = fixtures.FakeLogger(level=logging.ERROR)
+        self.useFixture(fake_logger)
+
+        raised = self.assertRaises(
+            SystemExit,
+            snapcraft.main.main, ['--jobs', '0'])
+
+        self.assertEqual(1, raised.code)
+        self.assertEqual(
+            fake_logger.output,
+            "The number of jobs must be a positive integer, not '0'\n")
+        mock_cmd.assert_not_called()
 
     @mock.patch('snapcraft.internal.lifecycle.snap')
     def test_command_with_target_deb_arch(self, mock_cmd):
@@ -111,4 +167,4 @@ class TestMain(TestCase):
             snapcraft.main.main(['--target-arch', 'arm64'])
             mock_project_options.assert_called_once_with(
                 debug=False, parallel_builds=True, target_deb_arch='arm64',
-                use_geoip=False)
+                use_geoip=False, jobs=1, trace_file=None, job_memory=1024)
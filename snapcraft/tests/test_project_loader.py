@@ -26,7 +26,7 @@ from testtools import ExpectedException
 from testtools.matchers import Equals
 
 import snapcraft
-from snapcraft.internal import dirs, parts
+from snapcraft.internal import common, dirs, parts
 from snapcraft.internal import project_loader
 from snapcraft.internal import errors
 from snapcraft import tests
@@ -322,7 +322,8 @@ parts:
                 'source': 'http://curl.org'},
             project_options=project_options,
             part_schema=self.part_schema,
-            definitions_schema=self.definitions_schema)
+            definitions_schema=self.definitions_schema,
+            state_store=unittest.mock.ANY)
         call2 = unittest.mock.call(
             'part1',
             plugin_name='go',
@@ -331,9 +332,12 @@ parts:
                 'stage-packages': ['fswebcam']},
             project_options=project_options,
             part_schema=self.part_schema,
-            definitions_schema=self.definitions_schema)
+            definitions_schema=self.definitions_schema,
+            state_store=unittest.mock.ANY)
 
         mock_load.assert_has_calls([call1, call2], any_order=True)
+        self.assertIs(mock_load.call_args_list[0][1]['state_store'],
+                      mock_load.call_args_list[1][1]['state_store'])
 
     def test_config_adds_extra_build_tools_when_cross_compiling(self):
         with unittest.mock.patch('platform.machine') as machine_mock, \
@@ -408,7 +412,8 @@ parts:
 
         self.assertEqual(
             raised.message,
-            'circular dependency chain found in parts definition')
+            'circular dependency chain found in parts definition: '
+            'p1 -> p2 -> p1')
 
     @unittest.mock.patch('snapcraft.internal.parts.PartsConfig.load_plugin')
     def test_invalid_yaml_missing_name(self, mock_loadPlugin):
@@ -765,6 +770,94 @@ parts:
         self.assertEqual({'dependent'},
                          config.parts.get_dependents('main'))
 
+    def _make_chain_snapcraft_yaml(self):
+        self.make_snapcraft_yaml("""name: test
+version: "1"
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+parts:
+  app:
+    plugin: nil
+    after: [lib, tools]
+
+  lib:
+    plugin: nil
+    after: [base]
+
+  other:
+    plugin: nil
+
+  tools:
+    plugin: nil
+
+  base:
+    plugin: nil
+""")
+
+    def test_get_dependents_recursive(self):
+        self._make_chain_snapcraft_yaml()
+        config = project_loader.Config()
+
+        self.assertEqual({'lib'}, config.parts.get_dependents('base'))
+        self.assertEqual({'app', 'lib'},
+                         config.parts.get_dependents('base', recursive=True))
+        self.assertFalse(config.parts.get_dependents('app', recursive=True))
+
+    def test_get_prereqs_recursive(self):
+        self._make_chain_snapcraft_yaml()
+        config = project_loader.Config()
+
+        self.assertEqual({'lib', 'tools'}, config.parts.get_prereqs('app'))
+        self.assertEqual({'base', 'lib', 'tools'},
+                         config.parts.get_prereqs('app', recursive=True))
+        self.assertFalse(config.parts.get_prereqs('base', recursive=True))
+
+    def test_parts_sorted_after_their_dependencies(self):
+        self._make_chain_snapcraft_yaml()
+        config = project_loader.Config()
+
+        self.assertEqual(['base', 'tools', 'other', 'lib', 'app'],
+                         [part.name for part in config.all_parts])
+        self.assertEqual(['lib', 'tools'],
+                         [part.name for part in config.parts.get_part(
+                             'app').deps])
+
+    def test_config_loop_reports_only_the_cycle(self):
+        self.make_snapcraft_yaml("""name: test
+version: "1"
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+parts:
+  base:
+    plugin: nil
+  p1:
+    plugin: nil
+    after: [base, p3]
+  p2:
+    plugin: nil
+    after: [p1]
+  p3:
+    plugin: nil
+    after: [p2]
+  app:
+    plugin: nil
+    after: [p3]
+""")
+        raised = self.assertRaises(
+            parts.SnapcraftLogicError,
+            project_loader.Config)
+
+        self.assertEqual(
+            raised.message,
+            'circular dependency chain found in parts definition: '
+            'p1 -> p3 -> p2 -> p1')
+
     @unittest.mock.patch('snapcraft.internal.parts.PartsConfig.load_plugin')
     def test_replace_snapcraft_variables(self, mock_load_plugin):
         self.make_snapcraft_yaml("""name: project-name
@@ -1726,10 +1819,6 @@ parts:
             '{stage_dir}/lib:'
             '{stage_dir}/usr/lib:'
             '{stage_dir}/lib/{arch_triplet}:'
-            '{stage_dir}/usr/lib/{arch_triplet}:'
-            '{stage_dir}/lib:'
-            '{stage_dir}/usr/lib:'
-            '{stage_dir}/lib/{arch_triplet}:'
             '{stage_dir}/usr/lib/{arch_triplet}'.format(
                 parts_dir=self.parts_dir,
                 stage_dir=self.stage_dir,
@@ -1756,6 +1845,173 @@ parts:
         env = config.parts.build_env_for_part(part1)
         self.assertIn('SNAPCRAFT_PARALLEL_BUILD_COUNT=fortytwo', env)
 
+    def test_parts_build_env_with_ccache(self):
+        self.make_snapcraft_yaml("""name: test
+version: "1"
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+parts:
+  part1:
+    plugin: nil
+    build-attributes: [ccache]
+  part2:
+    plugin: nil
+    after: [part1]
+""")
+        config = project_loader.Config()
+        part1, part2 = config.parts.all_parts
+
+        env = config.parts.build_env_for_part(part1)
+        path = [e for e in env if e.startswith('PATH=')]
+        self.assertEqual(path[-1], 'PATH="{}:$PATH"'.format(
+            os.path.join(self.parts_dir, 'part1', 'ccache')))
+        self.assertIn('ccache', config.build_tools)
+
+        env = config.parts.build_env_for_part(part2)
+        self.assertFalse([e for e in env if e.startswith('CCACHE_')])
+
+    def _make_diamond_snapcraft_yaml(self):
+        self.make_snapcraft_yaml("""name: test
+version: "1"
+summary: test
+description: test
+confinement: strict
+grade: stable
+
+parts:
+  base:
+    plugin: nil
+  left:
+    plugin: nil
+    after: [base]
+  right:
+    plugin: nil
+    after: [base]
+  top:
+    plugin: nil
+    after: [left, right]
+""")
+
+    def test_parts_build_env_with_diamond_deps_has_no_duplicates(self):
+        self._make_diamond_snapcraft_yaml()
+        config = project_loader.Config()
+        base = config.parts.get_part('base')
+        base.code.env = unittest.mock.Mock(return_value=['BASE=1'])
+
+        env = config.parts.build_env_for_part(config.parts.get_part('top'))
+
+        self.assertEqual(len(env), len(set(env)))
+        self.assertIn('BASE=1', env)
+        # The env of base is shared by left and right.
+        self.assertEqual(1, base.code.env.call_count)
+
+    def test_parts_build_env_keeps_last_of_duplicates(self):
+        self._make_diamond_snapcraft_yaml()
+        config = project_loader.Config()
+        config.parts.get_part('base').code.env = unittest.mock.Mock(
+            return_value=['PATH="/base:$PATH"'])
+        config.parts.get_part('left').code.env = unittest.mock.Mock(
+            return_value=['PATH="/left:$PATH"'])
+
+        env = config.parts.build_env_for_part(config.parts.get_part('top'))
+
+        # base comes last again through right, so it stays in front of left.
+        self.assertLess(env.index('PATH="/left:$PATH"'),
+                        env.index('PATH="/base:$PATH"'))
+
+    def test_parts_build_env_keeps_first_of_duplicate_appends(self):
+        self._make_diamond_snapcraft_yaml()
+        config = project_loader.Config()
+        config.parts.get_part('base').code.env = unittest.mock.Mock(
+            return_value=['LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/base"'])
+        config.parts.get_part('left').code.env = unittest.mock.Mock(
+            return_value=['LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/left"'])
+
+        env = config.parts.build_env_for_part(config.parts.get_part('top'))
+
+        # base is first reached through left, behind it.
+        self.assertEqual(1, env.count(
+            'LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/base"'))
+        self.assertLess(env.index('LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/left"'),
+                        env.index('LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/base"'))
+
+    def test_parts_build_env_resolves_as_without_cache(self):
+        self._make_diamond_snapcraft_yaml()
+        for directory in ('lib', 'usr/include'):
+            os.makedirs(os.path.join(self.stage_dir, directory))
+        self.useFixture(fixtures.EnvironmentVariable('PATH', '/bin'))
+        self.useFixture(fixtures.EnvironmentVariable(
+            'LD_LIBRARY_PATH', '/lib'))
+        config = project_loader.Config()
+        for name in ('base', 'left', 'right', 'top'):
+            config.parts.get_part(name).code.env = unittest.mock.Mock(
+                return_value=[
+                    'PATH="/{}/bin:$PATH"'.format(name),
+                    'LD_LIBRARY_PATH="$LD_LIBRARY_PATH:/{}/lib"'.format(name),
+                    'CFLAGS="$CFLAGS -I/{}/include"'.format(name),
+                    '{}=1'.format(name.upper())])
+        top = config.parts.get_part('top')
+
+        def search_order(value):
+            # Where a path is searched is decided by its first occurrence.
+            order = []
+            for path in value.replace(' ', ':').split(':'):
+                if path not in order:
+                    order.append(path)
+            return order
+
+        env = common.resolve_env(config.parts.build_env_for_part(top))
+        # How the env was built before dependency envs were cached and
+        # deduplicated.
+        with unittest.mock.patch.object(
+                parts, '_deduplicate_env', side_effect=lambda env: env), \
+            unittest.mock.patch.object(
+                config.parts, '_dependency_env',
+                side_effect=lambda dep: dep.env(self.stage_dir) +
+                config.parts.build_env_for_part(dep, root_part=False)):
+            uncached_env = common.resolve_env(
+                config.parts.build_env_for_part(top))
+
+        self.assertEqual(uncached_env.keys(), env.keys())
+        for variable in ('PATH', 'LD_LIBRARY_PATH', 'CFLAGS', 'CPPFLAGS'):
+            self.assertEqual(search_order(uncached_env[variable]),
+                             search_order(env[variable]), variable)
+
+    def test_parts_build_env_cache_cleared(self):
+        self._make_diamond_snapcraft_yaml()
+        config = project_loader.Config()
+        base = config.parts.get_part('base')
+        base.code.env = unittest.mock.Mock(return_value=['BASE=1'])
+        top = config.parts.get_part('top')
+
+        config.parts.build_env_for_part(top)
+        config.parts.build_env_for_part(top)
+        self.assertEqual(1, base.code.env.call_count)
+
+        base.code.env.return_value = ['BASE=2']
+        config.parts.clear_build_env_cache()
+        env = config.parts.build_env_for_part(top)
+
+        self.assertEqual(2, base.code.env.call_count)
+        self.assertIn('BASE=2', env)
+        self.assertNotIn('BASE=1', env)
+
+    def test_parts_build_env_dict(self):
+        self._make_diamond_snapcraft_yaml()
+        self.useFixture(fixtures.EnvironmentVariable('PATH', '/bin'))
+        config = project_loader.Config()
+
+        env = config.parts.build_env_dict_for_part(
+            config.parts.get_part('top'))
+
+        self.assertEqual(
+            os.path.join(self.parts_dir, 'top', 'install'),
+            env['SNAPCRAFT_PART_INSTALL'])
+        self.assertTrue(env['PATH'].endswith(':/bin'))
+
 
 class ValidationBaseTestCase(tests.TestCase):
 
@@ -15,10 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import fixtures
+import hashlib
 import logging
 import os
 import stat
 import tempfile
+from concurrent import futures
 from unittest.mock import ANY, call, patch, MagicMock
 from testtools.matchers import (
     Contains,
@@ -27,9 +29,10 @@ from testtools.matchers import (
 )
 
 import snapcraft
-from snapcraft import repo
+from snapcraft import file_utils, repo
 from snapcraft import tests
-from snapcraft.internal import errors
+from snapcraft.internal import cache, errors
+from snapcraft.tests.fake_debs import make_deb
 
 
 class RepoBaseTestCase(tests.TestCase):
@@ -58,6 +61,8 @@ class UbuntuTestCase(RepoBaseTestCase):
 
         self.mock_package = MagicMock()
         self.mock_package.candidate.fetch_binary.side_effect = _fetch_binary
+        # Without a URI, packages are fetched through apt.
+        self.mock_package.candidate.uri = None
         self.mock_cache.return_value.get_changes.return_value = [
             self.mock_package]
 
@@ -239,7 +244,9 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
         os.symlink('1', self.tempdir + '/rel-to-1')
         os.symlink('/1', self.tempdir + '/abs-to-1')
 
-        repo._fix_artifacts(debdir=self.tempdir)
+        repo._fix_unpacked(self.tempdir, [
+            'a', '1', 'rel-to-a', 'abs-to-a', 'abs-to-b', 'rel-to-1',
+            'abs-to-1'])
 
         self.assertEqual(os.readlink(self.tempdir + '/rel-to-a'), 'a')
         self.assertEqual(os.readlink(self.tempdir + '/abs-to-a'), 'a')
@@ -263,7 +270,7 @@ deb http://ports.ubuntu.com/ubuntu-ports trusty-security multiverse
             f.write('Cflags: -I${includedir}/granite\n')
             f.write('Requires: cairo gee-0.8 glib-2.0 gio-unix-2.0 '
                     'gobject-2.0\n')
-        repo._fix_artifacts(debdir=self.tempdir)
+        repo._fix_unpacked(self.tempdir, ['granite.pc'])
 
         with open(pc_file) as f:
             pc_file_content = f.read()
@@ -282,6 +289,355 @@ Requires: cairo gee-0.8 glib-2.0 gio-unix-2.0 gobject-2.0
 
         self.assertEqual(pc_file_content, expected_pc_file_content)
 
+    def test_fix_pkg_config_from_several_threads(self):
+        pc_files = []
+        for i in range(20):
+            pc_file = os.path.join(self.tempdir, 'lib{}.pc'.format(i))
+            with open(pc_file, 'w') as f:
+                f.write('prefix=/usr\nlibdir=${prefix}/lib\n')
+            pc_files.append(pc_file)
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda pc_file: repo.fix_pkg_config('/root', pc_file),
+                pc_files))
+
+        for pc_file in pc_files:
+            with open(pc_file) as f:
+                self.assertEqual('prefix=/root/usr\nlibdir=${prefix}/lib\n',
+                                 f.read())
+
+    def test_fix_pkg_config_does_not_write_through_links(self):
+        pc_file = os.path.join(self.tempdir, 'granite.pc')
+        linked_file = os.path.join(self.tempdir, 'linked.pc')
+        with open(pc_file, 'w') as f:
+            f.write('prefix=/usr\n')
+        os.chmod(pc_file, 0o640)
+        os.link(pc_file, linked_file)
+
+        repo.fix_pkg_config('/root', pc_file)
+
+        with open(pc_file) as f:
+            self.assertEqual('prefix=/root/usr\n', f.read())
+        with open(linked_file) as f:
+            self.assertEqual('prefix=/usr\n', f.read())
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(pc_file).st_mode))
+
+    def test_unpack(self):
+        ubuntu = repo.Ubuntu(self.tempdir)
+        download = os.path.join(self.tempdir, 'download')
+        make_deb(os.path.join(download, 'a.deb'), [
+            ('usr', 'dir', 0o755, None),
+            ('usr/bin', 'dir', 0o755, None),
+            ('usr/bin/tool', 'file', 0o755, b'#!/usr/bin/python\n'),
+            ('usr/bin/su', 'file', 0o4755, b''),
+            ('usr/lib', 'dir', 0o755, None),
+            ('usr/lib/tool', 'symlink', 0o777, '/usr/bin/tool'),
+            ('usr/lib/foo.pc', 'file', 0o644, b'prefix=/usr\n'),
+            ('usr/share', 'dir', 0o755, None),
+            ('usr/share/shared', 'file', 0o644, b'a'),
+        ])
+        make_deb(os.path.join(download, 'b.deb'), [
+            ('usr', 'dir', 0o755, None),
+            ('usr/share', 'dir', 0o755, None),
+            ('usr/share/shared', 'file', 0o644, b'b'),
+        ])
+        unpack_dir = os.path.join(self.tempdir, 'install')
+
+        ubuntu.unpack(unpack_dir)
+
+        def path(*parts):
+            return os.path.join(unpack_dir, 'usr', *parts)
+        # The last package wins.
+        self.assertThat(path('share', 'shared'), FileContains('b'))
+        self.assertThat(path('bin', 'tool'),
+                        FileContains('#!/usr/bin/env python\n'))
+        self.assertEqual(stat.S_IMODE(os.stat(path('bin', 'su')).st_mode),
+                         0o755)
+        self.assertEqual(os.readlink(path('lib', 'tool')), '../bin/tool')
+        self.assertThat(path('lib', 'foo.pc'),
+                        FileContains('prefix={}/usr\n'.format(unpack_dir)))
+
+    def test_unpack_copies_from_the_unpacked_cache(self):
+        ubuntu = repo.Ubuntu(self.tempdir)
+        deb_file = os.path.join(self.tempdir, 'download', 'a.deb')
+        make_deb(deb_file, [
+            ('usr', 'dir', 0o755, None),
+            ('usr/bin', 'dir', 0o755, None),
+            ('usr/bin/xml2-config', 'file', 0o755, b'prefix=/usr\n'),
+            ('usr/lib', 'dir', 0o755, None),
+            ('usr/lib/libfoo.so', 'file', 0o644, b'library'),
+            ('usr/lib/foo.pc', 'file', 0o644, b'prefix=/usr\n'),
+        ])
+        first = os.path.join(self.tempdir, 'first')
+        second = os.path.join(self.tempdir, 'second')
+
+        ubuntu.unpack(first)
+        with patch('snapcraft.internal.deb.extract') as mock_extract:
+            ubuntu.unpack(second)
+
+        mock_extract.assert_not_called()
+        self.assertFalse(os.path.samefile(
+            os.path.join(first, 'usr', 'lib', 'libfoo.so'),
+            os.path.join(second, 'usr', 'lib', 'libfoo.so')))
+        self.assertThat(os.path.join(second, 'usr', 'lib', 'libfoo.so'),
+                        FileContains('library'))
+        for root in (first, second):
+            self.assertThat(
+                os.path.join(root, 'usr', 'lib', 'foo.pc'),
+                FileContains('prefix={}/usr\n'.format(root)))
+            self.assertThat(
+                os.path.join(root, 'usr', 'bin', 'xml2-config'),
+                FileContains('prefix={}/usr\n'.format(root)))
+        # What is fixed for a root is not changed in the cache.
+        tree, _ = cache.UnpackedStagePackageCache().get(
+            digest=file_utils.calculate_sha256(deb_file))
+        for member in ('usr/lib/foo.pc', 'usr/bin/xml2-config'):
+            self.assertThat(os.path.join(tree, member),
+                            FileContains('prefix=/usr\n'))
+
+    def test_changing_unpacked_files_leaves_the_cache_unchanged(self):
+        ubuntu = repo.Ubuntu(self.tempdir)
+        deb_file = os.path.join(self.tempdir, 'download', 'a.deb')
+        make_deb(deb_file, [
+            ('usr', 'dir', 0o755, None),
+            ('usr/lib', 'dir', 0o755, None),
+            ('usr/lib/libfoo.so', 'file', 0o644, b'library'),
+        ])
+        unpack_dir = os.path.join(self.tempdir, 'install')
+        ubuntu.unpack(unpack_dir)
+
+        # Like the plugins rewriting the files of their installdir.
+        path = os.path.join(unpack_dir, 'usr', 'lib', 'libfoo.so')
+        with open(path, 'r+') as f:
+            f.write('changed')
+        os.chmod(path, 0o600)
+
+        tree, _ = cache.UnpackedStagePackageCache().get(
+            digest=file_utils.calculate_sha256(deb_file))
+        cached = os.path.join(tree, 'usr', 'lib', 'libfoo.so')
+        self.assertThat(cached, FileContains('library'))
+        self.assertEqual(stat.S_IMODE(os.stat(cached).st_mode), 0o644)
+
+    def test_unpack_records_the_use_of_the_unpacked_cache(self):
+        ubuntu = repo.Ubuntu(self.tempdir)
+        make_deb(os.path.join(self.tempdir, 'download', 'a.deb'),
+                 [('usr', 'dir', 0o755, None)])
+
+        ubuntu.unpack(os.path.join(self.tempdir, 'first'))
+        ubuntu.unpack(os.path.join(self.tempdir, 'second'))
+
+        stats = {s.kind: s for s in cache.CacheManager().get_stats()}
+        unpacked = stats['unpacked-stage-packages']
+        self.assertEqual((unpacked.entries, unpacked.hits, unpacked.misses),
+                         (1, 1, 1))
+
+    def test_unpack_error(self):
+        ubuntu = repo.Ubuntu(self.tempdir)
+        with open(os.path.join(self.tempdir, 'download', 'a.deb'), 'w') as f:
+            f.write('not a deb')
+
+        raised = self.assertRaises(repo.UnpackError, ubuntu.unpack,
+                                   os.path.join(self.tempdir, 'install'))
+
+        self.assertEqual(raised.package_name,
+                         os.path.join(self.tempdir, 'download', 'a.deb'))
+
+
+class ArchiveTestCase(RepoBaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('snapcraft.repo.apt.Cache')
+        self.mock_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('snapcraft.repo.apt.apt_pkg')
+        self.mock_apt_pkg = patcher.start()
+        self.addCleanup(patcher.stop)
+        # No proxies, credentials or TLS settings.
+        self.mock_apt_pkg.config.exists.return_value = False
+        self.mock_apt_pkg.config.find_file.return_value = ''
+        self.mock_apt_pkg.config.find_dir.return_value = ''
+
+        self.fetch_failures = []
+
+        def _fetch_binary(download_dir, **kwargs):
+            if self.fetch_failures:
+                raise self.fetch_failures.pop()
+            path = os.path.join(download_dir, 'fake-package.deb')
+            open(path, 'w').close()
+            return path
+
+        mock_package = MagicMock()
+        mock_package.candidate.fetch_binary.side_effect = _fetch_binary
+        mock_package.candidate.uri = None
+        self.mock_cache.return_value.get_changes.return_value = [
+            mock_package]
+
+        self.project_options = snapcraft.ProjectOptions(use_geoip=False)
+
+    def _updates(self):
+        return self.mock_cache.return_value.update.call_count
+
+    def test_archive_is_opened_once(self):
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+        ubuntu.is_valid('fake-package')
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(self.mock_cache.call_count, 1)
+        self.assertEqual(self._updates(), 1)
+        # Marks do not carry over from one use to the next.
+        self.assertEqual(self.mock_cache.return_value.clear.call_count, 2)
+
+    def test_fresh_indexes_are_not_updated(self):
+        repo.Ubuntu(self.tempdir, project_options=self.project_options).get(
+            ['fake-package'])
+        repo.close_archive()
+
+        repo.Ubuntu(self.tempdir, project_options=self.project_options).get(
+            ['fake-package'])
+
+        self.assertEqual(self.mock_cache.call_count, 2)
+        self.assertEqual(self._updates(), 1)
+
+    def test_stale_indexes_are_updated(self):
+        self.useFixture(fixtures.EnvironmentVariable(
+            'SNAPCRAFT_APT_INDEX_TTL', '0'))
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+        ubuntu.get(['fake-package'])
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(self._updates(), 2)
+
+    def test_fetch_failure_updates_fresh_indexes(self):
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+        ubuntu.is_valid('fake-package')
+        # As if the indexes had been updated by an earlier run.
+        repo._updated_archives.clear()
+        self.fetch_failures.append(repo.apt.cache.FetchFailedException())
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(self._updates(), 2)
+
+    def test_fetch_failure_after_update_is_raised(self):
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+        self.fetch_failures.append(repo.apt.cache.FetchFailedException())
+
+        self.assertRaises(repo.apt.cache.FetchFailedException,
+                          ubuntu.get, ['fake-package'])
+        self.assertEqual(self._updates(), 1)
+
+    def test_get_packages_solves_against_one_archive(self):
+        ubuntus = [repo.Ubuntu(os.path.join(self.tempdir, name),
+                               project_options=self.project_options)
+                   for name in ('part1', 'part2')]
+        mock_package, = self.mock_cache.return_value.get_changes()
+
+        pkg_lists = repo.get_packages(
+            [(ubuntus[0], {'fake-package'}), (ubuntus[1], {'other'})])
+
+        self.assertEqual(pkg_lists, [[str(mock_package.candidate)]] * 2)
+        self.assertEqual(self.mock_cache.call_count, 1)
+        self.assertEqual(self._updates(), 1)
+        self.assertEqual(
+            mock_package.candidate.fetch_binary.call_count, 1)
+        for name in ('part1', 'part2'):
+            self.assertTrue(os.path.exists(os.path.join(
+                self.tempdir, name, 'download', 'fake-package.deb')))
+
+    def test_get_packages_leaves_out_missing_packages(self):
+        def _getitem(name):
+            if name == 'missing':
+                raise KeyError(name)
+            return MagicMock()
+        self.mock_cache.return_value.__getitem__.side_effect = _getitem
+        ubuntus = [repo.Ubuntu(os.path.join(self.tempdir, name),
+                               project_options=self.project_options)
+                   for name in ('part1', 'part2')]
+
+        pkg_lists = repo.get_packages(
+            [(ubuntus[0], {'fake-package'}), (ubuntus[1], {'missing'})])
+
+        self.assertEqual(len(pkg_lists[0]), 1)
+        self.assertIsNone(pkg_lists[1])
+
+    def _archive_package(self, contents):
+        os.makedirs('archive', exist_ok=True)
+        path = os.path.abspath(os.path.join('archive', 'fake-package.deb'))
+        with open(path, 'wb') as f:
+            f.write(contents)
+        mock_package, = self.mock_cache.return_value.get_changes()
+        candidate = mock_package.candidate
+        candidate.uri = 'file://{}'.format(path)
+        candidate.filename = 'pool/main/f/fake-package.deb'
+        candidate.size = len(contents)
+        candidate.sha256 = hashlib.sha256(b'package').hexdigest()
+        return candidate
+
+    def test_get_downloads_with_the_fetcher(self):
+        candidate = self._archive_package(b'package')
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+
+        ubuntu.get(['fake-package'])
+
+        candidate.fetch_binary.assert_not_called()
+        with open(os.path.join(self.tempdir, 'download',
+                               'fake-package.deb'), 'rb') as f:
+            self.assertEqual(f.read(), b'package')
+
+    def test_get_with_an_apt_proxy_downloads_with_apt(self):
+        candidate = self._archive_package(b'package')
+        self.mock_apt_pkg.config.exists.side_effect = (
+            lambda option: option == 'Acquire::http::Proxy')
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(candidate.fetch_binary.call_count, 1)
+
+    def test_get_with_apt_credentials_downloads_with_apt(self):
+        candidate = self._archive_package(b'package')
+        auth_file = os.path.join(self.tempdir, 'auth.conf')
+        with open(auth_file, 'w') as f:
+            f.write('machine example.com login user password secret\n')
+        self.mock_apt_pkg.config.find_file.return_value = auth_file
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(candidate.fetch_binary.call_count, 1)
+
+    def test_get_checksum_mismatch_falls_back_to_apt(self):
+        candidate = self._archive_package(b'corrupt')
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(candidate.fetch_binary.call_count, 1)
+        self.assertEqual(self._updates(), 1)
+
+    def test_get_checksum_mismatch_updates_fresh_indexes(self):
+        self._archive_package(b'corrupt')
+        ubuntu = repo.Ubuntu(self.tempdir,
+                             project_options=self.project_options)
+        ubuntu.is_valid('fake-package')
+        repo._updated_archives.clear()
+        # apt fails to download it too.
+        self.fetch_failures.append(repo.apt.cache.FetchFailedException())
+
+        ubuntu.get(['fake-package'])
+
+        self.assertEqual(self._updates(), 2)
+
 
 class FixSUIDTestCase(RepoBaseTestCase):
 
@@ -302,7 +658,7 @@ class FixSUIDTestCase(RepoBaseTestCase):
         open(file, mode='w').close()
         os.chmod(file, self.test_mod)
 
-        repo._fix_artifacts(debdir=self.tempdir)
+        repo._fix_member(file, self.key)
         self.assertEqual(
             stat.S_IMODE(os.stat(file).st_mode), self.expected_mod)
 
@@ -347,7 +703,8 @@ class FixShebangTestCase(RepoBaseTestCase):
         with open(self.file_path, 'w') as fd:
             fd.write(self.content)
 
-        repo._fix_shebangs('root')
+        repo._fix_member(self.file_path,
+                         os.path.relpath(self.file_path, 'root'))
 
         with open(self.file_path, 'r') as fd:
             self.assertEqual(fd.read(), self.expected)
@@ -429,7 +786,8 @@ class FixXmlToolsTestCase(RepoBaseTestCase):
             with open(path, 'w') as f:
                 f.write(test_file['content'])
 
-        repo._fix_xml_tools('root')
+        repo._fix_unpacked(
+            'root', [os.path.relpath(f['path'], 'root') for f in self.files])
 
         for test_file in self.files:
             self.assertThat(
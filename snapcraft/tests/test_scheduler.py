@@ -0,0 +1,124 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from snapcraft.internal import errors
+from snapcraft.internal.scheduler import Scheduler
+from snapcraft import tests
+
+
+class SchedulerTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lock = threading.Lock()
+        self.ran = []
+        self.running = 0
+        self.max_running = 0
+
+    def record(self, node):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+            self.ran.append(node)
+
+    def test_requirements_run_first(self):
+        scheduler = Scheduler(jobs=4)
+        scheduler.add('c', requires=['a', 'b'])
+        scheduler.add('a')
+        scheduler.add('b', requires=['a'])
+        scheduler.add('d', requires=['c'])
+
+        scheduler.run(self.record)
+
+        self.assertEqual(['a', 'b', 'c', 'd'], self.ran)
+
+    def test_requirements_not_in_graph_are_ignored(self):
+        scheduler = Scheduler(jobs=2)
+        scheduler.add('a', requires=['already-done'])
+
+        scheduler.run(self.record)
+
+        self.assertEqual(['a'], self.ran)
+
+    def test_independent_nodes_run_concurrently(self):
+        scheduler = Scheduler(jobs=3)
+        for node in range(6):
+            scheduler.add(node)
+
+        scheduler.run(self.record)
+
+        self.assertEqual(set(range(6)), set(self.ran))
+        self.assertEqual(3, self.max_running)
+
+    def test_single_job_runs_in_order_added(self):
+        scheduler = Scheduler(jobs=1)
+        for node in ['b', 'a', 'c']:
+            scheduler.add(node)
+
+        scheduler.run(self.record)
+
+        self.assertEqual(['b', 'a', 'c'], self.ran)
+        self.assertEqual(1, self.max_running)
+
+    def test_error_stops_scheduling(self):
+        def run(node):
+            if node == 'a':
+                raise RuntimeError('failed {}'.format(node))
+            self.record(node)
+
+        scheduler = Scheduler(jobs=2)
+        scheduler.add('a')
+        scheduler.add('b', requires=['a'])
+
+        raised = self.assertRaises(RuntimeError, scheduler.run, run)
+
+        self.assertEqual('failed a', str(raised))
+        self.assertEqual([], self.ran)
+
+    def test_running_nodes_finish_on_error(self):
+        def run(node):
+            if node == 'a':
+                raise RuntimeError('failed')
+            self.record(node)
+
+        scheduler = Scheduler(jobs=2)
+        scheduler.add('b')
+        scheduler.add('a')
+        scheduler.add('c', requires=['b'])
+
+        self.assertRaises(RuntimeError, scheduler.run, run)
+
+        self.assertEqual(['b'], self.ran)
+
+    def test_cycle(self):
+        scheduler = Scheduler(jobs=2)
+        scheduler.add('a')
+        scheduler.add('b', requires=['a', 'c'])
+        scheduler.add('c', requires=['b'])
+
+        raised = self.assertRaises(
+            errors.SchedulerCycleError, scheduler.run, self.record)
+
+        self.assertEqual(['a'], self.ran)
+        self.assertEqual(
+            "Circular dependency chain found between: ['b', 'c']",
+            str(raised))
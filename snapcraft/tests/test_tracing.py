@@ -0,0 +1,98 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright (C) 2017 Canonical Ltd
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import subprocess
+
+from snapcraft.internal import tracing
+from snapcraft import tests
+
+
+class TracingTestCase(tests.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tracing.start()
+        self.addCleanup(tracing.stop)
+
+    def test_spans_are_not_recorded_unless_started(self):
+        tracing.stop()
+
+        with tracing.span('build', category='step', part='part1'):
+            tracing.count('bytes', 1)
+
+        self.assertFalse(tracing.is_enabled())
+
+    def test_span(self):
+        with tracing.span('build', category='step', part='part1'):
+            subprocess.check_call(['true'])
+
+        event, = tracing.stop().events
+        self.assertEqual('build', event['name'])
+        self.assertEqual('step', event['cat'])
+        self.assertEqual('X', event['ph'])
+        self.assertEqual('part1', event['args']['part'])
+        self.assertGreater(event['dur'], 0)
+        self.assertGreaterEqual(event['args']['cpu'], 0)
+
+    def test_count_adds_to_all_open_spans(self):
+        with tracing.span('stage', category='step', part='part1'):
+            with tracing.span('migrate files', category='phase',
+                              part='part1'):
+                tracing.count('bytes', 10)
+            tracing.count('bytes', 5)
+
+        phase, step = tracing.stop().events
+        self.assertEqual(10, phase['args']['bytes'])
+        self.assertEqual(15, step['args']['bytes'])
+
+    def test_write(self):
+        with tracing.span('pull', category='step', part='part1'):
+            pass
+
+        tracer = tracing.stop()
+        tracer.write('trace.json')
+
+        with open('trace.json') as trace_file:
+            trace = json.load(trace_file)
+        self.assertEqual(tracer.events, trace['traceEvents'])
+
+    def test_summary_is_sorted_by_wall_time(self):
+        tracer = tracing.stop()
+        for part, step, duration in [('part1', 'pull', 1000),
+                                     ('part2', 'build', 3000000),
+                                     ('part1', 'build', 2000000)]:
+            tracer._events.append({
+                'name': step, 'cat': 'step', 'dur': duration,
+                'args': {'part': part, 'cpu': 0.5}})
+        for duration in [1000000, 500000]:
+            tracer._events.append({
+                'name': 'copytree', 'cat': 'phase', 'dur': duration,
+                'args': {'part': 'part1', 'cpu': 0, 'bytes': 2}})
+
+        steps, phases = tracer.summary().split('\n\n')
+        self.assertEqual(
+            [['Part', 'Step', 'Wall', '(s)', 'Child', 'CPU', '(s)', 'Written',
+              '(bytes)'],
+             ['part2', 'build', '3.000', '0.500', '0'],
+             ['part1', 'build', '2.000', '0.500', '0'],
+             ['part1', 'pull', '0.001', '0.500', '0']],
+            [line.split() for line in steps.splitlines()])
+        self.assertEqual(
+            [['Phase', 'Wall', '(s)', 'Child', 'CPU', '(s)', 'Written',
+              '(bytes)'],
+             ['copytree', '1.500', '0.000', '4']],
+            [line.split() for line in phases.splitlines()])